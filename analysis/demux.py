@@ -0,0 +1,224 @@
+"""
+【PCAP Demux】
+單次走訪 (mmap) 把 Worker 的 pcap 依容器 IP 與應用協定拆成多個 pcap，取代對同一個檔案反覆跑 N 次 tcpdump filter。
+
+- 每批 (預設 1M 封包) 以 NumPy 解出位址 / 埠號，向量化分組後每個輸出檔一次寫入整批封包 (相鄰 record 合併成一段)
+- 容器 IP：端點位於 CONTAINER_NET (預設 Docker Swarm 的 Overlay 位址池 10.0.0.0/8) 的封包寫入該 IP 的檔案，
+  兩端都是容器時兩個檔案都會收到；Overlay 流量以 VXLAN 封裝，依內層位址判斷
+  (對外的網頁流量經過 docker_gwbridge NAT，在 Worker 網卡上只看得到主機 IP)
+- 協定：依 TCP / UDP 埠號分類 (HTTP、HTTPS、SMTP、FTP、SSH、SMB、DNS)，包含 stack 內靶機使用的非標準埠
+- 輸出保留原檔頭與原始封包內容 (VXLAN 封包仍是封裝後的樣子)：
+      <out>/<檔名>/ip/<位址>.pcap
+      <out>/<檔名>/proto/<協定>.pcap
+- 多個檔案以 ProcessPool 平行處理；每個檔案先寫到暫存目錄，完成後才改名，中斷不會留下不完整的結果
+
+用法:
+    python demux.py                                   # 處理 DATA_LAKE_DIR 下所有 round*.pcap (已是最新的會略過)
+    python demux.py a.pcap b.pcap --out /data/demux --container-net 10.0.1.0/24 --jobs 8
+"""
+
+import argparse
+import glob
+import ipaddress
+import logging
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pcap_reader import PROTO_TCP, PROTO_UDP, PcapFile, format_ips
+
+DATA_LAKE_DIR = os.getenv('DATA_LAKE_DIR', "/mnt/d/Traffic_Data")
+CONTAINER_NET = os.getenv('CONTAINER_NET', "10.0.0.0/8")
+DEFAULT_BATCH = 1 << 20
+WRITE_BUFFER = 1 << 18  # 每批已依輸出檔分組，緩衝區只需吸收零碎的小段 (同時開啟的檔案可能上百個)
+
+# 協定 -> {L4 協定: 埠號}；client / server 任一端符合即歸類
+PROTOCOL_PORTS = {
+    "http": {PROTO_TCP: (80, 8080, 8025)},                           # 8025: MailHog Web UI
+    "https": {PROTO_TCP: (443, 8443), PROTO_UDP: (443,)},            # UDP 443: QUIC
+    "smtp": {PROTO_TCP: (25, 465, 587, 1025)},                       # 1025: MailHog SMTP
+    "ftp": {PROTO_TCP: (20, 21) + tuple(range(21100, 21111))},       # 21100-21110: vsftpd 被動模式資料連線
+    "ssh": {PROTO_TCP: (22, 2222)},                                  # 2222: ssh-target
+    "smb": {PROTO_TCP: (139, 445), PROTO_UDP: (137, 138)},
+    "dns": {PROTO_TCP: (53,), PROTO_UDP: (53, 5353)},
+}
+PROTOCOLS = tuple(PROTOCOL_PORTS)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+
+def _port_tables():
+    """{L4 協定: 65536 長度的查表 (埠號 -> 協定編號，-1 = 不分類)}"""
+    tables = {}
+    for pid, name in enumerate(PROTOCOLS):
+        for l4, ports in PROTOCOL_PORTS[name].items():
+            table = tables.setdefault(l4, np.full(65536, -1, dtype=np.int8))
+            table[list(ports)] = pid
+    return tables
+
+
+def parse_network(cidr):
+    """CIDR -> (net_hi, net_lo, mask_hi, mask_lo)，與 decode_packets 的位址表示法一致 (IPv4 為 IPv4-mapped)"""
+    net = ipaddress.ip_network(cidr, strict=False)
+    if net.version == 4:
+        base, prefix = (0xFFFF << 32) | int(net.network_address), 96 + net.prefixlen
+    else:
+        base, prefix = int(net.network_address), net.prefixlen
+    mask = ((1 << 128) - 1) ^ ((1 << (128 - prefix)) - 1)
+    split = lambda v: (np.uint64(v >> 64), np.uint64(v & 0xFFFFFFFFFFFFFFFF))
+    return split(base) + split(mask)
+
+
+def classify(cols, tables):
+    """每個封包的協定編號 (-1 = 不屬於任何輸出協定)"""
+    pid = np.full(len(cols["proto"]), -1, dtype=np.int8)
+    for l4, table in tables.items():
+        sel = cols["proto"] == l4
+        if not sel.any(): continue
+        by_dport = table[cols["dport"][sel]]
+        pid[sel] = np.where(by_dport >= 0, by_dport, table[cols["sport"][sel]])
+    return pid
+
+
+class StreamWriter:
+    """單一輸出 pcap：第一次寫入時才建立檔案並寫入原檔頭"""
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.file = None
+        self.packets = 0
+
+    def write(self, view, starts, ends):
+        """寫入一批 record ([starts, ends) 為 record 在來源檔的範圍，已依檔案順序排列)"""
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, "wb", buffering=WRITE_BUFFER)
+            self.file.write(self.header)
+        self.packets += len(starts)
+        breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+        run_starts = starts[np.concatenate([[0], breaks])].tolist()
+        run_ends = ends[np.concatenate([breaks - 1, [len(ends) - 1]])].tolist()
+        self.file.writelines(view[s:e] for s, e in zip(run_starts, run_ends))
+
+    def close(self):
+        if self.file is not None: self.file.close()
+
+
+def _write_groups(view, keys, starts, ends, writer_for):
+    """依 key 分組 (組內維持檔案順序) 後每組一次寫入；keys 為 np.ndarray 或 (hi, lo) tuple"""
+    if len(starts) == 0: return
+    sort_keys = keys if isinstance(keys, tuple) else (keys,)
+    order = np.lexsort((starts,) + tuple(reversed(sort_keys)))
+    sorted_keys = [k[order] for k in sort_keys]
+    changed = np.zeros(len(order) - 1, dtype=bool)
+    for k in sorted_keys:
+        changed |= k[1:] != k[:-1]
+    bounds = np.concatenate([[0], np.flatnonzero(changed) + 1, [len(order)]])
+    s, e = starts[order], ends[order]
+    for i in range(len(bounds) - 1):
+        lo, hi = bounds[i], bounds[i + 1]
+        writer_for(tuple(k[lo] for k in sorted_keys)).write(view, s[lo:hi], e[lo:hi])
+
+
+def output_dir(path, out_dir):
+    return os.path.join(out_dir, os.path.basename(path).rsplit(".", 1)[0])
+
+
+def demux_file(path, out_dir, container_net=CONTAINER_NET, batch_size=DEFAULT_BATCH, vxlan=True):
+    """拆分單一 pcap，回傳 (path, packets, {輸出相對路徑: 封包數}, seconds)"""
+    start = time.time()
+    dst = output_dir(path, out_dir)
+    tmp = dst + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    net_hi, net_lo, mask_hi, mask_lo = parse_network(container_net)
+    tables = _port_tables()
+    writers = {}
+    packets = 0
+
+    with PcapFile(path) as pcap:
+        header = bytes(pcap.mm[:24])
+        view = memoryview(pcap.mm)
+
+        def proto_writer(key):
+            name = PROTOCOLS[key[0]]
+            if name not in writers: writers[name] = StreamWriter(os.path.join(tmp, "proto", f"{name}.pcap"), header)
+            return writers[name]
+
+        def ip_writer(key):
+            if key not in writers:
+                addr = format_ips(np.array([key[0]]), np.array([key[1]]))[0]
+                writers[key] = StreamWriter(os.path.join(tmp, "ip", f"{addr.replace(':', '_')}.pcap"), header)
+            return writers[key]
+
+        try:
+            for offsets in pcap.record_offsets(batch_size):
+                packets += len(offsets)
+                cols = pcap.decode(offsets, vxlan=vxlan)
+                ends = offsets + 16 + cols["caplen"]
+
+                pid = classify(cols, tables)
+                sel = pid >= 0
+                _write_groups(view, pid[sel], offsets[sel], ends[sel], proto_writer)
+
+                ip = cols["proto"] >= 0
+                src_in = ip & ((cols["src_hi"] & mask_hi) == net_hi) & ((cols["src_lo"] & mask_lo) == net_lo)
+                dst_in = ip & ((cols["dst_hi"] & mask_hi) == net_hi) & ((cols["dst_lo"] & mask_lo) == net_lo)
+                dst_in &= ~(src_in & (cols["src_hi"] == cols["dst_hi"]) & (cols["src_lo"] == cols["dst_lo"]))
+                hi = np.concatenate([cols["src_hi"][src_in], cols["dst_hi"][dst_in]])
+                lo = np.concatenate([cols["src_lo"][src_in], cols["dst_lo"][dst_in]])
+                _write_groups(view, (hi, lo), np.concatenate([offsets[src_in], offsets[dst_in]]),
+                              np.concatenate([ends[src_in], ends[dst_in]]), ip_writer)
+        finally:
+            for writer in writers.values(): writer.close()
+            view.release()
+
+    shutil.rmtree(dst, ignore_errors=True)
+    os.makedirs(tmp, exist_ok=True)
+    os.replace(tmp, dst)
+    streams = {os.path.relpath(w.path, tmp): w.packets for w in writers.values()}
+    return path, packets, streams, time.time() - start
+
+
+def is_up_to_date(path, out_dir):
+    dst = output_dir(path, out_dir)
+    return os.path.isdir(dst) and os.path.getmtime(dst) >= os.path.getmtime(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split captures into per-container-IP and per-protocol pcaps in one pass")
+    parser.add_argument("inputs", nargs="*", help="pcap 檔案 (預設: DATA_LAKE_DIR/round*.pcap)")
+    parser.add_argument("--out", default=os.path.join(DATA_LAKE_DIR, "demux"), help="輸出目錄")
+    parser.add_argument("--container-net", default=CONTAINER_NET, help="容器位址範圍 (CIDR)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="平行處理的檔案數")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="每批解析的封包數")
+    parser.add_argument("--no-vxlan", action="store_true", help="不拆開 VXLAN (Docker Overlay) 封裝")
+    parser.add_argument("--force", action="store_true", help="即使輸出已是最新也重新處理")
+    args = parser.parse_args()
+
+    inputs = args.inputs or sorted(glob.glob(os.path.join(DATA_LAKE_DIR, "round*.pcap")))
+    todo = [p for p in inputs if args.force or not is_up_to_date(p, args.out)]
+    logging.info(f"[Demux] {len(todo)}/{len(inputs)} captures to split (jobs={args.jobs})")
+    if not todo: return 0
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(todo)))) as pool:
+        futures = {pool.submit(demux_file, p, args.out, args.container_net, args.batch, not args.no_vxlan): p for p in todo}
+        for future, path in futures.items():
+            try:
+                _, packets, streams, seconds = future.result()
+                n_ip = sum(1 for name in streams if name.startswith("ip"))
+                logging.info(f"[Demux] {os.path.basename(path)}: {packets} packets -> {n_ip} container IPs, "
+                             f"{len(streams) - n_ip} protocols ({seconds:.1f}s)")
+            except Exception as e:
+                failed += 1
+                logging.error(f"[Demux] {os.path.basename(path)} failed: {e}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+【PCAP -> Flow 特徵萃取】
+將 Data Lake 中的 round{N}_{timestamp}_{host}.pcap 轉為雙向 Flow 紀錄 (Parquet)，作為非監督式 IDS 模型的訓練資料。
+
+- 封包以 pcap_reader 的 mmap + NumPy 批次解析，每批 (預設 1M 封包) 直接向量化聚合成「部分 Flow」
+- 部分 Flow 累積到一定數量就再合併一次；閒置超過 idle timeout 的 Flow 已不可能再延續，合併時直接寫出 Parquet，
+  之後只合併仍在進行中的 Flow，記憶體用量與處理時間只與同時進行中的 Flow 數有關，與檔案大小無關
+- Flow 以 5-tuple (不分方向) + idle timeout 切分；發起端 = 該 Flow 第一個封包的來源
+- 多個檔案以 ProcessPool 平行處理；輸出依 round / worker 分割：
+      <out>/round=<N>/worker=<host>/<檔名>.parquet
+
+用法:
+    python extract_flows.py                       # 處理 DATA_LAKE_DIR 下所有 round*.pcap (已是最新的會略過)
+    python extract_flows.py a.pcap b.pcap --out /data/flows --jobs 8
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pcap_reader import PcapFile, canonical_keys, format_ips, parse_capture_name, unpack_proto_ports
+
+DATA_LAKE_DIR = os.getenv('DATA_LAKE_DIR', "/mnt/d/Traffic_Data")
+DEFAULT_IDLE_TIMEOUT = 120.0
+DEFAULT_BATCH = 1 << 20
+COMPACT_ROWS = 2_000_000  # 部分 Flow 超過此數量就先合併並寫出已結束的 Flow，限制記憶體
+
+KEY_COLS = ("proto_ports", "a_hi", "a_lo", "b_hi", "b_lo")
+SUM_COLS = ("n_fwd", "n_bwd", "bytes_fwd", "bytes_bwd", "payload_fwd", "payload_bwd", "len_sumsq",
+            "syn", "fin", "rst", "psh", "ack")
+TCP_FLAG_BITS = {"fin": 0x01, "syn": 0x02, "rst": 0x04, "psh": 0x08, "ack": 0x10}
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+
+def packets_to_partials(cols):
+    """每個封包視為只有一個封包的部分 Flow (之後與其他部分 Flow 走同一套合併流程)"""
+    ip = cols["proto"] >= 0
+    c = {k: v[ip] for k, v in cols.items()}
+    keys, swap = canonical_keys(c)
+    fwd = ~swap
+    length = c["wirelen"].astype(np.int64)
+    flags = c["tcp_flags"]
+    p = dict(keys)
+    p.update({
+        "first_ns": c["ts_ns"],
+        "last_ns": c["ts_ns"],
+        "first_dir": swap.astype(np.int8),
+        "n_fwd": fwd.astype(np.int64),
+        "n_bwd": swap.astype(np.int64),
+        "bytes_fwd": np.where(fwd, length, 0),
+        "bytes_bwd": np.where(swap, length, 0),
+        "payload_fwd": np.where(fwd, c["payload"], 0),
+        "payload_bwd": np.where(swap, c["payload"], 0),
+        "len_sumsq": (length * length).astype(np.float64),
+        "len_min": length,
+        "len_max": length,
+        "iat_sum": np.zeros(len(length)),
+        "iat_sumsq": np.zeros(len(length)),
+        "iat_min": np.full(len(length), np.inf),
+        "iat_max": np.full(len(length), -np.inf),
+        "flags_or": flags,
+    })
+    for name, bit in TCP_FLAG_BITS.items():
+        p[name] = ((flags & bit) != 0).astype(np.int64)
+    return p
+
+
+def concat_partials(parts):
+    if len(parts) == 1: return parts[0]
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+
+def split_partials(p, mask):
+    """依 mask 拆成 (符合, 不符合) 兩組部分 Flow"""
+    return {k: v[mask] for k, v in p.items()}, {k: v[~mask] for k, v in p.items()}
+
+
+def reduce_partials(p, idle_ns):
+    """
+    合併部分 Flow：依 key + 起始時間排序，同 key 且間隔不超過 idle timeout 的相鄰列視為同一個 Flow。
+    相鄰部分之間的間隔本身也是一個 inter-arrival，一併計入 IAT 統計。
+    """
+    n = len(p["first_ns"])
+    if n == 0: return p
+    order = np.lexsort((p["first_ns"],) + tuple(p[k] for k in reversed(KEY_COLS)))
+    q = {k: v[order] for k, v in p.items()}
+
+    same_key = np.ones(n - 1, dtype=bool)
+    for k in KEY_COLS:
+        same_key &= q[k][1:] == q[k][:-1]
+    gap_ns = np.maximum(q["first_ns"][1:] - q["last_ns"][:-1], 0)
+    cont = np.concatenate([[False], same_key & (gap_ns <= idle_ns)])
+    gap = np.concatenate([[0.0], gap_ns / 1e9])
+    starts = np.flatnonzero(~cont)
+
+    out = {k: q[k][starts] for k in KEY_COLS + ("first_ns", "first_dir")}
+    for k in SUM_COLS:
+        out[k] = np.add.reduceat(q[k], starts)
+    out["last_ns"] = np.maximum.reduceat(q["last_ns"], starts)
+    out["len_min"] = np.minimum.reduceat(q["len_min"], starts)
+    out["len_max"] = np.maximum.reduceat(q["len_max"], starts)
+    out["flags_or"] = np.bitwise_or.reduceat(q["flags_or"], starts)
+    boundary = np.where(cont, gap, 0.0)
+    out["iat_sum"] = np.add.reduceat(q["iat_sum"] + boundary, starts)
+    out["iat_sumsq"] = np.add.reduceat(q["iat_sumsq"] + boundary * boundary, starts)
+    out["iat_min"] = np.minimum.reduceat(np.minimum(q["iat_min"], np.where(cont, gap, np.inf)), starts)
+    out["iat_max"] = np.maximum.reduceat(np.maximum(q["iat_max"], np.where(cont, gap, -np.inf)), starts)
+    return out
+
+
+def flows_to_table(f, source):
+    """部分 Flow 狀態 -> 特徵表 (src 一律為發起端)"""
+    flip = f["first_dir"] == 1
+    proto, a_port, b_port = unpack_proto_ports(f["proto_ports"])
+    f = dict(f, proto=proto, a_port=a_port, b_port=b_port)
+    pick = lambda a, b: np.where(flip, f[b], f[a])
+    n = f["n_fwd"] + f["n_bwd"]
+    total_bytes = f["bytes_fwd"] + f["bytes_bwd"]
+    len_mean = total_bytes / n
+    k = n - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iat_mean = np.where(k > 0, f["iat_sum"] / k, 0.0)
+        iat_std = np.where(k > 0, np.sqrt(np.maximum(f["iat_sumsq"] / k - iat_mean ** 2, 0.0)), 0.0)
+
+    columns = {
+        # round / worker 由輸出目錄 (Hive partition) 提供，不重複寫入檔案
+        "source_file": np.full(len(n), source, dtype=object),
+        "start_time": f["first_ns"].astype("datetime64[ns]"),
+        "end_time": f["last_ns"].astype("datetime64[ns]"),
+        "duration": (f["last_ns"] - f["first_ns"]) / 1e9,
+        "proto": f["proto"].astype(np.int16),
+        "src_ip": format_ips(pick("a_hi", "b_hi"), pick("a_lo", "b_lo")),
+        "dst_ip": format_ips(pick("b_hi", "a_hi"), pick("b_lo", "a_lo")),
+        "src_port": pick("a_port", "b_port").astype(np.int32),
+        "dst_port": pick("b_port", "a_port").astype(np.int32),
+        "packets": n,
+        "bytes": total_bytes,
+        "fwd_packets": pick("n_fwd", "n_bwd"),
+        "bwd_packets": pick("n_bwd", "n_fwd"),
+        "fwd_bytes": pick("bytes_fwd", "bytes_bwd"),
+        "bwd_bytes": pick("bytes_bwd", "bytes_fwd"),
+        "fwd_payload": pick("payload_fwd", "payload_bwd"),
+        "bwd_payload": pick("payload_bwd", "payload_fwd"),
+        "pkt_len_mean": len_mean,
+        "pkt_len_std": np.sqrt(np.maximum(f["len_sumsq"] / n - len_mean ** 2, 0.0)),
+        "pkt_len_min": f["len_min"],
+        "pkt_len_max": f["len_max"],
+        "iat_mean": iat_mean,
+        "iat_std": iat_std,
+        "iat_min": np.where(k > 0, f["iat_min"], 0.0),
+        "iat_max": np.where(k > 0, f["iat_max"], 0.0),
+        "tcp_flags": f["flags_or"],
+    }
+    for name in TCP_FLAG_BITS:
+        columns[f"{name}_count"] = f[name]
+    return pa.table(columns)
+
+
+def output_path(path, out_dir):
+    round_id, _, host = parse_capture_name(path)
+    stem = os.path.basename(path).rsplit(".", 1)[0]
+    return os.path.join(out_dir, f"round={round_id or 0}", f"worker={host}", f"{stem}.parquet")
+
+
+def process_file(path, out_dir, idle_timeout=DEFAULT_IDLE_TIMEOUT, batch_size=DEFAULT_BATCH, vxlan=True,
+                 compact_rows=COMPACT_ROWS):
+    """
+    處理單一 pcap，回傳 (path, packets, flows, seconds)
+    [修改] 合併時把最後封包早於「本批最早封包 - idle timeout」的 Flow 直接寫出 (之後的封包不可能再接上)，
+    只保留進行中的 Flow；下一次合併的門檻隨進行中的 Flow 數調整，長連線很多時也不會每批都重新排序全部狀態。
+    """
+    start = time.time()
+    idle_ns = int(idle_timeout * 1e9)
+    source = os.path.basename(path)
+    dst = output_path(path, out_dir)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    writer, flows = None, 0
+
+    def write(f):
+        nonlocal writer, flows
+        table = flows_to_table(f, source)
+        if writer is None: writer = pq.ParquetWriter(dst + ".tmp", table.schema, compression="zstd")
+        writer.write_table(table.cast(writer.schema))
+        flows += table.num_rows
+
+    try:
+        parts, rows, packets, limit = [], 0, 0, compact_rows
+        with PcapFile(path) as pcap:
+            for offsets in pcap.record_offsets(batch_size):
+                packets += len(offsets)
+                part = reduce_partials(packets_to_partials(pcap.decode(offsets, vxlan=vxlan)), idle_ns)
+                if len(part["first_ns"]) == 0: continue
+                parts.append(part)
+                rows += len(part["first_ns"])
+                if rows > limit:
+                    merged = reduce_partials(concat_partials(parts), idle_ns)
+                    done, live = split_partials(merged, merged["last_ns"] < part["first_ns"].min() - idle_ns)
+                    if len(done["first_ns"]): write(done)
+                    parts, rows = [live], len(live["first_ns"])
+                    limit = max(compact_rows, 2 * rows)
+            if not parts:
+                parts = [packets_to_partials(pcap.decode(np.zeros(0, dtype=np.int64), vxlan=vxlan))]
+
+        # 剩下的 Flow (含空檔案時的空表，保留原本「每個 pcap 一定有輸出檔」的行為)
+        write(reduce_partials(concat_partials(parts), idle_ns))
+        writer.close()
+        os.replace(dst + ".tmp", dst)
+    except BaseException:
+        if writer is not None: writer.close()
+        if os.path.exists(dst + ".tmp"): os.remove(dst + ".tmp")
+        raise
+    return path, packets, flows, time.time() - start
+
+
+def is_up_to_date(path, out_dir):
+    dst = output_path(path, out_dir)
+    return os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract bidirectional flow features from pcaps into Parquet")
+    parser.add_argument("inputs", nargs="*", help="pcap 檔案 (預設: DATA_LAKE_DIR/round*.pcap)")
+    parser.add_argument("--out", default=os.path.join(DATA_LAKE_DIR, "flows"), help="Parquet 輸出目錄")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="平行處理的檔案數")
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT, help="Flow 閒置逾時 (秒)")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="每批解析的封包數")
+    parser.add_argument("--no-vxlan", action="store_true", help="不拆開 VXLAN (Docker Overlay) 封裝")
+    parser.add_argument("--force", action="store_true", help="即使輸出已是最新也重新處理")
+    args = parser.parse_args()
+
+    inputs = args.inputs or sorted(glob.glob(os.path.join(DATA_LAKE_DIR, "round*.pcap")))
+    todo = [p for p in inputs if args.force or not is_up_to_date(p, args.out)]
+    logging.info(f"[Flows] {len(todo)}/{len(inputs)} captures to process (jobs={args.jobs})")
+    if not todo: return 0
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(todo)))) as pool:
+        futures = {pool.submit(process_file, p, args.out, args.idle_timeout, args.batch, not args.no_vxlan): p for p in todo}
+        for future, path in futures.items():
+            try:
+                _, packets, flows, seconds = future.result()
+                logging.info(f"[Flows] {os.path.basename(path)}: {packets} packets -> {flows} flows ({seconds:.1f}s)")
+            except Exception as e:
+                failed += 1
+                logging.error(f"[Flows] {os.path.basename(path)} failed: {e}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+【PCAP 時間 / Flow 索引】
+為 Data Lake 中的每個 pcap 建立 sidecar 索引 (<檔名>.pcap.idx.npz)，查詢時直接 seek 到需要的位置，
+不必為了幾分鐘的流量複製或掃描整個數 GB 的檔案。
+
+索引內容：
+- 時間表：每一秒第一個封包的 byte offset (以時間戳的累積最大值計算，少量亂序封包也不會漏掉)
+- Flow 表：不分方向的 5-tuple -> 該 Flow 所有封包的 offset (CSR 格式：flow_ptr + pkt_offset)
+
+用法:
+    python pcap_index.py build                                   # 為 DATA_LAKE_DIR 下所有 round*.pcap 建立 / 更新索引
+    python pcap_index.py slice CAPTURE --start "2026-01-01 12:00:00" --end "2026-01-01 12:05:00" -o out.pcap
+    python pcap_index.py select CAPTURE --host 10.0.0.3 --proto tcp --port 443 -o out.pcap
+    python pcap_index.py flows CAPTURE --host 10.0.0.3            # 列出符合條件的 Flow
+"""
+
+import argparse
+import datetime
+import glob
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pcap_reader import PcapFile, canonical_keys, format_ips, parse_ip, unpack_proto_ports
+
+DATA_LAKE_DIR = os.getenv('DATA_LAKE_DIR', "/mnt/d/Traffic_Data")
+INDEX_SUFFIX = ".idx.npz"
+INDEX_VERSION = 1
+TIME_BUCKET_NS = 1_000_000_000
+FLOW_KEYS = ("proto_ports", "a_hi", "a_lo", "b_hi", "b_lo")
+PROTO_NAMES = {"tcp": 6, "udp": 17, "icmp": 1, "icmpv6": 58}
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+
+def index_path(capture):
+    return capture + INDEX_SUFFIX
+
+
+def _signature(capture):
+    st = os.stat(capture)
+    return st.st_size, st.st_mtime_ns
+
+
+def _unique_keys(cols):
+    """多欄 key 的 unique (lexsort，比 structured array 的 np.unique 快得多)，回傳 ({key: 不重複值}, inverse)"""
+    order = np.lexsort(tuple(cols[k] for k in reversed(FLOW_KEYS)))
+    first = np.ones(len(order), dtype=bool)
+    if len(order) > 1:
+        changed = np.zeros(len(order) - 1, dtype=bool)
+        for k in FLOW_KEYS:
+            col = cols[k][order]
+            changed |= col[1:] != col[:-1]
+        first[1:] = changed
+    inverse = np.empty(len(order), dtype=np.int64)
+    inverse[order] = np.cumsum(first) - 1
+    return {k: cols[k][order[first]] for k in FLOW_KEYS}, inverse
+
+
+def build_index(capture, batch_size=1 << 20, vxlan=True):
+    """建立索引並寫入 sidecar，回傳 (capture, packets, flows, seconds)"""
+    start = time.time()
+    batch_keys, pkt_local, pkt_offset = [], [], []
+    time_sec, time_offset = [], []
+    running_max, last_bucket = np.int64(-1), None
+    packets = 0
+
+    with PcapFile(capture) as pcap:
+        linktype = pcap.linktype
+        for offsets in pcap.record_offsets(batch_size):
+            packets += len(offsets)
+            cols = pcap.decode(offsets, vxlan=vxlan)
+
+            # 時間表：累積最大時間戳跨過新的一秒時記下該封包位移
+            ts_max = np.maximum.accumulate(np.maximum(cols["ts_ns"], running_max))
+            running_max = ts_max[-1]
+            bucket = ts_max // TIME_BUCKET_NS
+            prev = np.concatenate([[last_bucket if last_bucket is not None else -1], bucket[:-1]])
+            new = bucket != prev
+            time_sec.append(bucket[new])
+            time_offset.append(offsets[new])
+            last_bucket = bucket[-1]
+
+            # Flow 表：批次內先取不重複的 key (批次內編號)，全部讀完後再統一對應到全域 flow id
+            ip = cols["proto"] >= 0
+            if not ip.any(): continue
+            keys, _ = canonical_keys({k: v[ip] for k, v in cols.items()})
+            uniq, inverse = _unique_keys(keys)
+            batch_keys.append(uniq)
+            pkt_local.append(inverse)
+            pkt_offset.append(offsets[ip])
+
+    if batch_keys:
+        flows, global_ids = _unique_keys({k: np.concatenate([u[k] for u in batch_keys]) for k in FLOW_KEYS})
+        bases = np.cumsum([0] + [len(u["a_lo"]) for u in batch_keys[:-1]])
+        pkt_flow = np.concatenate([global_ids[base + local] for base, local in zip(bases, pkt_local)])
+        pkt_offset = np.concatenate(pkt_offset)
+    else:
+        flows = {k: np.zeros(0, dtype=np.int64 if k == "proto_ports" else np.uint64) for k in FLOW_KEYS}
+        pkt_flow = pkt_offset = np.zeros(0, dtype=np.int64)
+    order = np.argsort(pkt_flow, kind="stable")  # 同一 Flow 內維持檔案順序
+    counts = np.bincount(pkt_flow, minlength=len(flows["a_lo"]))
+    size, mtime_ns = _signature(capture)
+
+    dst = index_path(capture)
+    with open(dst + ".tmp", "wb") as f:
+        # 不壓縮：zlib 會讓建立時間加倍，索引本身只有 pcap 的幾 %
+        np.savez(
+            f,
+            version=INDEX_VERSION, pcap_size=size, pcap_mtime_ns=mtime_ns, linktype=linktype,
+            time_sec=np.concatenate(time_sec) if time_sec else np.zeros(0, dtype=np.int64),
+            time_offset=np.concatenate(time_offset) if time_offset else np.zeros(0, dtype=np.int64),
+            flow_ptr=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            pkt_offset=pkt_offset[order],
+            **{f"flow_{k}": flows[k] for k in FLOW_KEYS},
+        )
+    os.replace(dst + ".tmp", dst)
+    return capture, packets, len(flows["a_lo"]), time.time() - start
+
+
+def is_up_to_date(capture):
+    try:
+        with np.load(index_path(capture)) as idx:
+            return int(idx["version"]) == INDEX_VERSION and (int(idx["pcap_size"]), int(idx["pcap_mtime_ns"])) == _signature(capture)
+    except (OSError, KeyError, ValueError):
+        return False
+
+
+def load_index(capture):
+    """讀取索引；不存在或 pcap 已變更時重建"""
+    if not is_up_to_date(capture):
+        logging.info(f"[Index] Building index for {os.path.basename(capture)}...")
+        build_index(capture)
+    with np.load(index_path(capture)) as idx:
+        return {k: idx[k] for k in idx.files}
+
+
+# ---------- 查詢 ----------
+
+def write_records(pcap, offsets, out_path):
+    """依 offset 寫出封包 (保留原 pcap 檔頭)；相鄰的 record 合併成一次寫入"""
+    offsets = np.sort(np.asarray(offsets, dtype=np.int64))
+    with open(out_path, "wb") as out:
+        out.write(pcap.mm[:24])
+        if len(offsets) == 0: return 0
+        _, caplen, _ = pcap.read_headers(offsets)
+        ends = offsets + 16 + caplen
+        breaks = np.flatnonzero(offsets[1:] != ends[:-1]) + 1
+        run_starts = offsets[np.concatenate([[0], breaks])]
+        run_ends = ends[np.concatenate([breaks - 1, [len(offsets) - 1]])]
+        for a, b in zip(run_starts.tolist(), run_ends.tolist()):
+            out.write(pcap.mm[a:b])
+    return len(offsets)
+
+
+def slice_time(capture, start_ns, end_ns, out_path):
+    """取出 [start, end] 時間範圍內的封包：以時間表 seek 到起點，只讀取該範圍"""
+    idx = load_index(capture)
+    time_sec, time_offset = idx["time_sec"], idx["time_offset"]
+    with PcapFile(capture) as pcap:
+        if len(time_sec) == 0: return write_records(pcap, [], out_path)
+        # 起點：累積最大時間戳仍小於 start 的封包都可跳過；終點多讀一個時間桶以容納少量亂序封包
+        first = np.searchsorted(time_sec, start_ns // TIME_BUCKET_NS, side="right") - 1
+        last = np.searchsorted(time_sec, end_ns // TIME_BUCKET_NS + 2, side="left")
+        begin = int(time_offset[max(first, 0)])
+        stop = int(time_offset[last]) if last < len(time_offset) else pcap.size
+        selected = []
+        for offsets in pcap.record_offsets(start=begin, end=stop):
+            ts_ns, _, _ = pcap.read_headers(offsets)
+            selected.append(offsets[(ts_ns >= start_ns) & (ts_ns <= end_ns)])
+        return write_records(pcap, np.concatenate(selected) if selected else [], out_path)
+
+
+def match_flows(idx, host=None, proto=None, port=None):
+    """回傳符合條件的 flow id (np.ndarray)"""
+    proto_col, a_port, b_port = unpack_proto_ports(idx["flow_proto_ports"])
+    mask = np.ones(len(proto_col), dtype=bool)
+    if host:
+        hi, lo = (np.uint64(v) for v in parse_ip(host))
+        mask &= ((idx["flow_a_hi"] == hi) & (idx["flow_a_lo"] == lo)) | ((idx["flow_b_hi"] == hi) & (idx["flow_b_lo"] == lo))
+    if proto is not None:
+        mask &= proto_col == proto
+    if port is not None:
+        mask &= (a_port == port) | (b_port == port)
+    return np.flatnonzero(mask)
+
+
+def flow_packet_offsets(idx, flow_ids):
+    """由 CSR 取出多個 Flow 的封包 offset (向量化，不逐 Flow 切片)"""
+    ptr = idx["flow_ptr"]
+    starts, lengths = ptr[flow_ids], ptr[flow_ids + 1] - ptr[flow_ids]
+    total = int(lengths.sum())
+    if total == 0: return np.zeros(0, dtype=np.int64)
+    base = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return idx["pkt_offset"][base + np.arange(total)]
+
+
+def select_packets(capture, out_path, host=None, proto=None, port=None):
+    """取出特定主機 / 協定 / 埠號的所有封包：直接由 Flow 表取得 offset 後 seek 讀取"""
+    idx = load_index(capture)
+    offsets = flow_packet_offsets(idx, match_flows(idx, host, proto, port))
+    with PcapFile(capture) as pcap:
+        return write_records(pcap, offsets, out_path)
+
+
+def list_flows(capture, host=None, proto=None, port=None):
+    idx = load_index(capture)
+    flow_ids = match_flows(idx, host, proto, port)
+    proto_col, a_port, b_port = unpack_proto_ports(idx["flow_proto_ports"][flow_ids])
+    a = format_ips(idx["flow_a_hi"][flow_ids], idx["flow_a_lo"][flow_ids])
+    b = format_ips(idx["flow_b_hi"][flow_ids], idx["flow_b_lo"][flow_ids])
+    packets = idx["flow_ptr"][flow_ids + 1] - idx["flow_ptr"][flow_ids]
+    return list(zip(proto_col.tolist(), a, a_port.tolist(), b, b_port.tolist(), packets.tolist()))
+
+
+# ---------- CLI ----------
+
+def parse_time(text):
+    """epoch 秒數或本地時間 (YYYY-mm-dd HH:MM:SS) -> ns"""
+    try: return int(float(text) * 1e9)
+    except ValueError: return int(datetime.datetime.fromisoformat(text).timestamp() * 1e9)
+
+
+def parse_proto(text):
+    if text is None: return None
+    return PROTO_NAMES[text.lower()] if text.lower() in PROTO_NAMES else int(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sidecar time / flow index for pcap captures")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="建立 / 更新索引")
+    p_build.add_argument("inputs", nargs="*", help="pcap 檔案 (預設: DATA_LAKE_DIR/round*.pcap)")
+    p_build.add_argument("--jobs", type=int, default=os.cpu_count())
+    p_build.add_argument("--force", action="store_true")
+
+    p_slice = sub.add_parser("slice", help="取出時間範圍內的封包")
+    p_slice.add_argument("capture")
+    p_slice.add_argument("--start", required=True, type=parse_time)
+    p_slice.add_argument("--end", required=True, type=parse_time)
+    p_slice.add_argument("-o", "--output", required=True)
+
+    for name, text in (("select", "取出特定主機 / 協定 / 埠號的封包"), ("flows", "列出符合條件的 Flow")):
+        p = sub.add_parser(name, help=text)
+        p.add_argument("capture")
+        p.add_argument("--host")
+        p.add_argument("--proto", type=parse_proto, help="tcp / udp / icmp 或協定號碼")
+        p.add_argument("--port", type=int)
+        if name == "select": p.add_argument("-o", "--output", required=True)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        inputs = args.inputs or sorted(glob.glob(os.path.join(DATA_LAKE_DIR, "round*.pcap")))
+        todo = [p for p in inputs if args.force or not is_up_to_date(p)]
+        logging.info(f"[Index] {len(todo)}/{len(inputs)} captures to index (jobs={args.jobs})")
+        if not todo: return 0
+        failed = 0
+        with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(todo)))) as pool:
+            futures = {pool.submit(build_index, p): p for p in todo}
+            for future, path in futures.items():
+                try:
+                    _, packets, flows, seconds = future.result()
+                    logging.info(f"[Index] {os.path.basename(path)}: {packets} packets, {flows} flows ({seconds:.1f}s)")
+                except Exception as e:
+                    failed += 1
+                    logging.error(f"[Index] {os.path.basename(path)} failed: {e}")
+        return 1 if failed else 0
+
+    start = time.time()
+    if args.command == "slice":
+        count = slice_time(args.capture, args.start, args.end, args.output)
+    elif args.command == "select":
+        count = select_packets(args.capture, args.output, args.host, args.proto, args.port)
+    else:
+        for proto, a, a_port, b, b_port, packets in list_flows(args.capture, args.host, args.proto, args.port):
+            print(f"{proto:>3}  {a}:{a_port} <-> {b}:{b_port}  {packets} packets")
+        return 0
+    logging.info(f"[Index] {count} packets -> {args.output} ({time.time() - start:.2f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
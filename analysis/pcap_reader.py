@@ -0,0 +1,268 @@
+"""
+【Memory-mapped PCAP Reader】
+Data Lake 內分析工具共用的 pcap 解析層：
+- 以 mmap 開檔，封包內容不複製 (np.frombuffer 直接指向檔案頁面)
+- 唯一的逐筆步驟是走訪 16-byte record header 取得每個封包的位移 (長度決定下一筆位置，無法向量化)
+- 之後的 L2/L3/L4 欄位全部以 NumPy fancy indexing 一次解出整批封包
+- 支援 Ethernet (含 802.1Q)、Linux SLL / SLL2、Raw IP；可選擇拆開 Docker Overlay 的 VXLAN (UDP 4789)
+
+IP 位址統一以兩個 uint64 (hi, lo) 表示：IPv4 轉為 IPv4-mapped IPv6 (::ffff:a.b.c.d)。
+"""
+
+import mmap
+import os
+import re
+import struct
+from itertools import repeat
+
+import numpy as np
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+VXLAN_PORT = 4789
+IPV4_MAPPED_HI = np.uint64(0)
+IPV4_MAPPED_LO = np.uint64(0xFFFF << 32)
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+
+# round{N}_{timestamp}_{host}.pcap 或串流模式的 round{N}_{timestamp}_{host}_{segment}{part}.pcap
+CAPTURE_NAME_RE = re.compile(r'^round(?P<round>\d+)_(?P<ts>\d{8}_\d{6})_(?P<host>.+?)(?:_(?P<segment>\d{8}_\d{6})(?P<part>\d*))?\.pcap$')
+
+
+def parse_capture_name(path):
+    """從 Data Lake 檔名取出 (round, timestamp, host)；不符合命名規則時回傳 (None, None, 檔名)"""
+    name = os.path.basename(path)
+    match = CAPTURE_NAME_RE.match(name)
+    if not match: return None, None, name.rsplit(".", 1)[0]
+    return int(match.group("round")), match.group("ts"), match.group("host")
+
+
+class PcapFile:
+    """唯讀 mmap 的 pcap 檔案 (libpcap 格式，µs / ns 時間戳，任一 byte order)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size < 24: raise ValueError(f"{path}: not a pcap file (too short)")
+        self.mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = np.frombuffer(self.mm, dtype=np.uint8)
+
+        magic = self.mm[:4]
+        if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"): self.endian = "<"
+        elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"): self.endian = ">"
+        else: raise ValueError(f"{path}: unsupported capture format (pcapng is not supported)")
+        self.ns_resolution = magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d")
+        self.snaplen, self.linktype = struct.unpack_from(self.endian + "II", self.mm, 16)
+        self._incl_len = struct.Struct(self.endian + "8xI")
+
+    def close(self):
+        # 先釋放 NumPy view，否則 mmap 會因仍有 export 而無法關閉
+        self.buf = None
+        try: self.mm.close()
+        except BufferError: pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record_offsets(self, batch_size=1 << 20, start=24, end=None):
+        """
+        逐批產生 record header 的位移 (np.int64)。
+        只有這一步是逐筆的 Python 迴圈：每筆只讀 4 bytes 的 incl_len，迴圈內不做其他事。
+        """
+        end = self.size if end is None else min(end, self.size)
+        unpack = self._incl_len.unpack_from
+        mm = self.mm
+        stop = end - 16
+        off = start
+        while off <= stop:
+            batch = []
+            append = batch.append
+            for _ in repeat(None, batch_size):
+                if off > stop: break
+                append(off)
+                off += 16 + unpack(mm, off)[0]
+            if off > end:
+                batch.pop()  # 被截斷的最後一筆 (例如 tcpdump 還在寫入)
+            if batch: yield np.array(batch, dtype=np.int64)
+
+    def read_headers(self, offsets):
+        """向量化讀取 record header：回傳 (ts_ns, caplen, wirelen)"""
+        word = lambda k: _u32(self.buf, offsets + 4 * k, self.endian)
+        frac = word(1) if self.ns_resolution else word(1) * 1000
+        return word(0) * 1_000_000_000 + frac, word(2), word(3)
+
+    def decode(self, offsets, vxlan=True):
+        """解出一批封包的欄位，回傳 {欄位: np.ndarray}"""
+        ts_ns, caplen, wirelen = self.read_headers(offsets)
+        data = offsets + 16
+        cols = decode_packets(self.buf, data, data + caplen, self.linktype)
+        if vxlan:
+            inner = (cols["proto"] == PROTO_UDP) & (cols["dport"] == VXLAN_PORT) & (cols["l4"] + 16 + 14 <= data + caplen)
+            cols["vxlan"] = inner
+            if inner.any():
+                sub = decode_packets(self.buf, cols["l4"][inner] + 16, (data + caplen)[inner], LINKTYPE_ETHERNET)
+                for key, value in sub.items():
+                    cols[key][inner] = value
+        else:
+            cols["vxlan"] = np.zeros(len(offsets), dtype=bool)
+        cols.update(offset=offsets, ts_ns=ts_ns, caplen=caplen, wirelen=wirelen)
+        return cols
+
+
+# ---------- 向量化欄位存取 ----------
+
+def _u32(buf, idx, endian):
+    b = [buf[idx + k].astype(np.int64) for k in range(4)]
+    if endian == "<": b.reverse()
+    return (b[0] << 24) | (b[1] << 16) | (b[2] << 8) | b[3]
+
+
+def _u8(buf, idx, valid):
+    return np.where(valid, buf[np.where(valid, idx, 0)], 0).astype(np.int64)
+
+
+def _be16(buf, idx, valid):
+    i = np.where(valid, idx, 0)
+    return np.where(valid, (buf[i].astype(np.int64) << 8) | buf[i + 1], 0)
+
+
+def _be32(buf, idx, valid):
+    i = np.where(valid, idx, 0)
+    value = (buf[i].astype(np.int64) << 24) | (buf[i + 1].astype(np.int64) << 16) | (buf[i + 2].astype(np.int64) << 8) | buf[i + 3]
+    return np.where(valid, value, 0)
+
+
+def _be64(buf, idx, valid):
+    return (_be32(buf, idx, valid).astype(np.uint64) << np.uint64(32)) | _be32(buf, idx + 4, valid).astype(np.uint64)
+
+
+def decode_packets(buf, data, data_end, linktype):
+    """
+    data / data_end 為每個封包內容在 buf 中的起訖位移。
+    回傳的 l3 / l4 為絕對位移 (供 VXLAN 內層或 demux 使用)；無法解析的欄位為 0。
+    """
+    has = lambda idx, length: idx + length <= data_end
+
+    # L2 -> ethertype + L3 位移
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype = _be16(buf, data + 12, has(data, 14))
+        l3 = data + 14
+        vlan = (ethertype == 0x8100) | (ethertype == 0x88A8)
+        ethertype = np.where(vlan, _be16(buf, data + 16, vlan & has(data, 18)), ethertype)
+        l3 = np.where(vlan, l3 + 4, l3)
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ethertype = _be16(buf, data + 14, has(data, 16))
+        l3 = data + 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        ethertype = _be16(buf, data, has(data, 20))
+        l3 = data + 20
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        version = _u8(buf, data, has(data, 1)) >> 4
+        ethertype = np.select([version == 4, version == 6], [0x0800, 0x86DD], 0)
+        l3 = data.copy()
+    else:
+        raise ValueError(f"unsupported linktype {linktype}")
+
+    # L3
+    v4 = (ethertype == 0x0800) & has(l3, 20)
+    v6 = (ethertype == 0x86DD) & has(l3, 40)
+    ihl = (_u8(buf, l3, v4) & 0x0F) * 4
+    proto = np.where(v4, _u8(buf, l3 + 9, v4), _u8(buf, l3 + 6, v6))
+    ip_payload = np.where(v4, _be16(buf, l3 + 2, v4) - ihl, _be16(buf, l3 + 4, v6))
+    l4 = np.where(v4, l3 + ihl, l3 + 40)
+
+    src_hi = np.where(v6, _be64(buf, l3 + 8, v6), IPV4_MAPPED_HI)
+    src_lo = np.where(v6, _be64(buf, l3 + 16, v6), IPV4_MAPPED_LO | _be32(buf, l3 + 12, v4).astype(np.uint64))
+    dst_hi = np.where(v6, _be64(buf, l3 + 24, v6), IPV4_MAPPED_HI)
+    dst_lo = np.where(v6, _be64(buf, l3 + 32, v6), IPV4_MAPPED_LO | _be32(buf, l3 + 16, v4).astype(np.uint64))
+
+    # L4
+    is_ip = v4 | v6
+    tcp = is_ip & (proto == PROTO_TCP) & has(l4, 20)
+    udp = is_ip & (proto == PROTO_UDP) & has(l4, 8)
+    ports = tcp | udp
+    sport = _be16(buf, l4, ports)
+    dport = _be16(buf, l4 + 2, ports)
+    tcp_flags = _u8(buf, l4 + 13, tcp)
+    thl = (_u8(buf, l4 + 12, tcp) >> 4) * 4
+    payload = np.select([tcp, udp], [ip_payload - thl, ip_payload - 8], np.maximum(ip_payload, 0))
+
+    return {
+        "ip_version": np.select([v4, v6], [4, 6], 0).astype(np.int8),
+        "proto": np.where(is_ip, proto, -1).astype(np.int16),
+        "src_hi": np.where(is_ip, src_hi, 0).astype(np.uint64),
+        "src_lo": np.where(is_ip, src_lo, 0).astype(np.uint64),
+        "dst_hi": np.where(is_ip, dst_hi, 0).astype(np.uint64),
+        "dst_lo": np.where(is_ip, dst_lo, 0).astype(np.uint64),
+        "sport": sport.astype(np.int32),
+        "dport": dport.astype(np.int32),
+        "tcp_flags": tcp_flags.astype(np.uint8),
+        "payload": np.maximum(payload, 0).astype(np.int64),
+        "l3": l3.astype(np.int64),
+        "l4": np.where(is_ip, l4, 0).astype(np.int64),
+    }
+
+
+def canonical_keys(cols):
+    """
+    不分方向的 5-tuple key：以 (位址, 埠) 較小的一端為 a，讓兩個方向落在同一個 key。
+    proto 與兩端埠號打包成一個 int64 (proto << 32 | a_port << 16 | b_port)，減少排序的 key 數。
+    回傳 ({proto_ports, a_hi, a_lo, b_hi, b_lo}, swap)；swap=True 表示封包方向為 b -> a。
+    """
+    swap = (cols["src_hi"] > cols["dst_hi"]) | ((cols["src_hi"] == cols["dst_hi"]) & (
+        (cols["src_lo"] > cols["dst_lo"]) | ((cols["src_lo"] == cols["dst_lo"]) & (cols["sport"] > cols["dport"]))))
+    a_port = np.where(swap, cols["dport"], cols["sport"]).astype(np.int64)
+    b_port = np.where(swap, cols["sport"], cols["dport"]).astype(np.int64)
+    keys = {
+        "proto_ports": (cols["proto"].astype(np.int64) << 32) | (a_port << 16) | b_port,
+        "a_hi": np.where(swap, cols["dst_hi"], cols["src_hi"]),
+        "a_lo": np.where(swap, cols["dst_lo"], cols["src_lo"]),
+        "b_hi": np.where(swap, cols["src_hi"], cols["dst_hi"]),
+        "b_lo": np.where(swap, cols["src_lo"], cols["dst_lo"]),
+    }
+    return keys, swap
+
+
+def unpack_proto_ports(proto_ports):
+    """canonical_keys 打包的 proto_ports -> (proto, a_port, b_port)"""
+    return proto_ports >> 32, (proto_ports >> 16) & 0xFFFF, proto_ports & 0xFFFF
+
+
+def format_ips(hi, lo):
+    """(hi, lo) -> 字串位址；只格式化不重複的位址 (Flow 數遠多於位址數)，IPv4-mapped 以點分十進位表示"""
+    import ipaddress
+    hi = np.asarray(hi, dtype=np.uint64)
+    lo = np.asarray(lo, dtype=np.uint64)
+    if len(hi) == 0: return np.empty(0, dtype=object)
+    order = np.lexsort((lo, hi))
+    h, l = hi[order], lo[order]
+    first = np.concatenate([[True], (h[1:] != h[:-1]) | (l[1:] != l[:-1])])
+    group = np.cumsum(first) - 1
+
+    names = []
+    for uh, ul in zip(h[first].tolist(), l[first].tolist()):
+        if uh == 0 and ul >> 32 == 0xFFFF: names.append(str(ipaddress.IPv4Address(ul & 0xFFFFFFFF)))
+        else: names.append(str(ipaddress.IPv6Address((uh << 64) | ul)))
+    out = np.empty(len(hi), dtype=object)
+    out[order] = np.array(names, dtype=object)[group]
+    return out
+
+
+def parse_ip(text):
+    """字串位址 -> (hi, lo)，與 decode_packets 的表示法一致"""
+    import ipaddress
+    addr = ipaddress.ip_address(text)
+    if addr.version == 4: return 0, (0xFFFF << 32) | int(addr)
+    value = int(addr)
+    return value >> 64, value & 0xFFFFFFFFFFFFFFFF
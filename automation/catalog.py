@@ -0,0 +1,363 @@
+"""
+【Data Lake Catalog】
+以 SQLite 記錄 Data Lake 中每個錄製檔的中繼資料，取代每輪對整個 DATA_LAKE_DIR 做 listdir 的作法：
+- 每個 capture 一列：round、timestamp、worker、大小、SHA256、封包數、首末封包時間、容器數、sites.json 版本
+- [新增] 每個 Bot 事件紀錄 (round{N}_{timestamp}_{host}.events.jsonl) 一列：事件數與首末事件時間
+- 登錄是增量且冪等的：同名檔案大小與修改時間都沒變時直接略過，重跑不會重算 checksum
+- 選取訓練資料時以索引查詢，不必走訪目錄
+
+Catalog 本身只使用標準函式庫；封包數與首末封包時間共用 analysis/pcap_reader.py 的 record 走訪 (需要 NumPy，
+即 analysis/requirements.txt)，未安裝時只記錄 checksum。
+
+用法:
+    python catalog.py scan                                    # 登錄 Data Lake 中既有的 round*.pcap 與事件紀錄 (可重複執行)
+    python catalog.py list --round 3 --worker worker1         # 列出符合條件的 capture
+    python catalog.py list --since 20260101_000000 --sites-rev 3f2a9c --min-replicas 20 --paths
+    python catalog.py rounds                                  # 每個 Round 的檔案數 / 大小 / 封包數 / 事件數
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# [修改] 與 Flow 萃取 / 索引共用同一個 pcap 解析層
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "analysis"))
+try:
+    from pcap_reader import PcapFile
+except ImportError:
+    PcapFile = None
+
+DATA_LAKE_DIR = os.getenv('DATA_LAKE_DIR', "/mnt/d/Traffic_Data")
+CATALOG_PATH = os.getenv('CATALOG_PATH', os.path.join(DATA_LAKE_DIR, "catalog.sqlite3"))
+
+# 與 analysis/pcap_reader.py 的命名規則相同 (串流模式多了 Segment 起始時間與分段編號)
+CAPTURE_NAME_RE = re.compile(r'^round(?P<round>\d+)_(?P<ts>\d{8}_\d{6})_(?P<host>.+?)(?:_(?P<segment>\d{8}_\d{6})(?P<part>\d*))?\.pcap$')
+EVENTS_NAME_RE = re.compile(r'^round(?P<round>\d+)_(?P<ts>\d{8}_\d{6})_(?P<host>.+)\.events\.jsonl$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rounds (
+    round           INTEGER NOT NULL,
+    timestamp       TEXT    NOT NULL,
+    replicas        INTEGER,
+    sites_revision  TEXT,
+    recorded_at     REAL,
+    PRIMARY KEY (round, timestamp)
+);
+CREATE TABLE IF NOT EXISTS captures (
+    name            TEXT PRIMARY KEY,   -- 相對於 Data Lake 的檔名
+    round           INTEGER NOT NULL,
+    timestamp       TEXT    NOT NULL,
+    worker          TEXT    NOT NULL,
+    segment         TEXT,
+    size            INTEGER NOT NULL,
+    mtime_ns        INTEGER NOT NULL,
+    sha256          TEXT,
+    packets         INTEGER,
+    first_ts        REAL,
+    last_ts         REAL,
+    replicas        INTEGER,
+    sites_revision  TEXT,
+    ingested_at     REAL
+);
+CREATE TABLE IF NOT EXISTS events (
+    name            TEXT PRIMARY KEY,   -- 相對於 Data Lake 的檔名
+    round           INTEGER NOT NULL,
+    timestamp       TEXT    NOT NULL,
+    worker          TEXT    NOT NULL,
+    size            INTEGER NOT NULL,
+    mtime_ns        INTEGER NOT NULL,
+    events          INTEGER,
+    first_ts        REAL,
+    last_ts         REAL,
+    ingested_at     REAL
+);
+CREATE INDEX IF NOT EXISTS events_round ON events (round, timestamp);
+CREATE INDEX IF NOT EXISTS captures_round ON captures (round, timestamp);
+CREATE INDEX IF NOT EXISTS captures_timestamp ON captures (timestamp);
+CREATE INDEX IF NOT EXISTS captures_worker ON captures (worker);
+CREATE INDEX IF NOT EXISTS captures_sites ON captures (sites_revision);
+"""
+
+HASH_CHUNK = 8 << 20
+
+
+def parse_capture_name(name):
+    """round{N}_{timestamp}_{host}[_{segment}{part}].pcap -> dict；不符合命名規則時回傳 None"""
+    m = CAPTURE_NAME_RE.match(os.path.basename(name))
+    if not m: return None
+    segment = f"{m.group('segment')}{m.group('part')}" if m.group("segment") else None
+    return {"round": int(m.group("round")), "timestamp": m.group("ts"), "worker": m.group("host"), "segment": segment}
+
+
+def scan_capture(path):
+    """
+    以 mmap 分段計算 SHA256，封包數與首末封包時間由 pcap_reader.PcapFile 批次走訪 record 取得。
+    沒有 NumPy 或非 libpcap 格式 (例如 pcapng) 時只計算 checksum，封包數為 None；結尾被截斷的 record 不計入。
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0: return digest.hexdigest(), 0, None, None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                for pos in range(0, size, HASH_CHUNK):
+                    digest.update(view[pos:pos + HASH_CHUNK])
+            finally:
+                view.release()
+    if PcapFile is None: return digest.hexdigest(), None, None, None
+
+    try: pcap = PcapFile(path)
+    except ValueError: return digest.hexdigest(), None, None, None
+    packets = first_ts = last_ts = None
+    with pcap:
+        packets, first, last = 0, None, None
+        for offsets in pcap.record_offsets():
+            if first is None: first = offsets[:1]
+            last = offsets[-1:]
+            packets += len(offsets)
+        if packets:
+            first_ts = int(pcap.read_headers(first)[0][0]) / 1e9
+            last_ts = int(pcap.read_headers(last)[0][0]) / 1e9
+    return digest.hexdigest(), packets, first_ts, last_ts
+
+
+def parse_events_name(name):
+    """round{N}_{timestamp}_{host}.events.jsonl -> dict；不符合命名規則時回傳 None"""
+    m = EVENTS_NAME_RE.match(os.path.basename(name))
+    if not m: return None
+    return {"round": int(m.group("round")), "timestamp": m.group("ts"), "worker": m.group("host")}
+
+
+def scan_events(path):
+    """事件數與首末事件時間 (wall clock 的 t 欄位)；無法解析的行 (例如寫到一半的最後一行) 不計入"""
+    count, first_ts, last_ts = 0, None, None
+    with open(path, "rb") as f:
+        for line in f:
+            try: t = float(json.loads(line)["t"])
+            except (ValueError, KeyError, TypeError): continue
+            count += 1
+            first_ts = t if first_ts is None else min(first_ts, t)
+            last_ts = t if last_ts is None else max(last_ts, t)
+    return count, first_ts, last_ts
+
+
+class Catalog:
+    """SQLite catalog；同一個實例可由多個執行緒共用 (pipeline_manager 的背景傳輸與 Segment 回收)"""
+
+    def __init__(self, path=CATALOG_PATH, data_lake_dir=DATA_LAKE_DIR):
+        self.path = path
+        self.data_lake_dir = data_lake_dir
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        # WAL：分析端查詢時不會擋住 pipeline_manager 寫入 (不支援共享記憶體的檔案系統維持預設 journal)
+        try: self._db.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError: pass
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # ---------- 寫入 ----------
+
+    def record_round(self, round_id, timestamp, replicas=None, sites_revision=None):
+        """記錄 Round 的容器數與 sites.json 版本；之後登錄的同一 Round capture 會帶入這些值"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO rounds (round, timestamp, replicas, sites_revision, recorded_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (round, timestamp) DO UPDATE SET "
+                "replicas = COALESCE(excluded.replicas, replicas), "
+                "sites_revision = COALESCE(excluded.sites_revision, sites_revision), recorded_at = excluded.recorded_at",
+                (round_id, timestamp, replicas, sites_revision, time.time()))
+
+    def _name(self, path):
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.data_lake_dir))
+
+    def _is_current(self, name, st):
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns FROM captures WHERE name = ?", (name,)).fetchone()
+        return row is not None and (row["size"], row["mtime_ns"]) == (st.st_size, st.st_mtime_ns)
+
+    def ingest(self, paths, jobs=4):
+        """
+        登錄 capture (路徑需位於 Data Lake 內，檔名符合 round{N}_{timestamp}_{host}.pcap)。
+        大小與修改時間都沒變的檔案直接略過；checksum 以執行緒平行計算 (hashlib 會釋放 GIL)。
+        回傳實際 (重新) 登錄的檔案數。
+        """
+        todo = []
+        for path in paths:
+            meta = parse_capture_name(path)
+            if meta is None: continue
+            try: st = os.stat(path)
+            except OSError: continue
+            name = self._name(path)
+            if not self._is_current(name, st): todo.append((path, name, meta, st))
+        if not todo: return 0
+
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(todo)))) as pool:
+            scans = list(pool.map(lambda item: scan_capture(item[0]), todo))
+
+        now = time.time()
+        with self._lock, self._db:
+            for (path, name, meta, st), (sha256, packets, first_ts, last_ts) in zip(todo, scans):
+                rnd = self._db.execute("SELECT replicas, sites_revision FROM rounds WHERE round = ? AND timestamp = ?",
+                                       (meta["round"], meta["timestamp"])).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO captures (name, round, timestamp, worker, segment, size, mtime_ns, sha256, "
+                    "packets, first_ts, last_ts, replicas, sites_revision, ingested_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (name, meta["round"], meta["timestamp"], meta["worker"], meta["segment"], st.st_size, st.st_mtime_ns,
+                     sha256, packets, first_ts, last_ts,
+                     rnd["replicas"] if rnd else None, rnd["sites_revision"] if rnd else None, now))
+        return len(todo)
+
+    def ingest_events(self, paths):
+        """
+        [新增] 登錄 Bot 事件紀錄 (檔名符合 round{N}_{timestamp}_{host}.events.jsonl)。
+        串流錄製模式每次回收都會附加到同一個檔案，大小或修改時間改變時重新計數。回傳實際 (重新) 登錄的檔案數。
+        """
+        todo = []
+        for path in paths:
+            meta = parse_events_name(path)
+            if meta is None: continue
+            try: st = os.stat(path)
+            except OSError: continue
+            name = self._name(path)
+            with self._lock:
+                row = self._db.execute("SELECT size, mtime_ns FROM events WHERE name = ?", (name,)).fetchone()
+            if row is None or (row["size"], row["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+                todo.append((name, meta, st, scan_events(path)))
+        if not todo: return 0
+
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO events (name, round, timestamp, worker, size, mtime_ns, events, first_ts, last_ts, "
+                "ingested_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(name, meta["round"], meta["timestamp"], meta["worker"], st.st_size, st.st_mtime_ns, *counts, now)
+                 for name, meta, st, counts in todo])
+        return len(todo)
+
+    def scan(self, jobs=4):
+        """登錄 Data Lake 最上層所有 round*.pcap 與事件紀錄 (補登既有資料用；只有這裡會走訪目錄)，並移除檔案已不存在的列"""
+        entries = [e for e in os.scandir(self.data_lake_dir) if e.is_file()]
+        paths = [e.path for e in entries if CAPTURE_NAME_RE.match(e.name)]
+        event_paths = [e.path for e in entries if EVENTS_NAME_RE.match(e.name)]
+        added = self.ingest(paths, jobs) + self.ingest_events(event_paths)
+        present = {self._name(p) for p in paths + event_paths}
+        removed = 0
+        with self._lock, self._db:
+            for table in ("captures", "events"):
+                gone = [r["name"] for r in self._db.execute(f"SELECT name FROM {table}") if r["name"] not in present]
+                self._db.executemany(f"DELETE FROM {table} WHERE name = ?", [(n,) for n in gone])
+                removed += len(gone)
+        return added, removed
+
+    # ---------- 查詢 ----------
+
+    def select(self, round_id=None, worker=None, since=None, until=None, sites_revision=None,
+               min_replicas=None, max_replicas=None):
+        """
+        選取訓練資料：依條件回傳 capture 列 (sqlite3.Row，依 timestamp / worker 排序)。
+        since / until 為 Round 起始時間字串 (YYYYmmdd_HHMMSS，含端點)；sites_revision 可只給前綴。
+        """
+        clauses, params = [], []
+        for column, op, value in (("round", "=", round_id), ("worker", "=", worker),
+                                  ("timestamp", ">=", since), ("timestamp", "<=", until),
+                                  ("replicas", ">=", min_replicas), ("replicas", "<=", max_replicas)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        if sites_revision:
+            clauses.append("sites_revision LIKE ?")
+            params.append(sites_revision + "%")
+        sql = "SELECT * FROM captures"
+        if clauses: sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY timestamp, round, worker, segment"
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def paths(self, **filters):
+        return [os.path.join(self.data_lake_dir, row["name"]) for row in self.select(**filters)]
+
+    def rounds(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT round, timestamp, COUNT(*) AS files, SUM(size) AS bytes, SUM(packets) AS packets, "
+                "MAX(replicas) AS replicas, MAX(sites_revision) AS sites_revision, "
+                "(SELECT SUM(e.events) FROM events e WHERE e.round = c.round AND e.timestamp = c.timestamp) AS events "
+                "FROM captures c GROUP BY round, timestamp ORDER BY timestamp, round").fetchall()
+
+    def events(self, round_id=None, worker=None):
+        """[新增] 事件紀錄列 (依 timestamp / worker 排序)"""
+        clauses, params = [], []
+        for column, value in (("round", round_id), ("worker", worker)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        sql = "SELECT * FROM events"
+        if clauses: sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY timestamp, round, worker"
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite catalog of the pcap data lake")
+    parser.add_argument("--db", default=CATALOG_PATH)
+    parser.add_argument("--data-lake", default=DATA_LAKE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_scan = sub.add_parser("scan", help="登錄 Data Lake 中既有的 capture")
+    p_scan.add_argument("--jobs", type=int, default=4)
+
+    p_list = sub.add_parser("list", help="列出符合條件的 capture")
+    p_list.add_argument("--round", type=int)
+    p_list.add_argument("--worker")
+    p_list.add_argument("--since", help="Round 起始時間下限 (YYYYmmdd_HHMMSS)")
+    p_list.add_argument("--until", help="Round 起始時間上限 (YYYYmmdd_HHMMSS)")
+    p_list.add_argument("--sites-rev", help="sites.json 版本 (可只給前綴)")
+    p_list.add_argument("--min-replicas", type=int)
+    p_list.add_argument("--max-replicas", type=int)
+    p_list.add_argument("--paths", action="store_true", help="只輸出完整路徑 (方便接到其他工具)")
+
+    sub.add_parser("rounds", help="每個 Round 的統計")
+    args = parser.parse_args()
+
+    catalog = Catalog(args.db, args.data_lake)
+    try:
+        if args.command == "scan":
+            start = time.time()
+            added, removed = catalog.scan(args.jobs)
+            print(f"[Catalog] {added} files ingested, {removed} missing removed ({time.time() - start:.1f}s)")
+        elif args.command == "list":
+            filters = dict(round_id=args.round, worker=args.worker, since=args.since, until=args.until,
+                           sites_revision=args.sites_rev, min_replicas=args.min_replicas, max_replicas=args.max_replicas)
+            if args.paths:
+                print("\n".join(catalog.paths(**filters)))
+            else:
+                for r in catalog.select(**filters):
+                    print(f"{r['name']}  round={r['round']} worker={r['worker']} {r['size'] / 1024**3:.2f}GB "
+                          f"packets={r['packets']} replicas={r['replicas']} sites={(r['sites_revision'] or '-')[:12]}")
+        else:
+            for r in catalog.rounds():
+                print(f"round{r['round']}_{r['timestamp']}: {r['files']} files, {(r['bytes'] or 0) / 1024**3:.2f}GB, "
+                      f"packets={r['packets']} events={r['events']} replicas={r['replicas']} sites={(r['sites_revision'] or '-')[:12]}")
+    finally:
+        catalog.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
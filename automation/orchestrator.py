@@ -0,0 +1,235 @@
+"""
+【非同步 Orchestrator】
+取代 pipeline_manager 中每個控制動作都 fork 一次 ansible CLI 的做法：
+- inventory.ini 只解析一次
+- 對每台 Manager / Worker 維持一條持久 SSH 連線 (asyncssh)，指令以多工 Channel 同時送出
+- 每台主機各自逾時，回傳結構化結果 {host: HostResult}
+- 事件迴圈跑在背景執行緒，pipeline_manager 仍以同步方式呼叫
+
+連線建立函式 (connector) 可注入，方便以本機 SSH 替身測試：
+    async def connector(host_vars) -> conn
+conn 需提供 `await conn.run(command, input=None, check=False)` (回傳含 exit_status / stdout / stderr 的物件) 與 `conn.close()`。
+"""
+
+import asyncio
+import shlex
+import threading
+import time
+
+
+class Inventory:
+    """解析 Ansible INI 格式的 inventory (支援 [group]、[group:vars]、[group:children])"""
+
+    def __init__(self, path):
+        self.groups = {}        # group -> [host]
+        self.children = {}      # group -> [child group]
+        self.host_vars = {}     # host -> {var: value}
+        self.group_vars = {}    # group -> {var: value}
+        self._parse(path)
+
+    def _parse(self, path):
+        section, kind = None, None
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith(("#", ";")): continue
+                if line.startswith("["):
+                    section, _, kind = line.strip("[]").partition(":")
+                    if not kind: self.groups.setdefault(section, [])
+                    continue
+                if kind == "vars":
+                    key, _, value = line.partition("=")
+                    self.group_vars.setdefault(section, {})[key.strip()] = self._unquote(value.strip())
+                elif kind == "children":
+                    self.children.setdefault(section, []).append(line)
+                else:
+                    parts = shlex.split(line)
+                    host = parts[0]
+                    self.groups.setdefault(section or "ungrouped", []).append(host)
+                    self.host_vars.setdefault(host, {}).update(p.split("=", 1) for p in parts[1:] if "=" in p)
+
+    @staticmethod
+    def _unquote(value):
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"": return value[1:-1]
+        return value
+
+    def _group_hosts(self, group):
+        hosts = list(self.groups.get(group, []))
+        for child in self.children.get(group, []):
+            hosts.extend(h for h in self._group_hosts(child) if h not in hosts)
+        return hosts
+
+    def resolve(self, pattern):
+        """'all' / 群組名 / 主機名，可用逗號或冒號組合 (與 ansible host pattern 的基本用法相同)"""
+        hosts = []
+        for part in pattern.replace(":", ",").split(","):
+            part = part.strip()
+            if part == "all":
+                found = list(self.host_vars)
+            elif part in self.groups or part in self.children:
+                found = self._group_hosts(part)
+            elif part in self.host_vars:
+                found = [part]
+            else:
+                found = []
+            hosts.extend(h for h in found if h not in hosts)
+        return hosts
+
+    def vars_for(self, host):
+        """all:vars < 所屬群組 vars < 主機 vars"""
+        merged = dict(self.group_vars.get("all", {}))
+        for group in self.groups:
+            if group != "all" and host in self._group_hosts(group):
+                merged.update(self.group_vars.get(group, {}))
+        merged.update(self.host_vars.get(host, {}))
+        merged["inventory_hostname"] = host
+        return merged
+
+    def hosts(self, group):
+        """{host: ansible_host}"""
+        return {h: self.host_vars[h].get("ansible_host", h) for h in self.resolve(group)}
+
+
+class HostResult:
+    """單台主機的執行結果；rc 為 None 代表連線失敗或逾時 (原因記錄在 error)"""
+    __slots__ = ('host', 'rc', 'stdout', 'stderr', 'elapsed', 'error')
+
+    def __init__(self, host, rc=None, stdout="", stderr="", elapsed=0.0, error=None):
+        self.host = host
+        self.rc = rc
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.rc == 0
+
+    def __repr__(self):
+        return f"HostResult({self.host!r}, rc={self.rc}, elapsed={self.elapsed:.3f}, error={self.error!r})"
+
+
+async def asyncssh_connector(host_vars):
+    """預設連線方式：依 inventory 變數建立 asyncssh 連線 (對應 StrictHostKeyChecking=no)"""
+    import asyncssh
+    key_file = host_vars.get("ansible_ssh_private_key_file")
+    return await asyncssh.connect(
+        host_vars.get("ansible_host", host_vars["inventory_hostname"]),
+        port=int(host_vars.get("ansible_port", 22)),
+        username=host_vars.get("ansible_user"),
+        client_keys=[key_file] if key_file else (),
+        known_hosts=None,
+        connect_timeout=int(host_vars.get("ansible_timeout", 10)),
+        keepalive_interval=30,
+    )
+
+
+class Orchestrator:
+    # OpenSSH 預設 MaxSessions=10，單一連線上同時開啟的 Channel 數保留一些餘裕
+    MAX_CHANNELS_PER_HOST = 8
+
+    def __init__(self, inventory, become_password="", connector=asyncssh_connector):
+        self.inventory = inventory
+        self.become_password = become_password
+        self.connector = connector
+        self._conns = {}
+        self._locks = {}
+        self._channels = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="orchestrator", daemon=True)
+        self._thread.start()
+
+    # ---------- 同步介面 (給 pipeline_manager 使用) ----------
+
+    def run(self, pattern, command, timeout=30, become=True):
+        """在 pattern 指定的所有主機上同時執行 shell 指令，回傳 {host: HostResult}"""
+        future = asyncio.run_coroutine_threadsafe(self.run_async(pattern, command, timeout, become), self._loop)
+        return future.result(timeout + 5)
+
+    def connect_all(self, pattern="all", timeout=30):
+        """預先建立所有連線，回傳 {host: 錯誤訊息或 None}"""
+        future = asyncio.run_coroutine_threadsafe(self._connect_all(pattern), self._loop)
+        return future.result(timeout)
+
+    def close(self):
+        if not self._loop.is_running(): return
+        asyncio.run_coroutine_threadsafe(self._close_all(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+
+    # ---------- 非同步實作 ----------
+
+    async def run_async(self, pattern, command, timeout=30, become=True):
+        hosts = self.inventory.resolve(pattern)
+        results = await asyncio.gather(*(self._run_host(h, command, timeout, become) for h in hosts))
+        return dict(zip(hosts, results))
+
+    async def _connect_all(self, pattern):
+        async def one(host):
+            try:
+                await self._get_conn(host)
+                return None
+            except Exception as e:
+                return str(e) or type(e).__name__
+        hosts = self.inventory.resolve(pattern)
+        return dict(zip(hosts, await asyncio.gather(*(one(h) for h in hosts))))
+
+    async def _get_conn(self, host):
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            conn = self._conns.get(host)
+            if conn is None:
+                conn = await self.connector(self.inventory.vars_for(host))
+                self._conns[host] = conn
+            return conn
+
+    def _drop_conn(self, host, conn):
+        if self._conns.get(host) is conn:
+            del self._conns[host]
+            try: conn.close()
+            except Exception: pass
+
+    def _wrap(self, command, become):
+        if not become: return command, None
+        # 與 ansible -b 相同：sudo 密碼由 stdin 傳入，不出現在程序列表中
+        return f"sudo -S -p '' sh -c {shlex.quote(command)}", f"{self.become_password}\n"
+
+    async def _run_host(self, host, command, timeout, become):
+        start = time.monotonic()
+        deadline = start + timeout
+        cmd, stdin = self._wrap(command, become)
+        channels = self._channels.setdefault(host, asyncio.Semaphore(self.MAX_CHANNELS_PER_HOST))
+        error = None
+        async with channels:
+            # 非零 exit status 不會拋例外 (check=False)，因此例外都代表連線層問題：
+            # 丟棄該連線並重連一次 (例如 Worker 重開機、sshd 重啟)
+            for _ in range(2):
+                conn = None
+                try:
+                    conn = await asyncio.wait_for(self._get_conn(host), max(0.1, deadline - time.monotonic()))
+                    result = await asyncio.wait_for(conn.run(cmd, input=stdin, check=False),
+                                                    max(0.1, deadline - time.monotonic()))
+                    return HostResult(host, result.exit_status, _text(result.stdout), _text(result.stderr),
+                                      time.monotonic() - start)
+                except asyncio.TimeoutError:
+                    return HostResult(host, elapsed=time.monotonic() - start, error=f"timeout after {timeout}s")
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                    if conn is not None: self._drop_conn(host, conn)
+        return HostResult(host, elapsed=time.monotonic() - start, error=error)
+
+    async def _close_all(self):
+        conns, self._conns = list(self._conns.values()), {}
+        for conn in conns:
+            try:
+                conn.close()
+                if hasattr(conn, "wait_closed"): await conn.wait_closed()
+            except Exception:
+                pass
+
+
+def _text(data):
+    if data is None: return ""
+    if isinstance(data, bytes): data = data.decode(errors="replace")
+    return data.strip()
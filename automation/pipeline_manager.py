@@ -5,13 +5,24 @@ import sys
 import datetime
 import getpass
 import re
+import math
+import hashlib
+import json
 import logging
+import threading
+import socket
+import socketserver
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from orchestrator import Inventory, Orchestrator, HostResult
+from catalog import Catalog
 
 # ================= 設定區 =================
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
 INVENTORY_PATH = os.path.join(PROJECT_ROOT, "deploy", "inventory.ini")
 PLAYBOOK_DIR = os.path.join(SCRIPT_DIR, "playbooks")
+ANALYSIS_DIR = os.path.join(PROJECT_ROOT, "analysis")
 DATA_LAKE_DIR = "/mnt/d/Traffic_Data"
 LOG_FILE = os.path.join(SCRIPT_DIR, "pipeline_debug.log")
 
@@ -26,12 +37,62 @@ MAX_ROUNDS = DEFAULT_MAX_ROUNDS
 TARGET_REPLICAS = DEFAULT_TARGET_REPLICAS
 SUDO_PASSWORD = os.getenv('ANSIBLE_BECOME_PASS', "")
 
+# [新增] 回收階段：同時傳輸的 Worker 數與總頻寬預算 (Mbps，0 = 不限)
+FETCH_PARALLEL = int(os.getenv('FETCH_PARALLEL', "5"))
+FETCH_BANDWIDTH_MBPS = float(os.getenv('FETCH_BANDWIDTH_MBPS', "0"))
+
+# [新增] 錄製模式：batch = 每輪停止後回收 (預設)；stream = tcpdump 輪替 Segment 並持續回收，Round 只是邏輯標記
+CAPTURE_MODE = os.getenv('CAPTURE_MODE', "batch").lower()
+ROTATE_SECONDS = int(os.getenv('ROTATE_SECONDS', "300"))
+ROTATE_MB = int(os.getenv('ROTATE_MB', "0"))
+SHIP_INTERVAL = int(os.getenv('SHIP_INTERVAL', "60"))
+DRAIN_TIMEOUT = int(os.getenv('DRAIN_TIMEOUT', "600"))   # 結束時等待 Worker 壓縮完最後 Segment 的上限 (秒)
+INCOMING_DIR = os.path.join(DATA_LAKE_DIR, "incoming")
+
+# [新增] Worker Telemetry Agent 推送埠 (0 = 停用，改回 ansible 輪詢)
+TELEMETRY_PORT = int(os.getenv('TELEMETRY_PORT', "0"))
+# Worker 連回 Control Node 用的位址，未設定時自動偵測
+TELEMETRY_ADVERTISE = os.getenv('TELEMETRY_ADVERTISE', "")
+TELEMETRY_MAX_AGE = 5.0
+
+# [新增] 閉迴路自動擴縮：目標總錄製速率 (Mbps，0 = 停用，使用固定容器數)，需搭配 TELEMETRY_PORT
+AUTOSCALE_TARGET_MBPS = float(os.getenv('AUTOSCALE_TARGET_MBPS', "0"))
+AUTOSCALE_MIN_REPLICAS = int(os.getenv('AUTOSCALE_MIN_REPLICAS', "1"))
+AUTOSCALE_MAX_REPLICAS = int(os.getenv('AUTOSCALE_MAX_REPLICAS', "200"))
+AUTOSCALE_MAX_STEP = int(os.getenv('AUTOSCALE_MAX_STEP', "5"))          # 每次最多增減的容器數
+AUTOSCALE_BAND = float(os.getenv('AUTOSCALE_BAND', "0.1"))              # 目標 ±10% 內不動作 (遲滯)
+AUTOSCALE_COOLDOWN = int(os.getenv('AUTOSCALE_COOLDOWN', "60"))         # 每次調整後等待容器爬升的秒數
+AUTOSCALE_CPU_HIGH = float(os.getenv('AUTOSCALE_CPU_HIGH', "85"))       # 任一節點超過即縮減
+AUTOSCALE_MEM_HIGH = float(os.getenv('AUTOSCALE_MEM_HIGH', "85"))
+AUTOSCALE_HEADROOM = 10.0                                               # 距上限不足此百分比時不再擴張
+AUTOSCALE_MAX_PER_NODE = int(os.getenv('AUTOSCALE_MAX_PER_NODE', "0"))  # 每節點容器上限 (0 = 不限)
+BOT_MEMORY_LIMIT_MB = 1200                                              # 與 docker-stack.yml 的 limits.memory 一致
+
+# [新增] 管線化 Round：背景同時傳輸的 Round 數 (0 = 依序執行：停止 → 傳輸 → 下一輪)
+PIPELINE_ROUNDS = int(os.getenv('PIPELINE_ROUNDS', "0"))
+WORKER_ROUNDS_DIR = "/tmp/traffic_data/rounds"
+PENDING_DIR = os.path.join(DATA_LAKE_DIR, "pending")
+
+# [新增] 控制指令的執行方式：ssh = 持久 SSH 連線 (asyncssh)；ansible = 每次 fork ansible CLI
+ORCHESTRATOR_MODE = os.getenv('ORCHESTRATOR', "ssh").lower()
+
+# [新增] 每輪傳輸完成後自動萃取 Flow 特徵 (Parquet)，需安裝 analysis/requirements.txt
+EXTRACT_FLOWS = os.getenv('EXTRACT_FLOWS', "0") == "1"
+FLOW_DATASET_DIR = os.getenv('FLOW_DATASET_DIR', os.path.join(DATA_LAKE_DIR, "flows"))
+# [新增] 每輪傳輸完成後為 pcap 建立時間 / Flow 索引 (<檔名>.pcap.idx.npz)，之後切片查詢不必掃描整個檔案
+BUILD_PCAP_INDEX = os.getenv('BUILD_PCAP_INDEX', "0") == "1"
+
+# [新增] Data Lake Catalog (SQLite)：每個 capture 的中繼資料，取代每輪 listdir 整個 Data Lake
+CATALOG_PATH = os.getenv('CATALOG_PATH', os.path.join(DATA_LAKE_DIR, "catalog.sqlite3"))
+SITES_CONFIG_REMOTE = "/srv/traffic-bot/sites.json"   # deploy_swarm.yml 複製到 Manager 的版本 (Swarm Config 來源)
+SITES_CONFIG_LOCAL = os.path.join(PROJECT_ROOT, "src", "sites.json")
+
 # Logger 設定
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s [%(levelname)s] %(message)s',
     handlers=[
-        logging.FileHandler(LOG_FILE, mode='w', encoding='utf-8'),
+        logging.FileHandler(LOG_FILE, mode='w', encoding='utf-8', delay=True),  # 第一筆 Log 才開檔 (單純 import 不會清空)
         logging.StreamHandler(sys.stdout)
     ]
 )
@@ -55,10 +116,11 @@ def run_cmd(cmd, shell=False, check=True):
     except subprocess.CalledProcessError:
         return None
 
-def run_cmd_stream(cmd, description="Executing", timeout=900):
-    """串流指令執行 (雙重輸出 + Timeout + 顯示警告)"""
+def run_cmd_stream(cmd, description="Executing", timeout=900, quiet=False):
+    """串流指令執行 (雙重輸出 + Timeout + 顯示警告)；quiet=True 時只寫入 Log 檔 (背景執行用)"""
     logging.info(f"--- [{description}] Start ---")
     start_time = time.time()
+    show = (lambda msg: None) if quiet else print
     
     try:
         process = subprocess.Popen(
@@ -85,21 +147,21 @@ def run_cmd_stream(cmd, description="Executing", timeout=900):
                 
                 # 包含 "debug" 但不包含 "警告" 的才隱藏，這樣警告訊息會顯示
                 if "debug" not in task_name.lower() or "警告" in task_name:
-                    print(f"      -> Step: {task_name}")
+                    show(f"      -> Step: {task_name}")
             
             elif "changed:" in line or "ok:" in line:
                 if "[" in line:
                     host = line.split('[')[1].split(']')[0]
                     status = "Changed" if "changed" in line else "OK"
-                    print(f"      -> {host}: {status}")
+                    show(f"      -> {host}: {status}")
 
             elif any(k in line.lower() for k in ["fatal:", "failed:", "error", "unreachable"]):
-                print(f"      [!] ERROR: {line}")
+                show(f"      [!] ERROR: {line}")
 
             # 捕捉 Ansible debug msg
             elif "\"msg\":" in line:
                 msg_content = line.replace('"msg":', '').strip().strip('"')
-                print(f"      [!] Message: {msg_content}")
+                show(f"      [!] Message: {msg_content}")
 
             if (time.time() - start_time) > timeout:
                 process.kill()
@@ -120,9 +182,9 @@ def get_ansible_base_cmd(hosts_pattern, module="shell", args=None):
     if args: cmd.extend(["-a", args])
     return cmd
 
-def get_playbook_cmd(playbook_path, extra_vars_dict=None):
+def get_playbook_cmd(playbook_path, extra_vars_dict=None, forks=None):
     """
-    [修改] 支援傳入額外變數 (extra_vars_dict)
+    [修改] 支援傳入額外變數 (extra_vars_dict) 與並行數 (forks)
     """
     vars_str = f"ansible_become_pass={SUDO_PASSWORD}"
     
@@ -130,12 +192,173 @@ def get_playbook_cmd(playbook_path, extra_vars_dict=None):
         for key, value in extra_vars_dict.items():
             vars_str += f" {key}={value}"
 
-    return ["ansible-playbook", "-i", INVENTORY_PATH, playbook_path,
-            "--extra-vars", vars_str]
+    cmd = ["ansible-playbook", "-i", INVENTORY_PATH, playbook_path,
+           "--extra-vars", vars_str]
+    if forks: cmd.extend(["-f", str(forks)])
+    return cmd
+
+def get_fetch_cmd(force_cleanup=False, capture_dir=None, dest_dir=None):
+    """
+    [新增] stop_and_fetch.yml：並行、壓縮、可續傳、校驗後才刪除遠端檔案
+    指定 capture_dir 時傳輸已移出的 Round 目錄 (不停止 tcpdump，完成後移除該目錄)
+    """
+    extra_vars = {
+        "force_cleanup": "yes" if force_cleanup else "no",
+        "data_lake_dir": dest_dir or DATA_LAKE_DIR,
+        "fetch_parallel": FETCH_PARALLEL,
+        "fetch_budget_mbps": FETCH_BANDWIDTH_MBPS,
+    }
+    if capture_dir:
+        extra_vars.update({"capture_dir": capture_dir, "stop_capture": "no", "remove_capture_dir": "yes"})
+    return get_playbook_cmd(os.path.join(PLAYBOOK_DIR, "stop_and_fetch.yml"), extra_vars, forks=FETCH_PARALLEL)
+
+INVENTORY = None
+ORCHESTRATOR = None
+
+def get_inventory():
+    """[新增] inventory.ini 只解析一次"""
+    global INVENTORY
+    if INVENTORY is None: INVENTORY = Inventory(INVENTORY_PATH)
+    return INVENTORY
+
+def get_inventory_hosts(group):
+    """[新增] 從 inventory.ini 取出群組內的主機 (name -> ansible_host)"""
+    return get_inventory().hosts(group)
+
+def start_orchestrator():
+    """[新增] 建立到所有節點的持久 SSH 連線；asyncssh 未安裝或全部連線失敗時退回 ansible CLI"""
+    global ORCHESTRATOR
+    if ORCHESTRATOR_MODE != "ssh": return
+    if importlib.util.find_spec("asyncssh") is None:
+        logging.warning("asyncssh not installed (pip install -r requirements.txt); falling back to ansible CLI.")
+        return
+    orchestrator = Orchestrator(get_inventory(), become_password=SUDO_PASSWORD)
+    start = time.time()
+    errors = {host: err for host, err in orchestrator.connect_all().items() if err}
+    if errors and len(errors) == len(get_inventory().resolve("all")):
+        logging.warning(f"Persistent SSH failed for all hosts ({next(iter(errors.values()))}); falling back to ansible CLI.")
+        orchestrator.close()
+        return
+    for host, err in errors.items():
+        logging.warning(f"Persistent SSH to {host} failed: {err} (will retry per command)")
+    logging.info(f"Persistent SSH connections ready in {time.time() - start:.2f}s")
+    ORCHESTRATOR = orchestrator
+
+ANSIBLE_HEADER_RE = re.compile(r'^(?P<host>\S+) \| (?P<status>CHANGED|SUCCESS|FAILED|UNREACHABLE!)(?: \| rc=(?P<rc>\d+))?')
+
+def parse_ansible_output(output):
+    """將 ansible ad-hoc 的輸出轉為 {host: HostResult} (與 Orchestrator 的結果格式一致)"""
+    results, current, lines = {}, None, []
+    def flush():
+        if current and current.error is None: current.stdout = "\n".join(lines).strip()
+    for line in (output or "").splitlines():
+        match = ANSIBLE_HEADER_RE.match(line)
+        if match:
+            flush()
+            rc = match.group("rc")
+            if match.group("status") == "UNREACHABLE!":
+                current = HostResult(match.group("host"), error="unreachable")
+            else:
+                current = HostResult(match.group("host"), int(rc) if rc else 0)
+            results[current.host], lines = current, []
+        elif current:
+            lines.append(line)
+    flush()
+    return results
+
+def remote_shell(pattern, command, timeout=60):
+    """[新增] 在指定主機群同時執行 shell 指令 (sudo)，回傳 {host: HostResult}"""
+    if ORCHESTRATOR: return ORCHESTRATOR.run(pattern, command, timeout=timeout)
+    return parse_ansible_output(run_cmd(get_ansible_base_cmd(pattern, args=command), check=False))
+
+def joined_stdout(results):
+    return "\n".join(r.stdout for r in results.values() if r.stdout)
+
+class _TelemetryHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw in self.rfile:
+            try: snapshot = json.loads(raw)
+            except ValueError: continue
+            self.server.telemetry.update(snapshot)
+
+class _TelemetryTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class TelemetryServer:
+    """
+    [新增] 接收各 Worker Telemetry Agent 的推送 (每台一條長連線、每秒一筆 JSON)
+    保存每台 Worker 的最新狀態，並在收到新資料時喚醒等待中的監控迴圈。
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.snapshots = {}  # host -> (received_monotonic, dict)
+        self._cond = threading.Condition()
+        self._server = _TelemetryTCPServer(("0.0.0.0", port), _TelemetryHandler)
+        self._server.telemetry = self
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logging.info(f"Telemetry server listening on :{self.port}")
+
+    def stop(self):
+        self._server.shutdown()
+
+    def update(self, snapshot):
+        with self._cond:
+            self.snapshots[snapshot.get("host")] = (time.monotonic(), snapshot)
+            self._cond.notify_all()
+
+    def wait_update(self, timeout):
+        """等到任一 Worker 推送新資料 (或逾時)"""
+        with self._cond:
+            self._cond.wait(timeout)
+
+    def fresh(self, hosts=None, max_age=TELEMETRY_MAX_AGE):
+        """回傳資料未過期的 {host: snapshot}；指定 hosts 時只要有任何一台過期就回傳 None"""
+        now = time.monotonic()
+        with self._cond:
+            result = {h: snap for h, (t, snap) in self.snapshots.items() if now - t <= max_age}
+        if hosts is not None and not set(hosts) <= set(result):
+            return None
+        return result
+
+    @staticmethod
+    def advertise_address():
+        if TELEMETRY_ADVERTISE: return TELEMETRY_ADVERTISE
+        # 以「連到第一台 Worker 時使用的本機 IP」作為 Worker 連回來的位址 (UDP connect 不會送出封包)
+        workers = get_inventory_hosts("workers")
+        target = next(iter(workers.values()), "8.8.8.8")
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect((target, 9))
+            return s.getsockname()[0]
+
+TELEMETRY = None
+
+def start_telemetry():
+    global TELEMETRY
+    TELEMETRY = TelemetryServer(TELEMETRY_PORT)
+    TELEMETRY.start()
+    manager = f"{TelemetryServer.advertise_address()}:{TELEMETRY_PORT}"
+    run_cmd(get_playbook_cmd(os.path.join(PLAYBOOK_DIR, "start_telemetry.yml"), {"telemetry_manager": manager}))
+
+def worker_telemetry():
+    """所有 Worker 的 Telemetry 都在時效內才回傳，否則回傳 None (呼叫端改走 ansible 輪詢)"""
+    if not TELEMETRY: return None
+    return TELEMETRY.fresh(get_inventory_hosts("workers"))
+
+def wait_for_update(timeout):
+    """有 Telemetry 時收到推送即返回 (亞秒級反應)，否則單純 sleep"""
+    if TELEMETRY: TELEMETRY.wait_update(timeout)
+    else: time.sleep(timeout)
 
 def get_max_file_size_gb():
-    cmd = get_ansible_base_cmd("workers", args="stat -c %s /tmp/traffic_data/*.pcap 2>/dev/null || echo 0")
-    output = run_cmd(cmd, check=False)
+    telemetry = worker_telemetry()
+    if telemetry is not None:
+        return max((snap.get("pcap_max_bytes", 0) for snap in telemetry.values()), default=0) / (1024**3)
+
+    output = joined_stdout(remote_shell("workers", "stat -c %s /tmp/traffic_data/*.pcap 2>/dev/null || echo 0"))
     max_size = 0.0
     if output:
         for line in output.split('\n'):
@@ -147,12 +370,9 @@ def get_max_file_size_gb():
 
 def ensure_service_scale(target_replicas, max_retries=5):
     logging.info(f"Enforcing service scale to {target_replicas}...")
-    scale_cmd = get_ansible_base_cmd("managers", args=f"docker service scale {SERVICE_NAME}={target_replicas}")
-    check_cmd = get_ansible_base_cmd("managers", args=f"docker service ls --filter name={SERVICE_NAME}")
-
     for i in range(max_retries):
-        run_cmd(scale_cmd, check=False)
-        output = run_cmd(check_cmd, check=False)
+        remote_shell("managers", f"docker service scale --detach {SERVICE_NAME}={target_replicas}")
+        output = joined_stdout(remote_shell("managers", f"docker service ls --filter name={SERVICE_NAME}"))
         if output:
             match = re.search(r'\s(\d+)/(\d+)', output)
             if match:
@@ -166,44 +386,543 @@ def ensure_service_scale(target_replicas, max_retries=5):
     logging.error("Failed to enforce scale command after multiple retries!")
     return False
 
+class Autoscaler:
+    """
+    [新增] 依 Worker Telemetry 的實際錄製速率調整容器數 (取代固定 TARGET_REPLICAS)
+    - 速率在目標 ±AUTOSCALE_BAND 內不動作；每次調整後冷卻 AUTOSCALE_COOLDOWN 秒
+    - 依「目前每容器平均產出」估算所需容器數，每次最多變動 AUTOSCALE_MAX_STEP
+    - 任一節點 CPU / 記憶體超過上限即縮減，接近上限時暫停擴張
+    - 依實測每容器記憶體學習 Swarm 的 memory reservation，讓排程器依節點容量放置 (小節點不再被塞到 OOM)
+    """
+
+    def __init__(self, target_mbps, initial_replicas):
+        self.target_mbps = target_mbps
+        self.replicas = max(AUTOSCALE_MIN_REPLICAS, min(AUTOSCALE_MAX_REPLICAS, initial_replicas))
+        self.rate_mbps = None  # EWMA
+        self.last_change = time.monotonic()
+        self.bot_mem_mb = 0.0
+        self.reservation_mb = 0
+
+    @staticmethod
+    def _node_load(snap):
+        mem_total = snap.get("mem_total_bytes", 0)
+        mem_used = 100.0 * (1 - snap.get("mem_available_bytes", 0) / mem_total) if mem_total else 0.0
+        return snap.get("cpu_percent", 0.0), mem_used
+
+    def observe(self, telemetry):
+        rate = sum(snap.get("capture_bps", 0) for snap in telemetry.values()) * 8 / 1e6
+        self.rate_mbps = rate if self.rate_mbps is None else 0.7 * self.rate_mbps + 0.3 * rate
+        # 每容器記憶體取各節點中最大者，作為 reservation 的依據
+        per_bot = [snap["bot_mem_bytes"] / snap["bot_containers"] / (1024**2)
+                   for snap in telemetry.values() if snap.get("bot_containers", 0) > 0 and snap.get("bot_mem_bytes")]
+        if per_bot: self.bot_mem_mb = max(per_bot)
+
+    def decide(self, telemetry):
+        """回傳新的容器數 (不需調整時回傳 None)"""
+        self.observe(telemetry)
+        if time.monotonic() - self.last_change < AUTOSCALE_COOLDOWN: return None
+
+        loads = {host: self._node_load(snap) for host, snap in telemetry.items()}
+        hot = [h for h, (cpu, mem) in loads.items() if cpu > AUTOSCALE_CPU_HIGH or mem > AUTOSCALE_MEM_HIGH]
+        warm = any(cpu > AUTOSCALE_CPU_HIGH - AUTOSCALE_HEADROOM or mem > AUTOSCALE_MEM_HIGH - AUTOSCALE_HEADROOM
+                   for cpu, mem in loads.values())
+        current, rate = self.replicas, self.rate_mbps
+        running = sum(max(0, snap.get("bot_containers", 0)) for snap in telemetry.values()) or current
+        per_bot = rate / running if rate > 0 else 0.0
+
+        if hot:
+            new, reason = current - max(1, min(AUTOSCALE_MAX_STEP, current // 10)), f"overloaded: {', '.join(hot)}"
+        elif rate < self.target_mbps * (1 - AUTOSCALE_BAND):
+            if warm: return None
+            desired = math.ceil(self.target_mbps / per_bot) if per_bot else current + AUTOSCALE_MAX_STEP
+            new, reason = min(desired, current + AUTOSCALE_MAX_STEP), "below target"
+        elif rate > self.target_mbps * (1 + AUTOSCALE_BAND):
+            desired = math.floor(self.target_mbps / per_bot) if per_bot else current
+            new, reason = max(desired, current - AUTOSCALE_MAX_STEP), "above target"
+        else:
+            return None
+
+        new = max(AUTOSCALE_MIN_REPLICAS, min(AUTOSCALE_MAX_REPLICAS, new))
+        if new == current: return None
+        logging.info(f"[Autoscale] {rate:.1f}/{self.target_mbps:.1f} Mbps, {reason}: {current} -> {new} replicas")
+        self.replicas = new
+        self.last_change = time.monotonic()
+        return new
+
+    def suggested_reservation_mb(self):
+        """實測每容器記憶體 +20%，以 50MB 為單位，上限為容器 memory limit"""
+        if not self.bot_mem_mb: return 0
+        return min(BOT_MEMORY_LIMIT_MB, int(math.ceil(self.bot_mem_mb * 1.2 / 50) * 50))
+
+    def apply_placement(self):
+        """
+        套用每節點上限與學到的 memory reservation。
+        修改 reservation 會讓 Swarm 滾動重建所有容器，因此只在容器數為 0 (Round 之間) 時呼叫。
+        """
+        args = []
+        if AUTOSCALE_MAX_PER_NODE: args.append(f"--replicas-max-per-node {AUTOSCALE_MAX_PER_NODE}")
+        reservation = self.suggested_reservation_mb()
+        if reservation and abs(reservation - self.reservation_mb) > max(50, self.reservation_mb * 0.2):
+            args.append(f"--reserve-memory {reservation}M")
+            self.reservation_mb = reservation
+        if not args: return
+        logging.info(f"[Autoscale] Updating placement: {' '.join(args)}")
+        remote_shell("managers", f"docker service update --detach {' '.join(args)} {SERVICE_NAME}")
+
+AUTOSCALER = None
+
+def current_target_replicas():
+    return AUTOSCALER.replicas if AUTOSCALER else TARGET_REPLICAS
+
+def autoscale_tick():
+    """監控迴圈中呼叫：依 Telemetry 決定是否調整容器數"""
+    if not AUTOSCALER: return
+    telemetry = worker_telemetry()
+    if telemetry is None: return
+    new = AUTOSCALER.decide(telemetry)
+    if new is not None: ensure_service_scale(new)
+
 def verify_service_status(target_replicas, retry_times=6):
     logging.info(f"Waiting for containers to reach state (Target: {target_replicas})...")
-    cmd = get_ansible_base_cmd("managers", args=f"docker service ls --filter name={SERVICE_NAME}")
-    for i in range(retry_times):
-        output = run_cmd(cmd, check=False)
+    # [修改] retry_times 換算成時間上限 (每次 5 秒)：Telemetry 每秒推送，收到就重新判斷，不會因推送頻繁提早用完次數
+    start = time.monotonic()
+    deadline = start + retry_times * 5
+    last = None
+    while time.monotonic() < deadline:
+        # [新增] 優先使用 Worker 推送的容器數 (各 Worker 執行中的 traffic-bot 加總)
+        telemetry = worker_telemetry()
+        if telemetry is not None and all(snap.get("bot_containers", -1) >= 0 for snap in telemetry.values()):
+            running = sum(snap["bot_containers"] for snap in telemetry.values())
+            # [新增] 擴增時以通過 HEALTHCHECK (第一個 Session 已開始) 的容器為準；沒有 bot_ready 的舊版 Agent 視同執行中即就緒
+            ready = sum(snap.get("bot_ready", snap["bot_containers"]) for snap in telemetry.values())
+            if (ready, running) != last:
+                print(f"      -> {time.monotonic() - start:.0f}s: {ready} ready / {running} running, target {target_replicas} (telemetry)")
+                last = (ready, running)
+            if (target_replicas > 0 and ready >= target_replicas) or (target_replicas == 0 and running == 0):
+                logging.info(f"Containers reached target in {time.monotonic() - start:.1f}s")
+                return True
+            wait_for_update(5)
+            continue
+
+        # Swarm 在容器通過 HEALTHCHECK 前不會把 Task 算進 running
+        output = joined_stdout(remote_shell("managers", f"docker service ls --filter name={SERVICE_NAME}"))
         if output:
             match = re.search(r'\s(\d+)/(\d+)', output)
             if match:
                 current = int(match.group(1))
                 desired = int(match.group(2))
-                print(f"      -> Attempt {i+1}/{retry_times}: {current}/{desired}")
-                if target_replicas > 0:
-                    if current >= target_replicas: return True
-                else:
-                    if current == 0: return True
+                print(f"      -> {time.monotonic() - start:.0f}s: {current}/{desired}")
+                if (target_replicas > 0 and current >= target_replicas) or (target_replicas == 0 and current == 0):
+                    logging.info(f"Containers reached target in {time.monotonic() - start:.1f}s")
+                    return True
         time.sleep(5)
     return False
 
 def verify_capture_status(retry_times=3):
     logging.info("Verifying tcpdump status...")
-    cmd = get_ansible_base_cmd("workers", args="pgrep -f tcpdump || true")
     for i in range(retry_times):
-        if run_cmd(cmd, check=True): return True
+        telemetry = worker_telemetry()
+        if telemetry is not None:
+            if all(snap.get("tcpdump_running") for snap in telemetry.values()): return True
+            wait_for_update(2)
+            continue
+        # [修改] 逐台確認 (pgrep 找不到時 rc=1)，不再只看整體指令是否有輸出
+        results = remote_shell("workers", "pgrep -x tcpdump")
+        if results and all(r.ok for r in results.values()): return True
         time.sleep(2)
     return False
 
+class SegmentShipper(threading.Thread):
+    """
+    [新增] 串流錄製模式的 Control Node 端回收器
+    每隔 SHIP_INTERVAL 秒以 ship_segments.yml 拉回各 Worker 已壓縮的 Segment，
+    解壓後依 Segment 起始時間 (檔名) 歸入對應的 Round 並命名為 round{N}_{timestamp}_{host}_{segment}.pcap。
+    [新增] 同一趟也拉回 Bot 事件紀錄批次 (<host>_<epoch>.events.jsonl.zst)，逐行依事件時間 t 歸入 Round，
+    附加到 round{N}_{timestamp}_{host}.events.jsonl 並登錄到 Catalog。
+    """
+    SEGMENT_RE = re.compile(r'^(?P<host>.+)_(?P<ts>\d{8}_\d{6})\.pcap(?P<part>\d*)\.zst$')
+    EVENTS_RE = re.compile(r'^(?P<host>.+)_(?P<epoch>\d+)\.events\.jsonl\.zst$')
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self.rounds = []        # [(round_id, timestamp, start_epoch)]，依時間排序
+        self.round_bytes = {}   # round_id -> {host: bytes}
+
+    def _marker_path(self, round_id, timestamp):
+        return os.path.join(DATA_LAKE_DIR, f"round{round_id}_{timestamp}.round.json")
+
+    def _write_marker(self, round_id, timestamp, start, end=None):
+        marker = {"round": round_id, "timestamp": timestamp, "start": start, "end": end,
+                  "bytes": self.round_bytes.get(round_id, {})}
+        with open(self._marker_path(round_id, timestamp), "w", encoding="utf-8") as f:
+            json.dump(marker, f, indent=2)
+
+    def begin_round(self, round_id, timestamp):
+        start = time.time()
+        with self._lock:
+            self.rounds.append((round_id, timestamp, start))
+            self.round_bytes[round_id] = {}
+        self._write_marker(round_id, timestamp, start)
+
+    def end_round(self, round_id):
+        with self._lock:
+            _, timestamp, start = next(r for r in self.rounds if r[0] == round_id)
+            self._write_marker(round_id, timestamp, start, end=time.time())
+
+    def round_max_gb(self, round_id):
+        with self._lock:
+            per_host = self.round_bytes.get(round_id, {})
+            return max(per_host.values(), default=0) / (1024**3)
+
+    def _round_for(self, segment_start):
+        """Segment 歸屬於「起始時間不晚於 Segment 起始」的最後一個 Round"""
+        chosen = self.rounds[0]
+        for r in self.rounds:
+            if r[2] <= segment_start: chosen = r
+        return chosen
+
+    def ship_once(self):
+        cmd = get_playbook_cmd(os.path.join(PLAYBOOK_DIR, "ship_segments.yml"), {
+            "data_lake_dir": DATA_LAKE_DIR,
+            "fetch_parallel": FETCH_PARALLEL,
+            "fetch_budget_mbps": FETCH_BANDWIDTH_MBPS,
+        }, forks=FETCH_PARALLEL)
+        if run_cmd(cmd) is None:
+            logging.warning("Segment shipping pass failed (will resume next pass).")
+        self.organize()
+
+    def organize(self):
+        if not self.rounds or not os.path.isdir(INCOMING_DIR): return
+        for host in os.listdir(INCOMING_DIR):
+            host_dir = os.path.join(INCOMING_DIR, host)
+            if not os.path.isdir(host_dir): continue
+            # 依收集時間排序，同一 Round 的事件依序附加
+            batches = [m for m in map(SegmentShipper.EVENTS_RE.match, os.listdir(host_dir)) if m]
+            for m in sorted(batches, key=lambda m: int(m.group('epoch'))):
+                self._organize_events(host, os.path.join(host_dir, m.group(0)))
+            for filename in sorted(os.listdir(host_dir)):
+                m = SegmentShipper.SEGMENT_RE.match(filename)
+                if not m: continue
+                seg_start = datetime.datetime.strptime(m.group('ts'), "%Y%m%d_%H%M%S").timestamp()
+                with self._lock:
+                    round_id, timestamp, _ = self._round_for(seg_start)
+                new_name = f"round{round_id}_{timestamp}_{m.group('host')}_{m.group('ts')}{m.group('part')}.pcap"
+                dst = os.path.join(DATA_LAKE_DIR, new_name)
+                if run_cmd(["zstd", "-d", "-q", "-f", "--rm", os.path.join(host_dir, filename), "-o", dst]) is None:
+                    logging.warning(f"Failed to decompress segment {filename}")
+                    continue
+                with self._lock:
+                    per_host = self.round_bytes.setdefault(round_id, {})
+                    per_host[host] = per_host.get(host, 0) + os.path.getsize(dst)
+                catalog_ingest([dst])
+
+    def _organize_events(self, host, src):
+        """解壓一個事件批次，逐行依 t 歸入 Round (無法解析的行歸入最後一個 Round)"""
+        tmp = src[:-len(".zst")]
+        if run_cmd(["zstd", "-d", "-q", "-f", src, "-o", tmp]) is None:
+            logging.warning(f"Failed to decompress events {os.path.basename(src)}")
+            return
+        per_round = {}
+        with open(tmp, "rb") as f:
+            for line in f:
+                if not line.strip(): continue
+                try: t = float(json.loads(line)["t"])
+                except (ValueError, KeyError, TypeError): t = None
+                with self._lock:
+                    round_id, timestamp, _ = self._round_for(t) if t is not None else self.rounds[-1]
+                per_round.setdefault((round_id, timestamp), []).append(line if line.endswith(b"\n") else line + b"\n")
+        written = []
+        for (round_id, timestamp), lines in per_round.items():
+            dst = os.path.join(DATA_LAKE_DIR, f"round{round_id}_{timestamp}_{host}.events.jsonl")
+            with open(dst, "ab") as f:
+                f.writelines(lines)
+            written.append(dst)
+        os.remove(src)
+        os.remove(tmp)
+        catalog_ingest(written)
+
+    def run(self):
+        while not self._stop_event.wait(SHIP_INTERVAL):
+            try: self.ship_once()
+            except Exception as e: logging.error(f"Segment shipper error: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+def wait_for_shipper_idle(timeout=DRAIN_TIMEOUT, interval=5):
+    """
+    [新增] 等各 Worker 的 segment_shipper.sh 壓縮完最後的 Segment 並結束 (outbox 中也沒有壓縮到一半的 .tmp)，
+    逾時仍未完成時回傳這些主機 (連不上的主機也算在內)
+    """
+    cmd = ("pgrep -f '[s]egment_shipper.sh' > /dev/null && echo busy; "
+           "ls /tmp/traffic_data/outbox 2>/dev/null | grep -q '\\.tmp$' && echo busy; true")
+    deadline = time.time() + timeout
+    while True:
+        results = remote_shell("workers", cmd, timeout=30)
+        pending = sorted(host for host, r in results.items() if not r.ok or "busy" in r.stdout)
+        if not pending or time.time() >= deadline: return pending
+        time.sleep(interval)
+
+def run_streaming_rounds():
+    """[新增] 串流錄製：容器與 tcpdump 全程不中斷，Round 之間只寫入邊界標記"""
+    if AUTOSCALER: AUTOSCALER.apply_placement()
+    if not ensure_service_scale(current_target_replicas()): raise RuntimeError("Scale command failed")
+    if not verify_service_status(target_replicas=current_target_replicas(), retry_times=60):
+        raise RuntimeError("Containers failed to start")
+
+    logging.info(f"Starting rotating tcpdump (every {ROTATE_SECONDS}s{f' / {ROTATE_MB}MB' if ROTATE_MB else ''})...")
+    run_cmd(get_playbook_cmd(os.path.join(PLAYBOOK_DIR, "start_capture.yml"), {
+        "capture_mode": "rotate", "rotate_seconds": ROTATE_SECONDS, "rotate_mb": ROTATE_MB}))
+    if not verify_capture_status(): raise RuntimeError("Capture failed")
+
+    shipper = SegmentShipper()
+    shipper.start()
+    try:
+        for round_id in range(1, MAX_ROUNDS + 1):
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            logging.info(f">>> [Round {round_id}/{MAX_ROUNDS}] Start Time: {timestamp} (streaming)")
+            mark_round_start(round_id, timestamp)
+            shipper.begin_round(round_id, timestamp)
+
+            monitor_until_threshold(lambda: shipper.round_max_gb(round_id), label="Shipped (max/worker)")
+
+            record_round(round_id, timestamp)
+            shipper.end_round(round_id)
+            logging.info(f"Round {round_id} boundary marked; capture continues.")
+    finally:
+        # 全部結束：停止流量與錄製，等 Worker 壓縮完最後的 Segment 再收一次
+        logging.info("Stopping traffic and capture, draining remaining segments...")
+        ensure_service_scale(0)
+        remote_shell("workers", "pkill tcpdump || true")
+        shipper.stop()
+        shipper.join()
+        # [修改] 不再固定等待：確認 Worker 都已壓縮完畢再做最後一趟回收
+        pending = wait_for_shipper_idle()
+        if pending: logging.warning(f"Segment shipper still busy after {DRAIN_TIMEOUT}s on {', '.join(pending)}; shipping what is ready.")
+        shipper.ship_once()
+        for round_id, timestamp, start in shipper.rounds:
+            logging.info(f"Round {round_id}: {sum(shipper.round_bytes.get(round_id, {}).values()) / (1024**3):.2f} GB collected.")
+
+def monitor_until_threshold(size_fn=None, label="Max File Size"):
+    """每次收到 Telemetry (或每 10 秒) 檢查一次，直到單一 Worker 的錄製量達 THRESHOLD_GB"""
+    size_fn = size_fn or get_max_file_size_gb
+    start_time = time.time()
+    while True:
+        max_gb = size_fn()
+        elapsed = int(time.time() - start_time)
+        sys.stdout.write(f"\r      -> {label}: {max_gb:.4f} GB / {THRESHOLD_GB} GB (Elapsed: {elapsed}s)")
+        sys.stdout.flush()
+        if max_gb >= THRESHOLD_GB:
+            print("\n")
+            logging.info("Threshold reached!")
+            return
+        autoscale_tick()
+        wait_for_update(10)
+
+CATALOG = None
+SITES_REVISION = None
+ACTIVE_ROUND = None  # 正在錄製的 (round_id, timestamp)，緊急回收時使用
+
+STAGING_DIR_RE = re.compile(r'^round(?P<round>\d+)_(?P<ts>\d{8}_\d{6})$')
+
+def staging_dir(round_id, timestamp):
+    """[新增] 每輪獨立的接收目錄：晚到的檔案不會被誤算到下一輪"""
+    return os.path.join(PENDING_DIR, f"round{round_id}_{timestamp}")
+
+def get_sites_revision():
+    """[新增] 本次部署使用的 sites.json 版本 (SHA256 前 12 碼)；讀不到 Manager 上的檔案時改用本機 src/sites.json"""
+    try:
+        for r in remote_shell("managers", f"sha256sum {SITES_CONFIG_REMOTE}", timeout=15).values():
+            if r.ok and r.stdout: return r.stdout.split()[0][:12]
+    except Exception: pass
+    try:
+        with open(SITES_CONFIG_LOCAL, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()[:12]
+    except OSError:
+        return None
+
+def record_round(round_id, timestamp):
+    """[新增] 在 Catalog 記下 Round 的容器數與 sites.json 版本 (Round 開始與結束時各記一次，以結束時為準)"""
+    if not CATALOG: return
+    try: CATALOG.record_round(round_id, timestamp, replicas=current_target_replicas(), sites_revision=SITES_REVISION)
+    except Exception as e: logging.warning(f"[Catalog] Failed to record round {round_id}: {e}")
+
+def mark_round_start(round_id, timestamp):
+    global ACTIVE_ROUND
+    ACTIVE_ROUND = (round_id, timestamp)
+    record_round(round_id, timestamp)
+
+def catalog_ingest(paths):
+    """登錄 pcap 與事件紀錄 (兩者各自依檔名挑出符合命名規則的檔案)"""
+    if not CATALOG or not paths: return
+    try:
+        CATALOG.ingest(paths)
+        CATALOG.ingest_events(paths)
+    except Exception as e: logging.warning(f"[Catalog] Ingestion failed ({e}); run 'catalog.py scan' to catch up.")
+
+def organize_round(round_id, timestamp, src_dir):
+    """
+    [修改] 將本輪接收目錄中的 <host>.pcap 改名為 round{N}_{timestamp}_<host>.pcap 移入 Data Lake 並登錄到 Catalog，回傳新路徑列表
+    只列出本輪的接收目錄 (檔案數 = Worker 數)，不再掃描整個 Data Lake
+    [新增] Bot 事件紀錄 <host>.events.jsonl 以相同前綴放在 pcap 旁邊，登錄到 Catalog 的 events 表 (不列入回傳值)
+    """
+    organized, events = [], []
+    if not os.path.isdir(src_dir): return organized
+    for filename in sorted(os.listdir(src_dir)):
+        if not filename.endswith((".pcap", ".events.jsonl")): continue
+        try:
+            new_name = f"round{round_id}_{timestamp}_{filename}"
+            os.rename(os.path.join(src_dir, filename), os.path.join(DATA_LAKE_DIR, new_name))
+            logging.info(f"Renamed: {filename} -> {new_name}")
+            (organized if filename.endswith(".pcap") else events).append(os.path.join(DATA_LAKE_DIR, new_name))
+        except OSError: pass
+    catalog_ingest(organized + events)
+    # 傳輸或校驗失敗留下的 .zst / .sha256 會讓目錄保留，下次啟動時由 reconcile_pending() 再處理
+    try: os.rmdir(src_dir)
+    except OSError: pass
+    return organized
+
+def reconcile_pending():
+    """[新增] 啟動時處理上次中斷或晚到的接收目錄，依目錄名稱歸回原本的 Round"""
+    if not os.path.isdir(PENDING_DIR): return
+    for entry in os.scandir(PENDING_DIR):
+        m = STAGING_DIR_RE.match(entry.name)
+        if not m or not entry.is_dir(): continue
+        organized = organize_round(int(m.group('round')), m.group('ts'), entry.path)
+        if organized: logging.info(f"[Catalog] Recovered {len(organized)} late files for {entry.name}")
+
+def fetch_round(round_id, timestamp, capture_dir=None, quiet=False):
+    """
+    [修改] 傳輸 (含重試) + 改名，原本寫在 main 迴圈中的步驟 6、7。
+    檔案一律先收到本輪的 pending/round{N}_{timestamp}/ 再改名登錄，避免與其他 Round 的同名檔案衝突。
+    capture_dir 為 Worker 上已移出的 Round 目錄 (管線化模式)。
+    """
+    dest_dir = staging_dir(round_id, timestamp)
+    os.makedirs(dest_dir, exist_ok=True)
+    logging.info(f"[Round {round_id}] Fetching files (parallel={FETCH_PARALLEL}, budget={FETCH_BANDWIDTH_MBPS or 'unlimited'} Mbps)...")
+    fetch_success = False
+    max_retries = 3
+
+    for attempt in range(max_retries):
+        # 判斷是否為最後一次嘗試
+        is_last_attempt = (attempt == max_retries - 1)
+
+        if attempt > 0:
+            logging.warning(f"[Round {round_id}] Retry transfer in 20s (Attempt {attempt+1}/{max_retries}, resuming partial files)...")
+            time.sleep(20)
+
+        if is_last_attempt:
+            logging.warning(f"[Round {round_id}] !!! LAST ATTEMPT: Unverified files will be set aside on workers (unfetched/) !!!")
+
+        # 執行 Playbook：重試時 rsync 會從上次中斷處續傳
+        if run_cmd_stream(get_fetch_cmd(force_cleanup=is_last_attempt, capture_dir=capture_dir, dest_dir=dest_dir),
+                          description=f"Round {round_id} Download (Attempt {attempt+1})", timeout=3600, quiet=quiet):
+            logging.info(f"[Round {round_id}] Transfer process completed successfully.")
+            fetch_success = True
+            break
+        else:
+            logging.warning(f"[Round {round_id}] This transfer attempt failed.")
+
+    if not fetch_success:
+        logging.error(f"[Round {round_id}] All transfer attempts failed! (Compressed copies kept in unfetched/ on workers)")
+
+    logging.info(f"[Round {round_id}] Organizing files...")
+    organized = organize_round(round_id, timestamp, dest_dir)
+    if EXTRACT_FLOWS and organized: extract_flows(round_id, organized)
+    if BUILD_PCAP_INDEX and organized: build_pcap_index(round_id, organized)
+    logging.info(f"Round {round_id} completed. {len(organized)} files processed.")
+    return fetch_success
+
+def extract_flows(round_id, paths):
+    """[新增] 以 analysis/extract_flows.py 將本輪的 pcap 轉為 Flow 特徵 (獨立行程，多核心平行)"""
+    logging.info(f"[Round {round_id}] Extracting flow features -> {FLOW_DATASET_DIR}")
+    cmd = [sys.executable, os.path.join(ANALYSIS_DIR, "extract_flows.py"), "--out", FLOW_DATASET_DIR, *paths]
+    if subprocess.run(cmd).returncode != 0:
+        logging.warning(f"[Round {round_id}] Flow extraction failed (rerun analysis/extract_flows.py manually).")
+
+def build_pcap_index(round_id, paths):
+    """[新增] 以 analysis/pcap_index.py 為本輪的 pcap 建立 sidecar 索引"""
+    logging.info(f"[Round {round_id}] Building pcap time/flow index...")
+    cmd = [sys.executable, os.path.join(ANALYSIS_DIR, "pcap_index.py"), "build", *paths]
+    if subprocess.run(cmd).returncode != 0:
+        logging.warning(f"[Round {round_id}] Index build failed (it is rebuilt on first query).")
+
+def close_capture_round(round_id, restart):
+    """[新增] 停止 tcpdump、將本輪檔案移到 Worker 的 rounds/round{N}/，並 (restart=True 時) 立即重新開始錄製"""
+    round_dir = f"{WORKER_ROUNDS_DIR}/round{round_id}"
+    run_cmd(get_playbook_cmd(os.path.join(PLAYBOOK_DIR, "rotate_round.yml"), {
+        "round_dir": round_dir, "restart_capture": "yes" if restart else "no"}))
+    return round_dir
+
+def run_pipelined_rounds():
+    """
+    [新增] 管線化 Round：容器全程不停，Round 結束時只把錄製檔移到一旁並立即開始下一輪，
+    上一輪的傳輸與改名在背景執行 (同時最多 PIPELINE_ROUNDS 輪)，叢集不再於傳輸/冷卻期間閒置。
+    """
+    if AUTOSCALER: AUTOSCALER.apply_placement()
+    if not ensure_service_scale(current_target_replicas()): raise RuntimeError("Scale command failed")
+    if not verify_service_status(target_replicas=current_target_replicas(), retry_times=60):
+        raise RuntimeError("Containers failed to start")
+
+    logging.info("Starting tcpdump...")
+    run_cmd(get_playbook_cmd(os.path.join(PLAYBOOK_DIR, "start_capture.yml")))
+    if not verify_capture_status(): raise RuntimeError("Capture failed")
+
+    executor = ThreadPoolExecutor(max_workers=PIPELINE_ROUNDS, thread_name_prefix="fetch")
+    futures = {}
+    try:
+        for round_id in range(1, MAX_ROUNDS + 1):
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            in_flight = sum(1 for f in futures.values() if not f.done())
+            logging.info(f">>> [Round {round_id}/{MAX_ROUNDS}] Start Time: {timestamp} (pipelined, {in_flight} fetch in flight)")
+            mark_round_start(round_id, timestamp)
+
+            logging.info("Recording traffic...")
+            monitor_until_threshold()
+
+            record_round(round_id, timestamp)
+            is_last_round = (round_id == MAX_ROUNDS)
+            if is_last_round:
+                # 最後一輪才停止流量，讓連線正常結束後再收尾
+                if not ensure_service_scale(0): raise RuntimeError("Stop command failed")
+                verify_service_status(target_replicas=0, retry_times=60)
+                print("      -> Waiting 60s for connections to close...")
+                time.sleep(60)
+
+            round_dir = close_capture_round(round_id, restart=not is_last_round)
+            if not is_last_round and not verify_capture_status(): raise RuntimeError("Capture failed")
+            futures[round_id] = executor.submit(fetch_round, round_id, timestamp, round_dir, True)
+            logging.info(f"Round {round_id} moved aside; transfer queued in background.")
+    finally:
+        logging.info("Waiting for background transfers to finish...")
+        executor.shutdown(wait=True)
+        for round_id, future in futures.items():
+            ok = future.exception() is None and future.result()
+            if not ok: logging.error(f"Round {round_id} transfer incomplete (data kept under {WORKER_ROUNDS_DIR} on workers).")
+
 def cleanup_on_exit():
     logging.warning("!!! INTERRUPTED !!! Performing EMERGENCY CLEANUP...")
-    try: run_cmd(get_ansible_base_cmd("managers", args=f"docker service scale {SERVICE_NAME}=0"), check=False)
+    # [修改] 經由持久連線同時送出，不必等 ansible 逐一啟動
+    try: remote_shell("managers", f"docker service scale --detach {SERVICE_NAME}=0", timeout=15)
     except: pass
-    try: run_cmd(get_ansible_base_cmd("workers", args="pkill tcpdump || true"), check=False)
+    try: remote_shell("workers", "pkill tcpdump || true", timeout=15)
     except: pass
-    try: run_cmd_stream(get_playbook_cmd(os.path.join(PLAYBOOK_DIR, "stop_and_fetch.yml")), description="Emergency Fetch")
+    # [修改] 收到正在錄製的 Round 的接收目錄並登錄 (未完成的部分下次啟動時由 reconcile_pending 處理)
+    try:
+        if ACTIVE_ROUND:
+            dest_dir = staging_dir(*ACTIVE_ROUND)
+            os.makedirs(dest_dir, exist_ok=True)
+            run_cmd_stream(get_fetch_cmd(dest_dir=dest_dir), description="Emergency Fetch")
+            organize_round(*ACTIVE_ROUND, dest_dir)
+        else:
+            run_cmd_stream(get_fetch_cmd(), description="Emergency Fetch")
     except: pass
     logging.info("!!! CLEANUP COMPLETE !!!")
 
 def main():
-    global SUDO_PASSWORD, THRESHOLD_GB, MAX_ROUNDS, TARGET_REPLICAS
+    global SUDO_PASSWORD, THRESHOLD_GB, MAX_ROUNDS, TARGET_REPLICAS, AUTOSCALER, CATALOG, SITES_REVISION
     print(f"=== Auto-Traffic-Pipeline Started ===")
     
     if not SUDO_PASSWORD:
@@ -214,18 +933,48 @@ def main():
     print("\n--- 設定參數 ---")
     THRESHOLD_GB = get_input_value("2. 檔案上限 (GB)", DEFAULT_THRESHOLD_GB, float)
     MAX_ROUNDS = get_input_value("3. 輪數", DEFAULT_MAX_ROUNDS, int)
-    TARGET_REPLICAS = get_input_value("4. 容器數", DEFAULT_TARGET_REPLICAS, int)
+    TARGET_REPLICAS = get_input_value("4. 容器數" + (" (自動擴縮起始值)" if AUTOSCALE_TARGET_MBPS else ""), DEFAULT_TARGET_REPLICAS, int)
+
+    if AUTOSCALE_TARGET_MBPS:
+        if TELEMETRY_PORT:
+            AUTOSCALER = Autoscaler(AUTOSCALE_TARGET_MBPS, TARGET_REPLICAS)
+            logging.info(f"Autoscaling enabled: target {AUTOSCALE_TARGET_MBPS} Mbps "
+                         f"({AUTOSCALE_MIN_REPLICAS}-{AUTOSCALE_MAX_REPLICAS} replicas)")
+        else:
+            logging.warning("AUTOSCALE_TARGET_MBPS requires TELEMETRY_PORT; using fixed replica count.")
     
     os.makedirs(DATA_LAKE_DIR, exist_ok=True)
+    try:
+        CATALOG = Catalog(CATALOG_PATH, DATA_LAKE_DIR)
+    except Exception as e:
+        logging.warning(f"[Catalog] Cannot open {CATALOG_PATH} ({e}); captures will not be catalogued.")
 
     try:
+        start_orchestrator()
+        if TELEMETRY_PORT: start_telemetry()
+        SITES_REVISION = get_sites_revision()
+        logging.info(f"[Catalog] sites.json revision: {SITES_REVISION or 'unknown'}")
+        reconcile_pending()
+
+        if CAPTURE_MODE == "stream":
+            run_streaming_rounds()
+            logging.info("All Rounds Completed Successfully.")
+            return
+
+        if PIPELINE_ROUNDS > 0:
+            run_pipelined_rounds()
+            logging.info("All Rounds Completed Successfully.")
+            return
+
         for round_id in range(1, MAX_ROUNDS + 1):
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
             logging.info(f">>> [Round {round_id}/{MAX_ROUNDS}] Start Time: {timestamp}")
+            mark_round_start(round_id, timestamp)
 
-            # 1. 啟動流量
-            if not ensure_service_scale(TARGET_REPLICAS): raise RuntimeError("Scale command failed")
-            if not verify_service_status(target_replicas=TARGET_REPLICAS, retry_times=60): 
+            # 1. 啟動流量 (自動擴縮時沿用上一輪收斂的容器數)
+            if AUTOSCALER: AUTOSCALER.apply_placement()
+            if not ensure_service_scale(current_target_replicas()): raise RuntimeError("Scale command failed")
+            if not verify_service_status(target_replicas=current_target_replicas(), retry_times=60): 
                 raise RuntimeError("Containers failed to start")
 
             # 2. 啟動錄製
@@ -235,17 +984,8 @@ def main():
             
             # 3. 監控
             logging.info("Recording traffic...")
-            start_time = time.time()
-            while True:
-                max_gb = get_max_file_size_gb()
-                elapsed = int(time.time() - start_time)
-                sys.stdout.write(f"\r      -> Max File Size: {max_gb:.4f} GB / {THRESHOLD_GB} GB (Elapsed: {elapsed}s)")
-                sys.stdout.flush()
-                if max_gb >= THRESHOLD_GB:
-                    print("\n")
-                    logging.info("Threshold reached!")
-                    break
-                time.sleep(10)
+            monitor_until_threshold()
+            record_round(round_id, timestamp)
 
             # 4. 停止流量
             if not ensure_service_scale(0): raise RuntimeError("Stop command failed")
@@ -255,56 +995,12 @@ def main():
 
             # 5. 全域停止 Tcpdump
             logging.info("Stopping tcpdump globally...")
-            run_cmd(get_ansible_base_cmd("workers", args="pkill tcpdump || true"))
+            remote_shell("workers", "pkill tcpdump || true")
             time.sleep(5)
 
-            # 6. Fetch (Serial + Retry + Last Resort Cleanup)
-            logging.info("Fetching files...")
-            fetch_success = False
-            max_retries = 3
-            
-            for attempt in range(max_retries):
-                # 判斷是否為最後一次嘗試
-                is_last_attempt = (attempt == max_retries - 1)
-                
-                # 如果是最後一次，傳入 force_cleanup=yes
-                current_vars = {"force_cleanup": "yes"} if is_last_attempt else {"force_cleanup": "no"}
-
-                if attempt > 0:
-                    logging.warning(f"Retry transfer in 20s (Attempt {attempt+1}/{max_retries})...")
-                    time.sleep(20)
-                
-                if is_last_attempt:
-                    logging.warning("!!! LAST ATTEMPT: Files will be deleted even if transfer fails !!!")
+            # 6. Fetch (Parallel + Compressed + Resume + Checksum) + 7. Rename
+            fetch_round(round_id, timestamp)
 
-                # 執行 Playbook 並帶入變數
-                cmd = get_playbook_cmd(os.path.join(PLAYBOOK_DIR, "stop_and_fetch.yml"), extra_vars_dict=current_vars)
-                
-                if run_cmd_stream(cmd, description=f"Downloading Data (Attempt {attempt+1})", timeout=3600):
-                    logging.info("Transfer process completed successfully.")
-                    fetch_success = True
-                    break
-                else:
-                    logging.warning("This transfer attempt failed.")
-            
-            if not fetch_success: 
-                logging.error("All transfer attempts failed! (Remote files cleaned up)")
-
-            # 7. Rename
-            logging.info(f"Organizing files...")
-            count = 0
-            if os.path.exists(DATA_LAKE_DIR):
-                files = os.listdir(DATA_LAKE_DIR)
-                for filename in files:
-                    if filename.endswith(".pcap") and not filename.startswith("round"):
-                        try:
-                            new_name = f"round{round_id}_{timestamp}_{filename}"
-                            os.rename(os.path.join(DATA_LAKE_DIR, filename), os.path.join(DATA_LAKE_DIR, new_name))
-                            logging.info(f"Renamed: {filename} -> {new_name}")
-                            count += 1
-                        except OSError: pass
-            
-            logging.info(f"Round {round_id} completed. {count} files processed.")
             print("      -> Cooling down for 10s...")
             time.sleep(10)
 
@@ -318,6 +1014,9 @@ def main():
         logging.error(f"Unexpected error: {e}")
         cleanup_on_exit()
         sys.exit(1)
+    finally:
+        if ORCHESTRATOR: ORCHESTRATOR.close()
+        if CATALOG: CATALOG.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,24 @@
+#!/bin/sh
+# Worker 端收集 Bot 的事件紀錄
+# 每個容器在 <events 目錄> 寫一個 <容器>.jsonl；先整批移走 (Bot 下一次寫入會自動建立新檔)，
+# 稍等進行中的寫入完成後，附加到 <輸出檔> (與同一輪的 pcap 放在一起傳回 Control Node)
+# 用法: collect_events.sh <events 目錄> <輸出檔>
+
+EVENTS_DIR=${1:-/tmp/traffic_data/events}
+OUT_FILE=$2
+
+[ -d "$EVENTS_DIR" ] || exit 0
+WORK_DIR="$EVENTS_DIR/.collect.$$"
+mkdir -p "$WORK_DIR"
+
+for f in "$EVENTS_DIR"/*.jsonl; do
+    [ -e "$f" ] && mv "$f" "$WORK_DIR/"
+done
+
+if ls "$WORK_DIR"/*.jsonl > /dev/null 2>&1; then
+    # Bot 每次寫入都是 open-append-close，移走前已開啟的檔案在 1 秒內就會寫完
+    sleep 1
+    mkdir -p "$(dirname "$OUT_FILE")"
+    cat "$WORK_DIR"/*.jsonl >> "$OUT_FILE"
+fi
+rm -rf "$WORK_DIR"
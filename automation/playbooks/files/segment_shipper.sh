@@ -0,0 +1,30 @@
+#!/bin/sh
+# 輪替錄製模式的 Worker 端壓縮迴圈
+# 將 tcpdump 已關閉的 Segment 以 zstd 壓縮後移到 outbox，由 Control Node 的 ship_segments.yml 拉回並刪除
+# 用法: segment_shipper.sh <segments 目錄> <outbox 目錄> [檢查間隔秒數]
+
+SEG_DIR=${1:-/tmp/traffic_data/segments}
+OUT_DIR=${2:-/tmp/traffic_data/outbox}
+INTERVAL=${3:-10}
+
+mkdir -p "$OUT_DIR"
+
+while :; do
+    if pgrep -x tcpdump > /dev/null; then
+        # 依修改時間排序，最新的一個仍在寫入中，先略過
+        closed=$(ls -1tr "$SEG_DIR" 2>/dev/null | grep '\.pcap' | head -n -1)
+    else
+        closed=$(ls -1tr "$SEG_DIR" 2>/dev/null | grep '\.pcap')
+    fi
+
+    for f in $closed; do
+        # 先寫成 .tmp 再改名，避免 rsync 拉到壓縮到一半的檔案
+        zstd -T2 -q -f --rm "$SEG_DIR/$f" -o "$OUT_DIR/$f.zst.tmp" && mv "$OUT_DIR/$f.zst.tmp" "$OUT_DIR/$f.zst"
+    done
+
+    # tcpdump 已停止且 Segment 全部處理完畢即結束
+    if ! pgrep -x tcpdump > /dev/null && [ -z "$(ls -A "$SEG_DIR" 2>/dev/null)" ]; then
+        break
+    fi
+    sleep "$INTERVAL"
+done
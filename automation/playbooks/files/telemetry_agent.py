@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+【Worker Telemetry Agent】
+在每台 Worker 上常駐，透過一條長連線每秒把錄製與容器狀態推送給 Control Node 的 pipeline_manager，
+取代每 10 秒一次的 ansible stat / pgrep / docker service ls 輪詢。
+只使用標準函式庫 (Worker 上只有系統內建的 python3)。
+
+每行一筆 JSON，例如:
+{"host": "worker1", "ts": 1700000000.0, "pcap_max_bytes": 123, "capture_bytes": 456, "capture_bps": 1250000.0,
+ "rx_pps": 1500.0, "rx_dropped": 0, "tcpdump_running": true, "disk_free_bytes": 789, "bot_containers": 10, "bot_ready": 8,
+ "bot_mem_bytes": 4000000000, "cpu_percent": 63.5, "mem_total_bytes": 8000000000, "mem_available_bytes": 2000000000}
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import time
+from urllib.parse import quote
+
+CAPTURE_DIR = "/tmp/traffic_data"
+DOCKER_SOCK = "/var/run/docker.sock"
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """透過 Docker 的 Unix Socket 呼叫 Engine API (不必 fork docker CLI)"""
+
+    def __init__(self, path, timeout=2):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.unix_path)
+        self.sock = sock
+
+
+def list_bot_containers(name_filter):
+    """
+    回傳執行中 traffic-bot 容器 {ID: 是否就緒} (Docker API 失敗時回傳 None)
+    [修改] 映像檔有 HEALTHCHECK 時，Status 為 "(health: starting)" / "(unhealthy)" 的容器尚未就緒
+    """
+    try:
+        conn = UnixHTTPConnection(DOCKER_SOCK)
+        filters = json.dumps({"name": [name_filter], "status": ["running"]})
+        conn.request("GET", "/containers/json?filters=" + quote(filters))
+        resp = conn.getresponse()
+        data = resp.read()
+        conn.close()
+        if resp.status != 200: return None
+        return {c["Id"]: not any(s in c.get("Status", "") for s in ("health: starting", "unhealthy"))
+                for c in json.loads(data)}
+    except (OSError, ValueError, KeyError, http.client.HTTPException):
+        return None
+
+
+# [新增] 容器記憶體直接讀 cgroup (docker stats API 每個容器要 1~2 秒，不適合每秒呼叫)
+CGROUP_MEMORY_PATHS = (
+    "/sys/fs/cgroup/system.slice/docker-{id}.scope/memory.current",   # cgroup v2 + systemd
+    "/sys/fs/cgroup/docker/{id}/memory.current",                      # cgroup v2 + cgroupfs
+    "/sys/fs/cgroup/memory/docker/{id}/memory.usage_in_bytes",        # cgroup v1
+)
+
+
+def container_memory(container_id):
+    for path in CGROUP_MEMORY_PATHS:
+        try:
+            with open(path.format(id=container_id)) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            continue
+    return 0
+
+
+def capture_files():
+    """回傳錄製目錄下所有檔案 {path: (inode, size)}"""
+    files = {}
+    for root, _, names in os.walk(CAPTURE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try: st = os.stat(path)
+            except OSError: continue
+            files[path] = (st.st_ino, st.st_size)
+    return files
+
+
+def read_cpu_times():
+    """/proc/stat: 回傳 (busy, total) jiffies"""
+    try:
+        with open("/proc/stat") as f:
+            fields = [int(x) for x in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return 0, 0
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle + iowait
+    total = sum(fields[:8])
+    return total - idle, total
+
+
+def read_meminfo():
+    """/proc/meminfo: 回傳 (MemTotal, MemAvailable) bytes"""
+    info = {}
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                info[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        pass
+    return info.get("MemTotal", 0), info.get("MemAvailable", 0)
+
+
+def read_iface_counters(iface):
+    """/proc/net/dev: 回傳 (rx_packets, rx_dropped)"""
+    try:
+        with open("/proc/net/dev") as f:
+            for line in f:
+                if ":" not in line: continue
+                name, data = line.split(":", 1)
+                if name.strip() == iface:
+                    fields = data.split()
+                    return int(fields[1]), int(fields[3])
+    except OSError:
+        pass
+    return 0, 0
+
+
+def tcpdump_running():
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit(): continue
+        try:
+            with open(f"/proc/{pid}/comm") as f:
+                if f.read().strip() == "tcpdump": return True
+        except OSError:
+            continue
+    return False
+
+
+class Collector:
+    def __init__(self, host, iface, container_filter):
+        self.host = host
+        self.iface = iface
+        self.container_filter = container_filter
+        self._last = None  # (monotonic, rx_packets, cpu_busy, cpu_total)
+        self._last_files = {}
+
+    def snapshot(self):
+        now = time.monotonic()
+        rx_packets, rx_dropped = read_iface_counters(self.iface)
+        cpu_busy, cpu_total = read_cpu_times()
+        files = capture_files()
+        # [新增] 錄製成長量：只計 .pcap，依 inode 逐檔累加正向增量
+        # (輪替產生的新檔從 0 起算；被搬到 rounds/ 的檔案 inode 不變，不會重複計算；壓縮產物不計入)
+        pcaps = {ino: size for path, (ino, size) in files.items() if path.endswith(".pcap")}
+        grown = sum(max(0, size - self._last_files.get(ino, 0)) for ino, size in pcaps.items())
+
+        rx_pps = capture_bps = cpu_percent = 0.0
+        if self._last:
+            dt = now - self._last[0]
+            if dt > 0:
+                rx_pps = max(0, rx_packets - self._last[1]) / dt
+                capture_bps = grown / dt
+            if cpu_total > self._last[3]:
+                cpu_percent = 100.0 * (cpu_busy - self._last[2]) / (cpu_total - self._last[3])
+        self._last = (now, rx_packets, cpu_busy, cpu_total)
+        self._last_files = pcaps
+
+        pcap_max = max((size for path, (_, size) in files.items()
+                        if os.path.dirname(path) == CAPTURE_DIR and path.endswith(".pcap")), default=0)
+        containers = list_bot_containers(self.container_filter)
+        mem_total, mem_available = read_meminfo()
+        st = os.statvfs(CAPTURE_DIR if os.path.isdir(CAPTURE_DIR) else "/tmp")
+        return {
+            "host": self.host,
+            "ts": time.time(),
+            "pcap_max_bytes": pcap_max,
+            "capture_bytes": sum(size for _, size in files.values()),
+            "capture_bps": round(capture_bps, 1),
+            "rx_pps": round(rx_pps, 1),
+            "rx_dropped": rx_dropped,
+            "tcpdump_running": tcpdump_running(),
+            "disk_free_bytes": st.f_bavail * st.f_frsize,
+            "bot_containers": -1 if containers is None else len(containers),
+            "bot_ready": -1 if containers is None else sum(containers.values()),
+            "bot_mem_bytes": sum(container_memory(c) for c in containers or ()),
+            "cpu_percent": round(cpu_percent, 1),
+            "mem_total_bytes": mem_total,
+            "mem_available_bytes": mem_available,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker telemetry agent")
+    parser.add_argument("--manager", required=True, help="Control Node 位址 host:port")
+    parser.add_argument("--host", default=socket.gethostname(), help="回報時使用的主機名稱 (inventory_hostname)")
+    parser.add_argument("--iface", default="eth0", help="錄製網卡")
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--container-filter", default="traffic-bot")
+    args = parser.parse_args()
+
+    manager_host, manager_port = args.manager.rsplit(":", 1)
+    collector = Collector(args.host, args.iface, args.container_filter)
+    backoff = 1.0
+
+    while True:
+        try:
+            with socket.create_connection((manager_host, int(manager_port)), timeout=5) as sock:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                backoff = 1.0
+                while True:
+                    line = json.dumps(collector.snapshot(), separators=(",", ":")) + "\n"
+                    sock.sendall(line.encode())
+                    time.sleep(args.interval)
+        except OSError:
+            # Control Node 尚未啟動或連線中斷：指數退避後重連
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+
+if __name__ == "__main__":
+    main()
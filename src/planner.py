@@ -0,0 +1,409 @@
+"""
+【Session Plan 產生器】
+以 NumPy 批次預先產生每個 Replica 的 Session 計畫 (Persona、動作序列、目標、停留時間、協定事件)，
+取代在 Event Loop 熱路徑中逐次呼叫 random / np.random：
+- 由主種子 (PLAN_SEED) + Replica 編號 (REPLICA_ID = Swarm 的 {{.Task.Slot}}) + 區塊編號推導 SeedSequence，
+  同樣的設定一定產生同樣的計畫，可重播；每個 Replica 的計畫與 Replica 總數無關
+- 計畫是幾個緊湊的陣列 (每個動作 12 bytes)，依區塊 (每區塊 256 個 Session / 1 小時的協定事件) 需要時才產生
+- 不依賴 Playwright，可在 Control Node 上離線 dry run，估計一輪的流量與 Flow 數
+
+Session 內的細部行為 (捲動、滑鼠軌跡、點哪個連結) 仍在執行時決定，但使用計畫中的 Session 種子，同樣可重播。
+
+用法:
+    python planner.py estimate --sites sites.json --seed 42 --replicas 50 --minutes 60
+    python planner.py generate --sites sites.json --seed 42 --replicas 50 --sessions 512 --out plans/
+    python planner.py show plans/replica-3.npz --sessions 5
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+
+import numpy as np
+
+ACTION_BROWSE, ACTION_DOWNLOAD, ACTION_VIDEO = 0, 1, 2
+ACTION_NAMES = ("browse", "download", "video")
+PROTOCOLS = ("smtp", "ftp", "ssh", "smb")
+
+CHUNK_SESSIONS = 256
+EVENT_CHUNK_S = 3600.0
+# SeedSequence spawn key 的第二層：各串流互相獨立，調整其中一種的速率不會改變其他計畫
+STREAM_SESSIONS, STREAM_PROTOCOL, STREAM_NOISE, STREAM_ARRIVALS = 0, 1, 2, 3
+
+# sites.json 沒有 "personas" 區塊時使用的預設角色 (simulator.py 與 CLI 共用，計畫與估計才會和容器一致)
+# categories 可為清單 (每個網址權重相同) 或 {分類: 權重} 字典
+DEFAULT_PERSONAS = {
+    "TECH_GEEK": {"weight": 1, "categories": ["tech", "global_giants"]},
+    "NEWS_ADDICT": {"weight": 1, "categories": ["news", "local"]},
+    "LOCAL_USER": {"weight": 1, "categories": ["local", "global_giants"]},
+    "MIXED": {"weight": 1, "categories": ["local", "global_giants", "tech", "news"]},
+}
+
+SESSION_FIELDS = ("persona", "seed", "pause", "n_actions")
+ACTION_FIELDS = ("kind", "target", "depth", "dwell", "watch")
+
+# dry run 的成本模型 (平均值)，可在 sites.json 的 "plan_costs" 覆寫
+DEFAULT_COSTS = {
+    "page_s": 4.0, "page_mb": 2.5, "page_flows": 35,         # 每次導覽 / 點擊進入的頁面
+    "step_s": 5.5, "click_ratio": 0.6,                       # 深度瀏覽每一步的停留 + 捲動；點擊成功比例
+    "download_s": 60.0, "download_mb": 50.0, "download_flows": 2,  # Persona 沒有 max_mb 時的下載大小
+    "video_page_s": 10.0, "video_kbps": 2500.0, "video_flows_per_min": 6,
+    "protocol_kb": {"smtp": 4.0, "ftp": 6.0, "ssh": 8.0, "smb": 12.0},
+    "protocol_flows": {"smtp": 1, "ftp": 2, "ssh": 0, "smb": 0},  # SSH / SMB 走持久連線池
+    "dns_kb": 0.2, "dns_flows": 1,
+}
+
+
+class PlanSpec:
+    """由 sites.json 編譯出計畫需要的查表 (網址表、Persona 累積權重)，與 simulator.SiteIndex 的規則相同"""
+
+    def __init__(self, data, default_personas=None):
+        categories = {k: list(v) for k, v in data.items() if isinstance(v, list)}
+        self.urls = []
+        index = {}
+
+        def url_ids(urls):
+            ids = []
+            for url in urls:
+                if url not in index:
+                    index[url] = len(self.urls)
+                    self.urls.append(url)
+                ids.append(index[url])
+            return np.array(ids, dtype=np.int32)
+
+        personas = data.get('personas') or default_personas or {
+            "MIXED": {"weight": 1, "categories": [c for c in categories if c not in ("download", "video", "video_streams")]}}
+        self.persona_names = list(personas)
+        weights = np.array([float(spec.get('weight', 1)) for spec in personas.values()])
+        self.persona_cdf = np.cumsum(weights) / weights.sum()
+        self.persona_targets = []   # [(url ids, 累積機率)]
+        self.download_mb = []       # 每個 Persona 的下載上限 (0 = 不限制，dry run 改用成本模型)
+        for spec in personas.values():
+            cats = spec.get('categories', [])
+            if isinstance(cats, list): cats = {c: 1.0 for c in cats}
+            urls, w = [], []
+            for category, weight in cats.items():
+                for url in categories.get(category, []):
+                    urls.append(url)
+                    w.append(float(weight))
+            if not urls:
+                urls = categories.get('global_giants', [])
+                w = [1.0] * len(urls)
+            cdf = np.cumsum(w) / sum(w) if urls else np.zeros(0)
+            self.persona_targets.append((url_ids(urls), cdf))
+            self.download_mb.append(float(spec.get('download', {}).get('max_mb', os.getenv("DOWNLOAD_MAX_MB", "0"))))
+        self.downloads = url_ids(categories.get('download', []))
+        self.videos = url_ids(categories.get('video', []))
+
+        profile = data.get('load_profile') or {}
+        low, high = profile.get('session_actions', [10, 25]) if profile.get('enabled', True) else (10, 25)
+        self.session_actions = (int(low), max(int(low), int(high)))
+        self.costs = dict(DEFAULT_COSTS, **data.get('plan_costs', {}))
+
+
+def plan_sessions(spec, seed_seq, n):
+    """一次產生 n 個 Session：回傳 {欄位: ndarray}，動作以 n_actions 串接 (CSR)"""
+    rng = np.random.default_rng(seed_seq)
+    low, high = spec.session_actions
+    n_actions = rng.integers(low, high + 1, n).astype(np.int16)
+    persona = np.minimum(np.searchsorted(spec.persona_cdf, rng.random(n), side='right'),
+                         len(spec.persona_names) - 1).astype(np.int16)
+    seed = rng.integers(0, 2**63 - 1, n, dtype=np.int64)
+    pause = rng.integers(5, 16, n).astype(np.float32)
+
+    total = int(n_actions.sum())
+    owner = np.repeat(persona, n_actions)
+    # 與原本的機率相同：10% 下載、20% 看影片、70% 瀏覽 (沒有清單時改為瀏覽)
+    dice = rng.random(total)
+    kind = np.select([dice < 0.10, dice < 0.30], [ACTION_DOWNLOAD, ACTION_VIDEO], ACTION_BROWSE).astype(np.int8)
+    if len(spec.downloads) == 0: kind[kind == ACTION_DOWNLOAD] = ACTION_BROWSE
+    if len(spec.videos) == 0: kind[kind == ACTION_VIDEO] = ACTION_BROWSE
+
+    u = rng.random(total)
+    target = np.full(total, -1, dtype=np.int32)
+    for p, (urls, cdf) in enumerate(spec.persona_targets):
+        sel = (kind == ACTION_BROWSE) & (owner == p)
+        if len(urls) and sel.any():
+            target[sel] = urls[np.minimum(np.searchsorted(cdf, u[sel], side='right'), len(urls) - 1)]
+    for k, urls in ((ACTION_DOWNLOAD, spec.downloads), (ACTION_VIDEO, spec.videos)):
+        sel = kind == k
+        if sel.any(): target[sel] = urls[(u[sel] * len(urls)).astype(np.int64)]
+
+    return {
+        "persona": persona, "seed": seed, "pause": pause, "n_actions": n_actions,
+        "kind": kind, "target": target,
+        "depth": rng.integers(2, 5, total).astype(np.int8),
+        "dwell": rng.integers(5, 11, total).astype(np.float32),
+        "watch": rng.integers(180, 1801, total).astype(np.int16),
+    }
+
+
+def plan_arrivals(seed_seq, start, end, rate_per_min):
+    """[start, end) 秒內的 Poisson 到達時間 (Poisson 過程無記憶性，各區塊可獨立產生)"""
+    if rate_per_min <= 0: return np.zeros(0)
+    rng = np.random.default_rng(seed_seq)
+    mean = 60.0 / rate_per_min
+    expected = (end - start) / mean
+    times = start + np.cumsum(rng.exponential(mean, int(expected + 6 * np.sqrt(expected) + 16)))
+    while times[-1] < end:
+        times = np.concatenate([times, times[-1] + np.cumsum(rng.exponential(mean, 64))])
+    return times[times < end]
+
+
+def plan_noise(seed_seq, start, end, n_domains, mean_s=60.0, min_s=10.0):
+    """SystemNoise 的 DNS 查詢時間與網域編號 (間隔與原本相同：max(10, Exp(60)))"""
+    rng = np.random.default_rng(seed_seq)
+    n = int((end - start) / min_s) + 1
+    times = start + np.cumsum(np.maximum(min_s, rng.exponential(mean_s, n)))
+    times = times[times < end]
+    return times, rng.integers(0, max(n_domains, 1), len(times))
+
+
+class SessionPlan:
+    """單一 Session 的計畫 (執行端使用)；steps 為 (kind, url 或 None, max_depth, dwell 秒, watch 秒)"""
+    __slots__ = ('index', 'persona', 'seed', 'pause', 'steps')
+
+    def __init__(self, index, persona, seed, pause, steps):
+        self.index = index
+        self.persona = persona
+        self.seed = seed
+        self.pause = pause
+        self.steps = steps
+
+
+class ReplicaPlan:
+    """
+    單一 Replica 的計畫：依需要逐區塊產生並快取，可無限延伸。
+    從 .npz 載入時，檔案內的區塊直接使用，之後的區塊再由種子產生。
+    """
+
+    def __init__(self, spec, master_seed, replica_id):
+        self.spec = spec
+        self.master_seed = int(master_seed)
+        self.replica_id = int(replica_id)
+        self._chunks = {}   # chunk -> (arrays, action_ptr, urls, persona_names)
+        self._next = 0
+
+    @classmethod
+    def from_env(cls, data, default_personas=None):
+        """PLAN_SEED 未設定時回傳 None (維持即時隨機)；PLAN_FILE 存在時優先載入"""
+        seed = os.getenv("PLAN_SEED", "")
+        plan_file = os.getenv("PLAN_FILE", "")
+        spec = PlanSpec(data, default_personas)
+        if plan_file and os.path.exists(plan_file): return cls.load(plan_file, spec)
+        if not seed: return None
+        return cls(spec, int(seed), int(os.getenv("REPLICA_ID", "0") or 0))
+
+    def seed_seq(self, stream, chunk, sub=0):
+        return np.random.SeedSequence(self.master_seed, spawn_key=(self.replica_id, stream, chunk, sub))
+
+    def int_seed(self, stream):
+        """給 random.Random 使用的整數種子"""
+        return int(self.seed_seq(stream, 0).generate_state(1, np.uint64)[0])
+
+    def _chunk(self, c):
+        if c not in self._chunks:
+            arrays = plan_sessions(self.spec, self.seed_seq(STREAM_SESSIONS, c), CHUNK_SESSIONS)
+            self._add_chunk(c, arrays, self.spec.urls, self.spec.persona_names)
+        return self._chunks[c]
+
+    def _add_chunk(self, c, arrays, urls, persona_names):
+        ptr = np.concatenate([[0], np.cumsum(arrays["n_actions"], dtype=np.int64)])
+        self._chunks[c] = (arrays, ptr, urls, persona_names)
+
+    def session(self, i):
+        arrays, ptr, urls, names = self._chunk(i // CHUNK_SESSIONS)
+        j = i % CHUNK_SESSIONS
+        lo, hi = int(ptr[j]), int(ptr[j + 1])
+        steps = [(kind, urls[target] if target >= 0 else None, depth, dwell, watch)
+                 for kind, target, depth, dwell, watch in zip(
+                     arrays["kind"][lo:hi].tolist(), arrays["target"][lo:hi].tolist(), arrays["depth"][lo:hi].tolist(),
+                     arrays["dwell"][lo:hi].tolist(), arrays["watch"][lo:hi].tolist())]
+        return SessionPlan(i, names[arrays["persona"][j]], int(arrays["seed"][j]), float(arrays["pause"][j]), steps)
+
+    def next_session(self):
+        i = self._next
+        self._next += 1
+        return self.session(i)
+
+    def protocol_times(self, proto, rate_per_min):
+        """依序產生該協定的事件時間 (相對於開始執行的秒數)"""
+        if rate_per_min <= 0: return
+        sub = PROTOCOLS.index(proto) if proto in PROTOCOLS else len(PROTOCOLS)
+        c = 0
+        while True:
+            yield from plan_arrivals(self.seed_seq(STREAM_PROTOCOL, c, sub), c * EVENT_CHUNK_S,
+                                     (c + 1) * EVENT_CHUNK_S, rate_per_min).tolist()
+            c += 1
+
+    def noise_events(self, n_domains):
+        """依序產生 (時間, 網域編號)"""
+        c = 0
+        while True:
+            times, domains = plan_noise(self.seed_seq(STREAM_NOISE, c), c * EVENT_CHUNK_S, (c + 1) * EVENT_CHUNK_S, n_domains)
+            yield from zip(times.tolist(), domains.tolist())
+            c += 1
+
+    # ---------- 序列化 ----------
+
+    def save(self, path, n_sessions):
+        n_chunks = -(-n_sessions // CHUNK_SESSIONS)
+        chunks = [self._chunk(c) for c in range(n_chunks)]
+        out = {f: np.concatenate([ch[0][f] for ch in chunks]) for f in SESSION_FIELDS + ACTION_FIELDS}
+        np.savez_compressed(path, master_seed=self.master_seed, replica_id=self.replica_id,
+                            urls=np.array(self.spec.urls), persona_names=np.array(self.spec.persona_names), **out)
+
+    @classmethod
+    def load(cls, path, spec):
+        with np.load(path) as f:
+            plan = cls(spec, int(f["master_seed"]), int(f["replica_id"]))
+            urls, names = f["urls"].tolist(), f["persona_names"].tolist()
+            sessions = {k: f[k] for k in SESSION_FIELDS}
+            actions = {k: f[k] for k in ACTION_FIELDS}
+        ptr = np.concatenate([[0], np.cumsum(sessions["n_actions"], dtype=np.int64)])
+        for c in range(len(sessions["persona"]) // CHUNK_SESSIONS):
+            s0, s1 = c * CHUNK_SESSIONS, (c + 1) * CHUNK_SESSIONS
+            arrays = {k: v[s0:s1] for k, v in sessions.items()}
+            arrays.update({k: v[ptr[s0]:ptr[s1]] for k, v in actions.items()})
+            plan._add_chunk(c, arrays, urls, names)
+        return plan
+
+
+# ---------- Dry run ----------
+
+def estimate_replica(plan, minutes, slots, video_mode="emulate", protocol_rates=None):
+    """
+    依成本模型估計單一 Replica 在 minutes 分鐘內的 Session / 動作 / 位元組 / Flow 數。
+    Session 由 slots 個併發 Worker 依序執行 (與 BrowserPool 相同)。
+    """
+    spec, costs = plan.spec, plan.spec.costs
+    budget = minutes * 60.0 * slots
+    used, sessions = 0.0, 0
+    totals = dict.fromkeys(ACTION_NAMES, 0)
+    total_bytes = total_flows = 0.0
+    c = 0
+    while used < budget:
+        arrays, ptr, _, _ = plan._chunk(c)
+        kind, depth = arrays["kind"], arrays["depth"].astype(np.float64)
+        watch = arrays["watch"].astype(np.float64)
+        browse, download, video = kind == ACTION_BROWSE, kind == ACTION_DOWNLOAD, kind == ACTION_VIDEO
+        pages = np.where(browse, 1 + depth * costs["click_ratio"], 1.0)
+        dl_mb = np.array(spec.download_mb)[np.repeat(arrays["persona"], arrays["n_actions"])]
+        dl_mb = np.where(dl_mb > 0, dl_mb, costs["download_mb"])
+
+        seconds = arrays["dwell"] + np.select(
+            [browse, download],
+            [pages * costs["page_s"] + depth * costs["step_s"], costs["download_s"]],
+            costs["video_page_s"] + (0 if video_mode == "emulate" else watch))
+        mb = np.select([browse, download], [pages * costs["page_mb"], dl_mb],
+                       costs["page_mb"] + watch * costs["video_kbps"] / 8 / 1000)
+        flows = np.select([browse, download], [pages * costs["page_flows"], costs["download_flows"]],
+                          costs["page_flows"] + watch / 60 * costs["video_flows_per_min"])
+
+        starts = ptr[:-1]
+        session_s = np.add.reduceat(seconds, starts) + arrays["pause"]
+        take = int(np.searchsorted(np.cumsum(session_s), budget - used, side='right'))
+        last = take if take == len(session_s) else take + 1  # 最後一個 Session 只做了一部分，以時間比例計入
+        frac = np.ones(last)
+        if last > take:
+            frac[-1] = (budget - used - session_s[:take].sum()) / session_s[take]
+        weight = np.repeat(frac, arrays["n_actions"][:last])
+        end = int(ptr[last])
+        for k, name in enumerate(ACTION_NAMES):
+            totals[name] += float((weight * (kind[:end] == k)).sum())
+        total_bytes += float((weight * mb[:end]).sum()) * 1024 * 1024
+        total_flows += float((weight * flows[:end]).sum())
+        sessions += float(frac.sum())
+        used += float((frac * session_s[:last]).sum())
+        c += 1
+
+    horizon = minutes * 60.0
+    events = {}
+    for proto in PROTOCOLS:
+        rate = (protocol_rates or {}).get(proto, 0.25)
+        times = plan.protocol_times(proto, rate)
+        events[proto] = sum(1 for _ in itertools.takewhile(lambda t: t < horizon, times))
+    events["dns"] = sum(1 for _ in itertools.takewhile(lambda e: e[0] < horizon, plan.noise_events(8)))
+    for proto in PROTOCOLS:
+        total_bytes += events[proto] * costs["protocol_kb"].get(proto, 0) * 1024
+        total_flows += events[proto] * costs["protocol_flows"].get(proto, 1)
+    total_bytes += events["dns"] * costs["dns_kb"] * 1024
+    total_flows += events["dns"] * costs["dns_flows"]
+    return {"sessions": sessions, "actions": totals, "events": events, "bytes": total_bytes, "flows": total_flows}
+
+
+def _protocol_rates():
+    """與 simulator._proto_env 相同：PROTO_<協定>_RATE 優先，其次 PROTO_RATE"""
+    rates = {}
+    for proto in PROTOCOLS:
+        raw = os.getenv(f"PROTO_{proto.upper()}_RATE", os.getenv("PROTO_RATE"))
+        rates[proto] = float(raw) if raw else 0.25
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seeded, replayable session plans for the traffic bots")
+    sub = parser.add_subparsers(dest="command", required=True)
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name, text in (("estimate", "離線估計一輪的流量與 Flow 數"), ("generate", "輸出每個 Replica 的計畫 (.npz)")):
+        p = sub.add_parser(name, help=text)
+        p.add_argument("--sites", default=os.path.join(here, "sites.json"))
+        p.add_argument("--seed", type=int, required=True, help="主種子 (與容器的 PLAN_SEED 相同)")
+        p.add_argument("--replicas", type=int, required=True)
+        if name == "estimate":
+            p.add_argument("--minutes", type=float, default=60, help="一輪的長度")
+            p.add_argument("--sessions-per-container", type=int, default=int(os.getenv("SESSIONS_PER_CONTAINER", "1")))
+            p.add_argument("--video-mode", default=os.getenv("VIDEO_MODE", "emulate"), choices=("emulate", "browser"))
+        else:
+            p.add_argument("--sessions", type=int, default=CHUNK_SESSIONS, help="每個 Replica 的 Session 數 (以 256 為單位進位)")
+            p.add_argument("--out", required=True)
+    p_show = sub.add_parser("show", help="顯示計畫檔內容")
+    p_show.add_argument("plan")
+    p_show.add_argument("--sessions", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "show":
+        with np.load(args.plan) as f:
+            saved = len(f['persona'])
+            print(f"seed={int(f['master_seed'])} replica={int(f['replica_id'])} sessions={saved} "
+                  f"actions={len(f['kind'])} ({sum(f[k].nbytes for k in ACTION_FIELDS)} bytes)")
+        # 沒有 sites.json 無法延伸計畫，只顯示檔案內的 Session
+        plan = ReplicaPlan.load(args.plan, None)
+        for i in range(min(args.sessions, saved)):
+            s = plan.session(i)
+            print(f"#{i} {s.persona} seed={s.seed} pause={s.pause:.0f}s")
+            for kind, url, depth, dwell, watch in s.steps:
+                extra = f" depth={depth}" if kind == ACTION_BROWSE else f" watch={watch}s" if kind == ACTION_VIDEO else ""
+                print(f"    {ACTION_NAMES[kind]:<8} {url}{extra} +{dwell:.0f}s")
+        return 0
+
+    with open(args.sites, encoding="utf-8") as f:
+        spec = PlanSpec(json.load(f), DEFAULT_PERSONAS)
+    plans = [ReplicaPlan(spec, args.seed, r) for r in range(1, args.replicas + 1)]  # {{.Task.Slot}} 從 1 開始
+
+    if args.command == "generate":
+        os.makedirs(args.out, exist_ok=True)
+        for plan in plans:
+            plan.save(os.path.join(args.out, f"replica-{plan.replica_id}.npz"), args.sessions)
+        print(f"[Plan] {len(plans)} replica plans -> {args.out}")
+        return 0
+
+    results = [estimate_replica(p, args.minutes, args.sessions_per_container, args.video_mode, _protocol_rates())
+               for p in plans]
+    total = lambda key: sum(r[key] for r in results)
+    actions = {name: sum(r["actions"][name] for r in results) for name in ACTION_NAMES}
+    events = {name: sum(r["events"][name] for r in results) for name in results[0]["events"]}
+    print(f"[Plan] seed={args.seed} replicas={args.replicas} round={args.minutes:g} min "
+          f"sessions/container={args.sessions_per_container} video={args.video_mode}")
+    print(f"  sessions : {total('sessions'):.0f}")
+    print(f"  actions  : " + ", ".join(f"{k} {v:.0f}" for k, v in actions.items()))
+    print(f"  events   : " + ", ".join(f"{k} {v}" for k, v in events.items()))
+    print(f"  traffic  : {total('bytes') / 1024**3:.2f} GB total, {total('bytes') / 1024**3 / args.replicas:.3f} GB per replica")
+    print(f"  flows    : {total('flows'):.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2075 @@
+"""
+【Human Traffic Simulator V3.0 - JSON Config & Persona Mode】
+[修改] 實作本體 (由 flow.py 啟動)；冷啟動只載入標準函式庫：NumPy、Playwright、planner 與協定函式庫都在第一次用到時才 import
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import os
+import time
+import logging
+import socket
+import json
+import signal  # [新增] 訊號處理
+import sys     # [新增] 系統退出
+import re
+import itertools
+import bisect
+import contextlib
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from urllib.parse import urljoin, urlsplit
+
+if TYPE_CHECKING:
+    from playwright.async_api import Page, BrowserContext
+
+# --- 設定日誌 ---
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("HumanSim")
+
+# --- 預設資料 (Fallback) ---
+# 當讀取不到 JSON 時使用的備用資料
+DEFAULT_SITES = {
+    "local": ["https://www.ptt.cc/bbs/index.html", "https://tw.yahoo.com/"],
+    "global_giants": ["https://www.google.com", "https://www.wikipedia.org"],
+    "tech": ["https://github.com", "https://stackoverflow.com"],
+    "news": ["https://www.bbc.com"],
+    "download": ["https://www.python.org/ftp/python/3.12.1/python-3.12.1-amd64.exe"],
+    "video": ["https://www.youtube.com/watch?v=jfKfPfyJRdk"]
+}
+
+# [新增] 設定 PLAN_SEED 時由 main() 建立的 Session 計畫 (planner.ReplicaPlan)；None = 維持即時隨機
+REPLICA_PLAN = None
+
+async def _sleep_until(start, offset):
+    """睡到計畫中的時間點 (start 為 time.monotonic() 基準，offset 為相對秒數)"""
+    await asyncio.sleep(max(0.0, start + offset - time.monotonic()))
+
+class EventLog:
+    """
+    [新增] Ground-truth 事件紀錄 (JSONL，每個容器一個檔案)
+    每個動作 (導覽、點擊、下載、影片、SMTP/FTP/SSH/SMB、DNS 雜訊) 記一筆：wall / monotonic 時間、
+    replica、容器、session、persona、目標、結果 (ok 或例外類別)、延遲，之後可用時間 + 容器 IP 與 pcap 的 Flow 對應。
+    emit() 只把 tuple 放進環狀緩衝區，由背景 Task 每 EVENT_FLUSH_S 秒在 Thread 中序列化並附加寫入，
+    熱路徑不做任何 I/O；緩衝區滿時丟棄最舊的事件並記錄數量。
+    每次寫入都重新以 append 開啟檔案，Worker 端把檔案移走 (Round 收尾) 後下一批會自動建立新檔。
+    """
+    DIR = os.getenv("EVENT_LOG_DIR", "")   # 空白 = 停用
+    BUFFER = int(os.getenv("EVENT_BUFFER", "65536"))
+    FLUSH_S = float(os.getenv("EVENT_FLUSH_S", "1"))
+    HOST = socket.gethostname()
+    REPLICA = os.getenv("REPLICA_ID", "")
+
+    _buffer = deque(maxlen=max(1, BUFFER))
+    _dropped = 0
+    _sessions = itertools.count(1)
+    _task = None
+
+    @staticmethod
+    def emit(kind, target=None, outcome="ok", latency=None, persona=None, session=None, **extra):
+        if Metrics.PORT: Metrics.observe(kind, outcome, latency, extra)
+        if not EventLog.DIR: return
+        buf = EventLog._buffer
+        if len(buf) == buf.maxlen: EventLog._dropped += 1
+        buf.append((time.time(), time.monotonic(), kind, target, outcome, latency, persona, session, extra))
+
+    @staticmethod
+    @contextlib.contextmanager
+    def timed(kind, target=None, persona=None, session=None, **extra):
+        """
+        計時一個動作並在結束時 emit；例外時 outcome 為例外類別 (照常往外拋)。
+        區塊內可修改 yield 出來的 dict：outcome / target 覆寫預設值，其餘欄位 (例如 bytes) 一併寫入。
+        """
+        t0 = time.monotonic()
+        # Metrics 啟用時一併記錄本動作送給 Playwright Driver 的訊息數
+        calls = Metrics.driver_calls.get()
+        calls0 = calls[0] if calls else 0
+        try:
+            yield extra
+        except BaseException as e:
+            outcome = "cancelled" if isinstance(e, asyncio.CancelledError) else type(e).__name__
+            if calls: extra['calls'] = calls[0] - calls0
+            EventLog.emit(kind, extra.pop('target', target), outcome, time.monotonic() - t0, persona, session, **extra)
+            raise
+        if calls: extra['calls'] = calls[0] - calls0
+        outcome = extra.pop('outcome', "ok")
+        EventLog.emit(kind, extra.pop('target', target), outcome, time.monotonic() - t0, persona, session, **extra)
+
+    @staticmethod
+    def new_session():
+        return f"{EventLog.HOST}-{next(EventLog._sessions)}"
+
+    @staticmethod
+    def _path():
+        return os.path.join(EventLog.DIR, f"{EventLog.HOST}.jsonl")
+
+    @staticmethod
+    def _write(batch):
+        replica = int(EventLog.REPLICA) if EventLog.REPLICA.isdigit() else EventLog.REPLICA
+        lines = []
+        for t, mono, kind, target, outcome, latency, persona, session, extra in batch:
+            event = {"t": round(t, 6), "mono": round(mono, 6), "replica": replica, "host": EventLog.HOST, "kind": kind}
+            if session: event["session"] = session
+            if persona: event["persona"] = persona
+            if target: event["target"] = target
+            event["outcome"] = outcome
+            if latency is not None: event["latency_ms"] = round(latency * 1000, 1)
+            if extra: event.update((k, v) for k, v in extra.items() if v is not None)
+            lines.append(json.dumps(event, ensure_ascii=False, separators=(',', ':')))
+        with open(EventLog._path(), "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    @staticmethod
+    async def flush():
+        buf = EventLog._buffer
+        if not buf: return
+        batch = list(buf)
+        buf.clear()
+        dropped, EventLog._dropped = EventLog._dropped, 0
+        if dropped:
+            Metrics.inc("bot_events_dropped_total", value=dropped)
+            logger.warning(f"[Events] Ring buffer full, {dropped} oldest events dropped")
+        try: await asyncio.to_thread(EventLog._write, batch)
+        except Exception as e: logger.warning(f"[Events] Write to {EventLog._path()} failed: {e}")
+
+    @staticmethod
+    async def _flush_loop():
+        while True:
+            await asyncio.sleep(EventLog.FLUSH_S)
+            await EventLog.flush()
+
+    @staticmethod
+    def start():
+        if not EventLog.DIR: return
+        try: os.makedirs(EventLog.DIR, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"[Events] Cannot create {EventLog.DIR} ({e}), event log disabled")
+            EventLog.DIR = ""
+            return
+        # 容器的位址 (Overlay / Bridge)，供事件與 pcap 中的 Flow 對應
+        try: ips = sorted({a[4][0] for a in socket.getaddrinfo(EventLog.HOST, None)})
+        except OSError: ips = []
+        EventLog.emit("bot_start", outcome="ok", ips=ips, plan_seed=os.getenv("PLAN_SEED") or None)
+        EventLog._task = asyncio.create_task(EventLog._flush_loop())
+        logger.info(f"[Events] Logging actions to {EventLog._path()} (flush every {EventLog.FLUSH_S}s)")
+
+    @staticmethod
+    async def stop():
+        if EventLog._task:
+            EventLog._task.cancel()
+            await asyncio.gather(EventLog._task, return_exceptions=True)
+        await EventLog.flush()
+
+class Metrics:
+    """
+    [新增] Prometheus 文字格式的指標端點 (METRICS_PORT，0 = 停用)
+    以 asyncio.start_server 回應 GET /metrics，不需額外套件；更新只是記憶體內的加法，不做 I/O。
+    動作類指標由 EventLog.emit 餵入 (與事件紀錄同一個出口，事件紀錄停用時照樣統計)，
+    記憶體、Context 數等 Gauge 在被抓取時才計算。
+    """
+    PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+    CALL_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+    LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+    LAG_INTERVAL = 0.5
+    FAMILIES = {
+        "bot_actions_total": ("counter", "Actions by kind and outcome (ok or exception class)"),
+        "bot_action_duration_seconds": ("histogram", "Action latency by kind"),
+        "bot_page_load_seconds": ("histogram", "Top-level navigation latency by sites.json category"),
+        "bot_driver_calls_per_action": ("histogram", "Playwright driver round trips per action"),
+        "bot_driver_calls_total": ("counter", "Playwright driver round trips"),
+        "bot_events_dropped_total": ("counter", "Events dropped because the ring buffer was full"),
+        "bot_event_loop_lag_seconds": ("histogram", "Event loop scheduling lag"),
+        "bot_event_loop_lag_max_seconds": ("gauge", "Largest event loop lag since the last scrape"),
+        "bot_active_contexts": ("gauge", "Open browser contexts (running sessions)"),
+        "bot_video_viewers": ("gauge", "Background video stream emulators"),
+        "bot_startup_seconds": ("gauge", "Cold start duration by phase (until the first session runs)"),
+        "process_resident_memory_bytes": ("gauge", "RSS of the bot process"),
+        "bot_container_memory_bytes": ("gauge", "Container memory including Chromium (cgroup)"),
+    }
+    CGROUP_MEMORY = ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes")
+
+    # 每個 Session Task 一個計數格 (list)，Driver 訊息計入目前 Task 的 Session
+    driver_calls = contextvars.ContextVar("driver_calls", default=None)
+
+    _counters = {}    # (name, labels) -> value
+    _histograms = {}  # (name, labels) -> [各 bucket 計數..., +Inf, sum]
+    _gauges = {}      # name -> callable
+    _lag_max = 0.0
+    _server = None
+    _task = None
+
+    @staticmethod
+    def inc(name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        Metrics._counters[key] = Metrics._counters.get(key, 0) + value
+
+    @staticmethod
+    def observe_value(name, value, buckets, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = Metrics._histograms.get(key)
+        if hist is None:
+            hist = Metrics._histograms[key] = [0] * (len(buckets) + 2)
+        hist[bisect.bisect_left(buckets, value)] += 1
+        hist[-1] += value
+
+    @staticmethod
+    def set(name, value, **labels):
+        Metrics._counters[(name, tuple(sorted(labels.items())))] = value
+
+    @staticmethod
+    def gauge(name, fn):
+        Metrics._gauges[name] = fn
+
+    @staticmethod
+    def observe(kind, outcome, latency, extra):
+        """EventLog.emit 的每一筆事件"""
+        Metrics.inc("bot_actions_total", kind=kind, outcome=outcome)
+        if latency is None: return
+        Metrics.observe_value("bot_action_duration_seconds", latency, Metrics.LATENCY_BUCKETS, kind=kind)
+        if kind == "navigate" and outcome == "ok":
+            Metrics.observe_value("bot_page_load_seconds", latency, Metrics.LATENCY_BUCKETS,
+                                  category=extra.get('category') or "other")
+        if extra.get('calls') is not None:
+            Metrics.observe_value("bot_driver_calls_per_action", extra['calls'], Metrics.CALL_BUCKETS, kind=kind)
+
+    @staticmethod
+    def new_session():
+        """在目前的 Session Task 開始計算 Driver 訊息數"""
+        if Metrics.PORT: Metrics.driver_calls.set([0])
+
+    @staticmethod
+    def _hook_driver():
+        """
+        計算 Playwright → Driver 的協定訊息 (每次 page / mouse / evaluate 呼叫一則，對應一次以上的 CDP 往返)。
+        使用 Playwright 內部 API，版本不相容時只停用這兩項指標。
+        """
+        try:
+            from playwright._impl._connection import Connection
+            original = Connection._send_message_to_server
+        except (ImportError, AttributeError):
+            logger.warning("[Metrics] Playwright connection hook unavailable, driver call metrics disabled")
+            return
+        def counted(self, *args, **kwargs):
+            Metrics.inc("bot_driver_calls_total")
+            calls = Metrics.driver_calls.get()
+            if calls: calls[0] += 1
+            return original(self, *args, **kwargs)
+        Connection._send_message_to_server = counted
+
+    @staticmethod
+    async def _lag_loop():
+        """定時睡 LAG_INTERVAL，實際多睡的時間即為 Event Loop 的排程延遲"""
+        while True:
+            t0 = time.monotonic()
+            await asyncio.sleep(Metrics.LAG_INTERVAL)
+            lag = max(0.0, time.monotonic() - t0 - Metrics.LAG_INTERVAL)
+            Metrics.observe_value("bot_event_loop_lag_seconds", lag, Metrics.LAG_BUCKETS)
+            Metrics._lag_max = max(Metrics._lag_max, lag)
+
+    @staticmethod
+    def _rss():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    @staticmethod
+    def _container_memory():
+        for path in Metrics.CGROUP_MEMORY:
+            try:
+                with open(path) as f: return int(f.read())
+            except (OSError, ValueError):
+                continue
+        return 0
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs: return ""
+        esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+    @staticmethod
+    def render():
+        samples = {name: [] for name in Metrics.FAMILIES}
+        for (name, labels), value in sorted(Metrics._counters.items()):
+            samples.setdefault(name, []).append(f"{name}{Metrics._labels(labels)} {value}")
+        buckets_of = {"bot_event_loop_lag_seconds": Metrics.LAG_BUCKETS, "bot_driver_calls_per_action": Metrics.CALL_BUCKETS}
+        for (name, labels), hist in sorted(Metrics._histograms.items()):
+            buckets = buckets_of.get(name, Metrics.LATENCY_BUCKETS)
+            cumulative = 0
+            for le, count in zip(list(buckets) + ["+Inf"], hist[:-1]):
+                cumulative += count
+                samples[name].append(f"{name}_bucket{Metrics._labels(labels, [('le', le)])} {cumulative}")
+            samples[name].append(f"{name}_sum{Metrics._labels(labels)} {hist[-1]:.6f}")
+            samples[name].append(f"{name}_count{Metrics._labels(labels)} {cumulative}")
+        gauges = dict(Metrics._gauges)
+        lag_max, Metrics._lag_max = Metrics._lag_max, 0.0
+        gauges.update({"bot_event_loop_lag_max_seconds": lambda: lag_max,
+                       "process_resident_memory_bytes": Metrics._rss,
+                       "bot_container_memory_bytes": Metrics._container_memory})
+        for name, fn in gauges.items():
+            try: samples.setdefault(name, []).append(f"{name} {fn()}")
+            except Exception: pass
+
+        lines = []
+        for name, values in samples.items():
+            if not values: continue
+            kind, text = Metrics.FAMILIES.get(name, ("untyped", name))
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"] + values
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    async def _handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while await asyncio.wait_for(reader.readline(), 5) not in (b"\r\n", b"\n", b""): pass
+            parts = request.split()
+            if len(parts) > 1 and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", Metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except Exception: pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def start():
+        if not Metrics.PORT: return
+        Metrics._hook_driver()
+        try:
+            Metrics._server = await asyncio.start_server(Metrics._handle, "0.0.0.0", Metrics.PORT)
+        except OSError as e:
+            logger.warning(f"[Metrics] Cannot listen on port {Metrics.PORT} ({e}), metrics endpoint disabled")
+            return
+        Metrics._task = asyncio.create_task(Metrics._lag_loop())
+        logger.info(f"[Metrics] Serving Prometheus metrics on :{Metrics.PORT}/metrics")
+
+    @staticmethod
+    async def stop():
+        if Metrics._task: Metrics._task.cancel()
+        if Metrics._server:
+            Metrics._server.close()
+            await Metrics._server.wait_closed()
+
+class Startup:
+    """
+    [新增] 冷啟動計時與 Readiness 訊號
+    依序記錄各階段耗時：imports (行程啟動到 main()，含直譯器與模組載入)、config (計畫 / 事件紀錄 / 指標)、
+    playwright (Driver 啟動)、chromium (Browser 啟動)、first_session (第一個 Context 與頁面)。
+    第一個 Session 的頁面開好時 (開迴路模式為排程器開始等待到達時) 寫入 READY_FILE，
+    映像檔的 HEALTHCHECK 以此判斷容器就緒；同時輸出一行摘要、bot_ready 事件與 bot_startup_seconds 指標。
+    """
+    READY_FILE = os.getenv("READY_FILE", "/tmp/ready")
+
+    phases = []   # [(階段, 秒)]
+    ready = False
+    _last = None
+
+    @staticmethod
+    def _process_age():
+        """行程已執行的秒數 (/proc)；無法取得時為 None"""
+        try:
+            with open("/proc/self/stat") as f: start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+            with open("/proc/uptime") as f: uptime = float(f.read().split()[0])
+            return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+        except (OSError, ValueError, IndexError):
+            return None
+
+    @staticmethod
+    def begin():
+        """main() 開頭呼叫：清掉上次留下的 READY_FILE 並開始計時"""
+        try: os.remove(Startup.READY_FILE)
+        except OSError: pass
+        Startup._last = time.monotonic()
+        age = Startup._process_age()
+        if age is not None: Startup.phases.append(("imports", age))
+
+    @staticmethod
+    def phase(name):
+        """結束一個階段 (從上一個階段結束算起)"""
+        if Startup.ready or Startup._last is None: return
+        now = time.monotonic()
+        Startup.phases.append((name, now - Startup._last))
+        Startup._last = now
+
+    @staticmethod
+    def mark_ready(phase="first_session"):
+        if Startup.ready or Startup._last is None: return
+        Startup.phase(phase)
+        Startup.ready = True
+        phases = {name: round(seconds, 3) for name, seconds in Startup.phases}
+        total = sum(seconds for _, seconds in Startup.phases)
+        try:
+            with open(Startup.READY_FILE, "w") as f: json.dump(dict(phases, total=round(total, 3)), f)
+        except OSError as e:
+            logger.warning(f"[Startup] Cannot write {Startup.READY_FILE}: {e}")
+        for name, seconds in phases.items():
+            Metrics.set("bot_startup_seconds", seconds, phase=name)
+        EventLog.emit("bot_ready", total_s=round(total, 3), phases=phases)
+        logger.info(f"[Startup] Ready in {total:.1f}s (" + ", ".join(f"{n} {s:.2f}s" for n, s in phases.items()) + ")")
+
+class SystemNoise:
+    """系統背景雜訊產生器 (已優化)"""
+    NOISE_DOMAINS = [
+        "time.windows.com", "time.google.com", "pool.ntp.org",
+        "update.microsoft.com", "clients3.google.com", "detectportal.firefox.com",
+        "connectivity-check.ubuntu.com", "ntp.ubuntu.com"
+    ]
+
+    @staticmethod
+    async def _dns_query_loop():
+        """
+        模擬作業系統背景流量 (NTP, Update Check)
+        [優化重點]：使用非阻塞查詢 + 長時間隨機間隔，避免塞爆 Conntrack 表
+        """
+        logger.info("[Noise] 背景雜訊服務已啟動 (Low Frequency Mode)")
+        # [新增] 計畫模式：查詢時間與網域都來自計畫 (間隔分佈與下方相同)
+        planned = REPLICA_PLAN.noise_events(len(SystemNoise.NOISE_DOMAINS)) if REPLICA_PLAN else None
+        start = time.monotonic()
+        while True:
+            if planned:
+                offset, idx = next(planned)
+                await _sleep_until(start, offset)
+            domain = SystemNoise.NOISE_DOMAINS[idx] if planned else random.choice(SystemNoise.NOISE_DOMAINS)
+            with EventLog.timed("dns", domain) as event:
+                try:
+                    # [修正 1] 使用 asyncio 的 resolver (非阻塞)，避免卡死 Python 主程序
+                    # 原本的 socket.gethostbyname 是阻塞式的，DNS 慢的時候會導致整個 Worker 卡死
+                    loop = asyncio.get_running_loop()
+                    await loop.getaddrinfo(domain, 80)
+                except Exception as e:
+                    event['outcome'] = type(e).__name__ # 忽略雜訊產生的錯誤
+            if planned: continue
+
+            # [修正 2] 使用指數分佈 (Exponential Distribution) 模擬真實間隔
+            # scale=60.0 代表平均每 60 秒發生一次 (原本是 0.3 秒，太快了)
+            import numpy as np
+            wait_time = np.random.exponential(scale=60.0)
+            
+            # [修正 3] 設定安全下限 (至少 10 秒)，防止極端值造成 Flood
+            final_wait = max(10.0, wait_time)
+            
+            await asyncio.sleep(final_wait)
+
+def _proto_env(proto, key, default, cast=float):
+    """讀取協定設定：PROTO_<協定>_<KEY> 優先，其次 PROTO_<KEY>，最後使用預設值"""
+    raw = os.getenv(f"PROTO_{proto.upper()}_{key}", os.getenv(f"PROTO_{key}"))
+    if raw is None: return default
+    try: return cast(raw)
+    except ValueError: return default
+
+class ConnectionPool:
+    """
+    [新增] 協定連線池 (每種協定一個)
+    - size: 同時使用中的連線上限
+    - keepalive: 閒置連線每隔多久送一次 NOOP/Echo 保活
+    - max_idle: 閒置超過此秒數即關閉
+    - fresh_ratio: 刻意不重用、走完整 Handshake 的比例 (控制 pcap 中新連線與長連線的組成)
+    open_fn / check_fn / close_fn 皆為 coroutine function，以便同時支援阻塞式與原生 async 客戶端。
+    """
+
+    def __init__(self, name, open_fn, check_fn, close_fn, size=2, max_idle=120.0, keepalive=30.0, fresh_ratio=0.0):
+        self.name = name
+        self._open_fn = open_fn
+        self._check_fn = check_fn
+        self._close_fn = close_fn
+        self.size = max(1, int(size))
+        self.max_idle = max_idle
+        self.keepalive = max(1.0, float(keepalive))  # 0 會讓 maintain() 變成不停的 sleep(0) 迴圈
+        self.fresh_ratio = fresh_ratio
+        self._idle = []  # [(conn, last_used_monotonic)]
+        self._sem = asyncio.Semaphore(self.size)
+
+    @classmethod
+    def from_env(cls, name, open_fn, check_fn, close_fn):
+        return cls(
+            name, open_fn, check_fn, close_fn,
+            # 預設池大小與該協定的併發上限一致，避免併發對話卡在池上排隊
+            size=_proto_env(name, "POOL_SIZE", _proto_env(name, "CONCURRENCY", 4, int), int),
+            max_idle=_proto_env(name, "MAX_IDLE", 120.0),
+            keepalive=_proto_env(name, "KEEPALIVE", 30.0),
+            fresh_ratio=_proto_env(name, "FRESH_RATIO", 0.2),
+        )
+
+    async def _close(self, conn):
+        try: await self._close_fn(conn)
+        except Exception: pass
+
+    async def _checkout(self):
+        """回傳 (conn, reused, one_shot)"""
+        if random.random() < self.fresh_ratio:
+            return await self._open_fn(), False, True
+        now = time.monotonic()
+        while self._idle:
+            conn, last_used = self._idle.pop()
+            if now - last_used <= self.max_idle:
+                return conn, True, False
+            await self._close(conn)
+        return await self._open_fn(), False, False
+
+    async def _checkin(self, conn):
+        if len(self._idle) >= self.size:
+            await self._close(conn)
+        else:
+            self._idle.append((conn, time.monotonic()))
+
+    async def run(self, action):
+        """
+        取得一條連線執行 action(conn)。
+        重用的連線若已失效 (對端斷線、逾時)，丟棄後以新連線重試一次。
+        """
+        async with self._sem:
+            for attempt in range(2):
+                conn, reused, one_shot = await self._checkout()
+                try:
+                    result = await action(conn)
+                except Exception:
+                    await self._close(conn)
+                    if reused and attempt == 0: continue
+                    raise
+                if one_shot: await self._close(conn)
+                else: await self._checkin(conn)
+                return result
+
+    async def maintain(self):
+        """
+        背景保活迴圈：關閉逾時閒置連線，其餘送 keep-alive，失敗即丟棄
+        一次只取出正在檢查的那一條，其餘仍留在池中可被借用；檢查期間池已補滿時直接關閉
+        """
+        while True:
+            await asyncio.sleep(self.keepalive)
+            now = time.monotonic()
+            for entry in list(self._idle):
+                if entry not in self._idle: continue  # 已被借走
+                self._idle.remove(entry)
+                conn, last_used = entry
+                if now - last_used > self.max_idle:
+                    await self._close(conn)
+                    continue
+                try:
+                    await self._check_fn(conn)
+                except Exception:
+                    await self._close(conn)
+                    continue
+                # 放回最舊的位置 (借出時從尾端取最近使用的連線)
+                if len(self._idle) >= self.size: await self._close(conn)
+                else: self._idle.insert(0, entry)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            await self._close(conn)
+
+class _AsyncReplyClient:
+    """[新增] SMTP / FTP 共用的 asyncio Streams 文字協定基底 (三碼回應、支援多行回應)"""
+
+    def __init__(self, host, reader, writer, timeout):
+        self.host = host
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+
+    @classmethod
+    async def open(cls, host, port, timeout=5):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        return cls(host, reader, writer, timeout)
+
+    async def _readline(self):
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line: raise ConnectionError(f"{self.host}: connection closed")
+        return line
+
+    async def read_reply(self, expect=None):
+        first = await self._readline()
+        lines = [first]
+        # 多行回應格式: "250-xxx" ... "250 xxx"
+        if first[3:4] == b'-':
+            while True:
+                line = await self._readline()
+                lines.append(line)
+                if line[:3] == first[:3] and line[3:4] == b' ': break
+        code = int(first[:3])
+        if expect and code not in expect:
+            raise ConnectionError(f"{self.host}: unexpected reply {code}")
+        return code, b''.join(lines)
+
+    async def command(self, line, expect=None):
+        self.writer.write(line.encode() + b'\r\n')
+        await self.writer.drain()
+        return await self.read_reply(expect)
+
+    async def close(self, quit_cmd="QUIT"):
+        try: await self.command(quit_cmd)
+        except Exception: pass
+        self.writer.close()
+        try: await self.writer.wait_closed()
+        except Exception: pass
+
+class AsyncSMTPClient(_AsyncReplyClient):
+    """[新增] 精簡 async SMTP 客戶端 (EHLO / MAIL / RCPT / DATA / NOOP)"""
+
+    @classmethod
+    async def connect(cls, host, port, timeout=5):
+        client = await cls.open(host, port, timeout)
+        try:
+            await client.read_reply((220,))
+            await client.command(f"EHLO {socket.gethostname()}", (250,))
+        except Exception:
+            client.writer.close()
+            raise
+        return client
+
+    async def send_message(self, msg):
+        await self.command(f"MAIL FROM:<{msg['From']}>", (250,))
+        await self.command(f"RCPT TO:<{msg['To']}>", (250, 251))
+        await self.command("DATA", (354,))
+        from email import policy as email_policy
+        body = msg.as_bytes(policy=email_policy.SMTP)
+        # Dot-stuffing: 以 "." 開頭的行需補一個 "."
+        body = re.sub(rb'(?m)^\.', b'..', body)
+        if not body.endswith(b'\r\n'): body += b'\r\n'
+        self.writer.write(body + b'.\r\n')
+        await self.writer.drain()
+        await self.read_reply((250,))
+
+    async def noop(self):
+        await self.command("NOOP", (250,))
+
+class AsyncFTPClient(_AsyncReplyClient):
+    """[新增] 精簡 async FTP 客戶端 (USER / PASS / PASV + NLST / NOOP)"""
+    PASV_RE = re.compile(rb'(\d+),(\d+),(\d+),(\d+),(\d+),(\d+)')
+
+    @classmethod
+    async def connect(cls, host, port, user, password, timeout=5):
+        client = await cls.open(host, port, timeout)
+        try:
+            await client.read_reply((220,))
+            code, _ = await client.command(f"USER {user}", (230, 331))
+            if code == 331: await client.command(f"PASS {password}", (230,))
+        except Exception:
+            client.writer.close()
+            raise
+        return client
+
+    async def nlst(self):
+        _, text = await self.command("PASV", (227,))
+        m = AsyncFTPClient.PASV_RE.search(text)
+        if not m: raise ConnectionError(f"{self.host}: bad PASV reply")
+        # 與 ftplib 相同：忽略伺服器回報的 IP，改連控制連線的主機 (NAT / Overlay 網路下較可靠)
+        port = int(m.group(5)) * 256 + int(m.group(6))
+        data_reader, data_writer = await asyncio.wait_for(asyncio.open_connection(self.host, port), self.timeout)
+        try:
+            await self.command("NLST", (125, 150))
+            listing = await asyncio.wait_for(data_reader.read(), self.timeout)
+        finally:
+            data_writer.close()
+        await self.read_reply((226, 250))
+        return listing.split(b'\r\n')
+
+    async def noop(self):
+        await self.command("NOOP", (200,))
+
+class ProtocolSimulator:
+    """
+    [新增] 多重協定模擬器 (SMTP, FTP, SSH, SMB)
+    SMTP / FTP 為 asyncio Streams 原生實作，SSH 使用 asyncssh，
+    只有 pysmb 仍是阻塞式，放在專屬且有上限的 Thread Pool 執行。
+    每種協定各自以 Poisson 到達率觸發，並有獨立的併發上限。
+    [修改] 協定函式庫 (asyncssh / pysmb / email) 延後到第一次使用時才載入，不拖慢容器冷啟動。
+    """
+    
+    # 從環境變數讀取 Service Name
+    HOST_MAIL = os.getenv("TARGET_MAIL_HOST", "mail-server")
+    HOST_FTP = os.getenv("TARGET_FTP_HOST", "ftp-server")
+    HOST_SSH = os.getenv("TARGET_SSH_HOST", "ssh-target")
+    HOST_SMB = os.getenv("TARGET_SMB_HOST", "smb-server")
+    TARGET_HOSTS = {'smtp': HOST_MAIL, 'ftp': HOST_FTP, 'ssh': HOST_SSH, 'smb': HOST_SMB}
+
+    _pools = {}
+    _smb_executor = None
+
+    # --- SMTP ---
+    @staticmethod
+    async def _open_smtp():
+        # MailHog SMTP port 1025
+        return await AsyncSMTPClient.connect(ProtocolSimulator.HOST_MAIL, 1025, timeout=5)
+
+    @staticmethod
+    async def _smtp_send(server):
+        """發送 Email"""
+        from email.mime.text import MIMEText
+        msg = MIMEText(f"Simulation log entry {random.randint(1,9999)}")
+        msg['Subject'] = "Traffic Gen Report"
+        msg['From'] = "bot@traffic.local"
+        msg['To'] = "admin@traffic.local"
+        await server.send_message(msg)
+
+    # --- FTP ---
+    @staticmethod
+    async def _open_ftp():
+        return await AsyncFTPClient.connect(ProtocolSimulator.HOST_FTP, 21, "testuser", "testpass", timeout=5)
+
+    @staticmethod
+    async def _ftp_list(ftp):
+        """FTP 檔案列表"""
+        await ftp.nlst()
+
+    # --- SSH ---
+    @staticmethod
+    async def _open_ssh():
+        # SSH Target 內部 port 是 2222 (根據 docker-stack 設定)
+        import asyncssh
+        return await asyncssh.connect(
+            ProtocolSimulator.HOST_SSH,
+            port=2222,
+            username='linuxuser',
+            password='password',
+            known_hosts=None,
+            connect_timeout=5,
+            keepalive_interval=_proto_env('ssh', "KEEPALIVE", 30.0),
+        )
+
+    @staticmethod
+    async def _ssh_exec(conn):
+        """SSH 遠端指令執行"""
+        await conn.run('ls -la /tmp', check=False, timeout=10)
+
+    @staticmethod
+    async def _ssh_keepalive(conn):
+        # 協定層的 keepalive@openssh.com 由 asyncssh 自動送出，這裡只補一個輕量的 Debug 封包
+        conn.send_debug("keepalive")
+
+    @staticmethod
+    async def _ssh_close(conn):
+        conn.close()
+        await conn.wait_closed()
+
+    # --- SMB (pysmb 為阻塞式，使用專屬 Executor) ---
+    @staticmethod
+    def _open_smb():
+        from smb.SMBConnection import SMBConnection
+        client_name = f"Worker-{random.randint(1,100)}"
+        conn = SMBConnection("testuser", "testpass", client_name, "SMB-SERVER", use_ntlm_v2=True)
+        if not conn.connect(ProtocolSimulator.HOST_SMB, 445, timeout=5):
+            raise ConnectionError("SMB authentication failed")
+        return conn
+
+    @staticmethod
+    def _smb_list(conn):
+        """SMB 檔案存取"""
+        conn.listPath("public", "/")
+
+    @staticmethod
+    async def _in_smb_executor(fn, *args):
+        if ProtocolSimulator._smb_executor is None:
+            ProtocolSimulator._smb_executor = ThreadPoolExecutor(
+                max_workers=_proto_env('smb', "THREADS", 4, int), thread_name_prefix="smb")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(ProtocolSimulator._smb_executor, fn, *args)
+
+    @staticmethod
+    def _get_pools():
+        if not ProtocolSimulator._pools:
+            sim = ProtocolSimulator
+            smb = sim._in_smb_executor
+            specs = {
+                'smtp': (sim._open_smtp, lambda c: c.noop(), lambda c: c.close()),
+                'ftp': (sim._open_ftp, lambda c: c.noop(), lambda c: c.close()),
+                'ssh': (sim._open_ssh, sim._ssh_keepalive, sim._ssh_close),
+                'smb': (lambda: smb(sim._open_smb), lambda c: smb(c.echo, b'ping', 5), lambda c: smb(c.close)),
+            }
+            for name, (open_fn, check_fn, close_fn) in specs.items():
+                ProtocolSimulator._pools[name] = ConnectionPool.from_env(name, open_fn, check_fn, close_fn)
+        return ProtocolSimulator._pools
+
+    @staticmethod
+    async def _do(proto, action):
+        with EventLog.timed(proto, ProtocolSimulator.TARGET_HOSTS.get(proto)) as event:
+            try:
+                await ProtocolSimulator._get_pools()[proto].run(action)
+            except Exception as e: event['outcome'] = type(e).__name__
+
+    @staticmethod
+    async def _do_smtp():
+        await ProtocolSimulator._do('smtp', ProtocolSimulator._smtp_send)
+
+    @staticmethod
+    async def _do_ftp():
+        await ProtocolSimulator._do('ftp', ProtocolSimulator._ftp_list)
+
+    @staticmethod
+    async def _do_ssh():
+        await ProtocolSimulator._do('ssh', ProtocolSimulator._ssh_exec)
+
+    @staticmethod
+    async def _do_smb():
+        await ProtocolSimulator._do('smb', lambda c: ProtocolSimulator._in_smb_executor(ProtocolSimulator._smb_list, c))
+
+    @staticmethod
+    async def _poisson_loop(proto, action):
+        """
+        單一協定的產生迴圈：間隔為指數分佈 (Poisson 到達)，
+        每個動作是獨立 Task；併發達上限時丟棄該次到達，不無限排隊。
+        """
+        # 預設每種協定每分鐘 0.25 次，四種合計約等於舊版「30~90 秒一次」
+        rate_per_min = _proto_env(proto, "RATE", 0.25)
+        limit = _proto_env(proto, "CONCURRENCY", 4, int)
+        if rate_per_min <= 0: return
+        logger.info(f"[Protocol] {proto.upper()} rate={rate_per_min}/min concurrency={limit}")
+
+        inflight = set()
+        dropped = 0
+        # [新增] 計畫模式：到達時間由計畫預先產生 (同樣是 Poisson 過程)，不在迴圈中抽樣
+        planned = REPLICA_PLAN.protocol_times(proto, rate_per_min) if REPLICA_PLAN else None
+        start = time.monotonic()
+        try:
+            while True:
+                if planned: await _sleep_until(start, next(planned))
+                else: await asyncio.sleep(random.expovariate(rate_per_min / 60.0))
+                if len(inflight) >= limit:
+                    dropped += 1
+                    EventLog.emit(proto, ProtocolSimulator.TARGET_HOSTS.get(proto), "dropped")
+                    if dropped % 100 == 1:
+                        logger.warning(f"[Protocol] {proto.upper()} saturated, {dropped} arrivals dropped so far")
+                    continue
+                task = asyncio.create_task(action())
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+        finally:
+            for t in inflight: t.cancel()
+
+    @staticmethod
+    async def run_protocol_noise():
+        """背景協定流量產生迴圈"""
+        logger.info("[Protocol] 多協定模擬服務已啟動")
+        actions = {
+            'smtp': ProtocolSimulator._do_smtp,
+            'ftp': ProtocolSimulator._do_ftp,
+            'ssh': ProtocolSimulator._do_ssh,
+            'smb': ProtocolSimulator._do_smb,
+        }
+        pools = ProtocolSimulator._get_pools()
+        tasks = [asyncio.create_task(pool.maintain()) for pool in pools.values()]
+        tasks += [asyncio.create_task(ProtocolSimulator._poisson_loop(p, a)) for p, a in actions.items()]
+        
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for t in tasks: t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for pool in pools.values():
+                await pool.close()
+            if ProtocolSimulator._smb_executor:
+                ProtocolSimulator._smb_executor.shutdown(wait=False)
+
+class StreamDownloader:
+    """
+    [新增] 串流下載模式
+    由 aiohttp 直接拉取檔案，邊讀邊丟：不經過 Chromium 的下載管理員、不寫入 /tmp (tmpfs 會吃記憶體)。
+    讀取速度即為限速 (TCP 視窗自然回壓)，超過位元組上限就中斷連線。
+    """
+    MODE = os.getenv("DOWNLOAD_MODE", "stream").lower()   # stream / browser
+    MAX_MB = float(os.getenv("DOWNLOAD_MAX_MB", "0"))       # 0 = 不限制
+    RATE_KBPS = float(os.getenv("DOWNLOAD_RATE_KBPS", "0")) # 0 = 不限速
+    CHUNK_SIZE = 64 * 1024
+
+    _session = None
+
+    @staticmethod
+    def _get_session():
+        if StreamDownloader._session is None or StreamDownloader._session.closed:
+            import aiohttp  # [修改] 延後載入：第一次下載 / 影片串流時才需要
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=60)
+            StreamDownloader._session = aiohttp.ClientSession(timeout=timeout)
+        return StreamDownloader._session
+
+    @staticmethod
+    async def fetch(url, max_bytes=0, rate_bps=0, headers=None):
+        """串流並丟棄回應本體，回傳實際收到的位元組數"""
+        session = StreamDownloader._get_session()
+        received = 0
+        started = time.monotonic()
+        async with session.get(url, headers=headers) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(StreamDownloader.CHUNK_SIZE):
+                received += len(chunk)
+                if max_bytes and received >= max_bytes:
+                    # 直接中斷，不把剩下的內容讀完
+                    resp.close()
+                    break
+                if rate_bps:
+                    ahead = received / rate_bps - (time.monotonic() - started)
+                    if ahead > 0: await asyncio.sleep(ahead)
+        return received
+
+    @staticmethod
+    async def close():
+        if StreamDownloader._session and not StreamDownloader._session.closed:
+            await StreamDownloader._session.close()
+
+class _HlsSource:
+    """HLS 來源：Master Playlist 的各 Variant 即為 ABR 階梯，Segment 依序號在各畫質間對齊"""
+    INF_RE = re.compile(r'BANDWIDTH=(\d+)')
+
+    def __init__(self, url, headers):
+        self.url = url
+        self.headers = headers
+        self.levels = []   # [(bitrate_bps, media_playlist_url)]
+        self._media = {}   # level -> (segments, ended)
+        self._seq = 0
+        self._last_url = None
+
+    @property
+    def bitrates(self):
+        return [bw for bw, _ in self.levels]
+
+    @staticmethod
+    def parse_playlist(text, base_url):
+        """回傳 (variants, segments, ended)；variants=[(bandwidth, url)]，segments=[(duration, url)]"""
+        variants, segments = [], []
+        bandwidth = duration = None
+        for line in text.splitlines():
+            line = line.strip()
+            if not line: continue
+            if line.startswith('#EXT-X-STREAM-INF'):
+                m = _HlsSource.INF_RE.search(line)
+                bandwidth = int(m.group(1)) if m else 0
+            elif line.startswith('#EXTINF:'):
+                duration = float(line[8:].split(',')[0] or 0)
+            elif not line.startswith('#'):
+                if bandwidth is not None:
+                    variants.append((bandwidth, urljoin(base_url, line)))
+                    bandwidth = None
+                elif duration is not None:
+                    segments.append((duration, urljoin(base_url, line)))
+                    duration = None
+        return sorted(variants), segments, '#EXT-X-ENDLIST' in text
+
+    async def _load(self, url):
+        session = StreamDownloader._get_session()
+        async with session.get(url, headers=self.headers) as resp:
+            resp.raise_for_status()
+            return _HlsSource.parse_playlist(await resp.text(), str(resp.url))
+
+    async def open(self):
+        variants, segments, ended = await self._load(self.url)
+        if variants:
+            self.levels = variants
+        else:
+            self.levels = [(0, self.url)]
+            self._media[0] = (segments, ended)
+
+    async def fetch_segment(self, level):
+        if level not in self._media:
+            _, segments, ended = await self._load(self.levels[level][1])
+            self._media[level] = (segments, ended)
+        segments, ended = self._media[level]
+        if self._seq >= len(segments):
+            if ended:
+                self._seq = 0
+            else:
+                # 直播：重新抓 Playlist，從上一個 Segment 之後接續
+                await asyncio.sleep(segments[-1][0] if segments else 2.0)
+                _, segments, ended = await self._load(self.levels[level][1])
+                self._media[level] = (segments, ended)
+                urls = [u for _, u in segments]
+                self._seq = urls.index(self._last_url) + 1 if self._last_url in urls else max(0, len(urls) - 3)
+                if self._seq >= len(segments): return 0.0, 0
+        duration, url = segments[self._seq]
+        self._seq += 1
+        self._last_url = url
+        return duration, await StreamDownloader.fetch(url, headers=self.headers)
+
+class _ProgressiveSource:
+    """單一媒體檔 (mp4 等)：以 Range 請求模擬固定長度的 Segment，位元率階梯由 VIDEO_LADDER_KBPS 決定"""
+
+    def __init__(self, url, headers):
+        self.url = url
+        self.headers = headers
+        self.bitrates = [int(k) * 1000 for k in VideoStreamEmulator.LADDER_KBPS]
+        self._pos = 0
+
+    async def open(self):
+        pass
+
+    async def fetch_segment(self, level):
+        import aiohttp
+        seg = VideoStreamEmulator.SEGMENT_SECONDS
+        size = int(self.bitrates[level] / 8 * seg)
+        headers = dict(self.headers, Range=f"bytes={self._pos}-{self._pos + size - 1}")
+        try:
+            # 伺服器忽略 Range 時也只讀 size bytes
+            received = await StreamDownloader.fetch(self.url, max_bytes=size, headers=headers)
+        except aiohttp.ClientResponseError as e:
+            if e.status != 416: raise
+            # 超過檔案結尾：從頭再播
+            self._pos = 0
+            return 0.0, 0
+        self._pos += size
+        return seg, received
+
+class VideoStreamEmulator:
+    """
+    [新增] 輕量影音串流模擬
+    不佔用 Chromium Renderer，以 async Task 重現 ABR 串流的抓取型態：
+    起播時連續抓 Segment 填滿 Buffer (burst)，之後每播完一段才補一段 (steady state)，
+    並依量測到的吞吐量在位元率階梯間切換。來源可以是 HLS (.m3u8) 或單一媒體檔 (Range 請求)。
+    """
+    MODE = os.getenv("VIDEO_MODE", "emulate").lower()  # emulate / browser
+    MAX_VIEWERS = int(os.getenv("VIDEO_MAX_VIEWERS", "20"))
+    BUFFER_TARGET = float(os.getenv("VIDEO_BUFFER_S", "30"))
+    SEGMENT_SECONDS = 4.0
+    LADDER_KBPS = os.getenv("VIDEO_LADDER_KBPS", "400,1000,2500,5000").split(',')
+
+    _viewers = set()
+
+    @staticmethod
+    def spawn(source_url, duration, headers=None, tags=None):
+        """啟動背景觀看 Task；同時觀看人數已滿時回傳 False (tags 為事件紀錄的 persona / session)"""
+        if len(VideoStreamEmulator._viewers) >= VideoStreamEmulator.MAX_VIEWERS:
+            return False
+        task = asyncio.create_task(VideoStreamEmulator.watch(source_url, duration, headers or {}, tags or {}))
+        VideoStreamEmulator._viewers.add(task)
+        task.add_done_callback(VideoStreamEmulator._viewers.discard)
+        return True
+
+    @staticmethod
+    async def watch(source_url, duration, headers, tags=None):
+        source_cls = _HlsSource if '.m3u8' in source_url else _ProgressiveSource
+        source = source_cls(source_url, headers)
+        total = 0
+        with EventLog.timed("video_stream", source_url, watch_s=duration, **(tags or {})) as event:
+            try:
+                await source.open()
+                total = await VideoStreamEmulator._play(source, duration)
+                event['bytes'] = total
+                logger.info(f" -> [Video] Viewer finished ({total / 1024 / 1024:.1f} MB)")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                event['outcome'] = type(e).__name__
+                logger.error(f" -> [Video] Viewer failed: {e}")
+
+    @staticmethod
+    async def _play(source, duration):
+        bitrates = source.bitrates
+        level = 0
+        throughput = None
+        buffered = 0.0   # 已下載的媒體秒數
+        stalled = 0.0    # 累計卡頓秒數
+        total = 0
+        start = time.monotonic()
+        while True:
+            played = time.monotonic() - start - stalled
+            if played > buffered:
+                # Buffer 見底：播放暫停直到下一段抵達
+                stalled += played - buffered
+                played = buffered
+            if played >= duration: break
+
+            ahead = buffered - played
+            if ahead >= VideoStreamEmulator.BUFFER_TARGET:
+                # Steady state：等 Buffer 降到目標以下再補下一段
+                await asyncio.sleep(ahead - VideoStreamEmulator.BUFFER_TARGET + 0.1)
+                continue
+
+            # ABR：選擇不超過 80% 估計吞吐量的最高位元率
+            if throughput:
+                level = max([0] + [i for i, bw in enumerate(bitrates) if bw <= 0.8 * throughput])
+            t0 = time.monotonic()
+            seg_duration, received = await source.fetch_segment(level)
+            elapsed = max(time.monotonic() - t0, 1e-3)
+            total += received
+            buffered += seg_duration
+            if received:
+                sample = received * 8 / elapsed
+                throughput = sample if throughput is None else 0.7 * throughput + 0.3 * sample
+        return total
+
+    @staticmethod
+    async def cancel_all():
+        viewers = list(VideoStreamEmulator._viewers)
+        for v in viewers: v.cancel()
+        await asyncio.gather(*viewers, return_exceptions=True)
+
+class RoutingProfile:
+    """
+    [新增] 資源路由 / 頻寬塑形設定 (sites.json 的 routing_profiles)
+    - block_types / block_domains: 直接中斷的資源類型與網域 (含子網域)
+    - allow_domains: 白名單，命中時略過所有封鎖與延遲
+    - throttle: {"types": [...], "domains": [...], "delay_ms": N} 命中的請求延遲後才放行
+    - network: CDP 網路條件預設 (NETWORK_PRESETS) 或自訂 {latency, download_kbps, upload_kbps}
+    """
+    NETWORK_PRESETS = {
+        "mobile_3g": {"latency": 300, "download_kbps": 1600, "upload_kbps": 750},
+        "mobile_4g": {"latency": 70, "download_kbps": 12000, "upload_kbps": 3000},
+        "home_wifi": {"latency": 15, "download_kbps": 50000, "upload_kbps": 10000},
+        "office_lan": {"latency": 2, "download_kbps": 100000, "upload_kbps": 50000},
+    }
+
+    # 新分頁套用網路條件的 Task (保留參照，避免執行中被 GC)
+    _page_tasks = set()
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.block_types = frozenset(spec.get('block_types', []))
+        self.block_domains = tuple(spec.get('block_domains', []))
+        self.allow_domains = tuple(spec.get('allow_domains', []))
+        throttle = spec.get('throttle', {})
+        self.throttle_types = frozenset(throttle.get('types', []))
+        self.throttle_domains = tuple(throttle.get('domains', []))
+        self.throttle_delay = float(throttle.get('delay_ms', 0)) / 1000
+
+        network = spec.get('network')
+        if isinstance(network, str):
+            network = RoutingProfile.NETWORK_PRESETS.get(network)
+            if network is None:
+                logger.warning(f"[*] Routing profile {name}: unknown network preset {spec.get('network')}")
+        self.network = network
+
+        # 沒有任何路由規則時不註冊 context.route，避免每個請求都多繞一趟 Python
+        self.needs_route = bool(self.block_types or self.block_domains or
+                                (self.throttle_delay and (self.throttle_types or self.throttle_domains)))
+
+    @staticmethod
+    def _match(host, domains):
+        return any(host == d or host.endswith('.' + d) for d in domains)
+
+    async def _handle(self, route, request):
+        host = urlsplit(request.url).hostname or ''
+        if not self._match(host, self.allow_domains):
+            rtype = request.resource_type
+            if rtype in self.block_types or self._match(host, self.block_domains):
+                await route.abort('blockedbyclient')
+                return
+            if self.throttle_delay and (rtype in self.throttle_types or self._match(host, self.throttle_domains)):
+                await asyncio.sleep(self.throttle_delay)
+        await route.continue_()
+
+    async def apply_page(self, page: Page):
+        """CDP 網路條件是以分頁為單位，新分頁也要各自套用"""
+        if not self.network: return
+        try:
+            cdp = await page.context.new_cdp_session(page)
+            await cdp.send('Network.enable')
+            await cdp.send('Network.emulateNetworkConditions', {
+                'offline': False,
+                'latency': self.network.get('latency', 0),
+                'downloadThroughput': self.network.get('download_kbps', 0) * 1000 / 8 or -1,
+                'uploadThroughput': self.network.get('upload_kbps', 0) * 1000 / 8 or -1,
+            })
+        except Exception as e:
+            logger.warning(f"[Routing] Network emulation failed: {e}")
+
+    async def attach(self, context: BrowserContext, page: Page):
+        """對 Context 掛上路由規則，並對現有與之後開啟的分頁套用網路條件"""
+        if self.needs_route:
+            await context.route("**/*", self._handle)
+        await self.apply_page(page)
+        if self.network:
+            context.on('page', self._on_page)
+
+    def _on_page(self, page: Page):
+        task = asyncio.create_task(self.apply_page(page))
+        RoutingProfile._page_tasks.add(task)
+        task.add_done_callback(RoutingProfile._page_tasks.discard)
+
+class SiteIndex:
+    """
+    [新增] 由 sites.json 預先編譯的索引
+    - categories: 所有清單型態的頂層欄位都視為分類 (可自由新增分類)
+    - personas: 每個 Persona 的目標網址陣列與累積權重，取樣時直接 rng.choices(cum_weights=...)
+    只在設定檔變更時重建一次，Session 開始時不再重新串接清單。
+    """
+
+    def __init__(self, data):
+        self.raw = data
+        self.categories = {k: list(v) for k, v in data.items() if isinstance(v, list)}
+        # [新增] 網址 -> 所屬分類 (事件紀錄與頁面載入指標的 category)
+        self.url_category = {}
+        for category, urls in self.categories.items():
+            for url in urls: self.url_category.setdefault(url, category)
+
+        self.personas = {}  # name -> (targets, cum_weights)
+        self.download_limits = {}  # name -> (max_bytes, rate_bytes_per_s)，0 代表不限制
+        self.routing = {}  # name -> RoutingProfile 或 None
+        profiles = {k: RoutingProfile(k, v) for k, v in data.get('routing_profiles', {}).items()}
+        persona_weights = []
+        personas = data.get('personas')
+        if not personas:
+            from planner import DEFAULT_PERSONAS
+            personas = DEFAULT_PERSONAS
+        for name, spec in personas.items():
+            dl = spec.get('download', {})
+            self.download_limits[name] = (
+                int(float(dl.get('max_mb', StreamDownloader.MAX_MB)) * 1024 * 1024),
+                int(float(dl.get('rate_kbps', StreamDownloader.RATE_KBPS)) * 1000 / 8),
+            )
+            targets, cum_weights = self._compile_persona(spec.get('categories', []))
+            if not targets:
+                logger.warning(f"[*] Persona {name} has no targets, falling back to global_giants")
+                targets = list(DEFAULT_SITES['global_giants'])
+                cum_weights = list(range(1, len(targets) + 1))
+            self.personas[name] = (targets, cum_weights)
+            persona_weights.append(float(spec.get('weight', 1)))
+            self.routing[name] = profiles.get(spec.get('routing'))
+
+        self.persona_names = list(self.personas)
+        self.persona_cum_weights = list(itertools.accumulate(persona_weights))
+
+        # [新增] 開迴路負載曲線 (沒有 load_profile 或 enabled=false 時維持原本的閉迴路 Session)
+        spec = data.get('load_profile')
+        self.load_profile = LoadProfile(spec) if spec and spec.get('enabled', True) else None
+
+    def _compile_persona(self, categories):
+        if isinstance(categories, list):
+            categories = {c: 1.0 for c in categories}
+        targets, weights = [], []
+        for category, weight in categories.items():
+            urls = self.categories.get(category, [])
+            targets.extend(urls)
+            weights.extend([float(weight)] * len(urls))
+        return targets, list(itertools.accumulate(weights))
+
+    def category(self, name):
+        return self.categories.get(name, [])
+
+    def pick_persona(self, rng):
+        return rng.choices(self.persona_names, cum_weights=self.persona_cum_weights)[0]
+
+    def pick_target(self, persona, rng):
+        targets, cum_weights = self.personas[persona]
+        return rng.choices(targets, cum_weights=cum_weights)[0]
+
+class ConfigLoader:
+    """
+    負責讀取外部 JSON 設定檔
+    [修改] 以 (inode, mtime, size) 判斷檔案是否變更，未變更時直接回傳快取的 SiteIndex，
+    保留熱更新能力但不再每個 Session 重新解析 JSON。
+    """
+    # 注意：這個路徑是對應 Docker 容器內部的掛載路徑
+    CONFIG_PATH = "/traffic_data/sites.json"
+
+    _cache_key = None
+    _cache = None
+
+    @staticmethod
+    def load_sites():
+        path = ConfigLoader.CONFIG_PATH
+        try:
+            st = os.stat(path)
+            key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            key = 'default'
+
+        if key == ConfigLoader._cache_key:
+            return ConfigLoader._cache
+
+        if key == 'default':
+            logger.warning(f"[*] sites.json not found at {path}. Using Default.")
+            index = SiteIndex(DEFAULT_SITES)
+        else:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    index = SiteIndex(json.load(f))
+                logger.info(f"[*] Successfully loaded sites.json from {path} (personas: {', '.join(index.persona_names)})")
+            except Exception as e:
+                # 檔案寫到一半或格式錯誤：沿用上一版設定，記下這一版的 key，檔案再次變更時才重試
+                if ConfigLoader._cache is not None:
+                    logger.error(f"[*] Error loading JSON: {e}. Keeping previous config.")
+                    ConfigLoader._cache_key = key
+                    return ConfigLoader._cache
+                logger.error(f"[*] Error loading JSON: {e}. Using Default.")
+                index = SiteIndex(DEFAULT_SITES)
+
+        ConfigLoader._cache_key = key
+        ConfigLoader._cache = index
+        return index
+
+class LinkCache:
+    """
+    [新增] 以 URL 為 key 的候選連結快取 (LRU + TTL)
+    常逛的首頁再次造訪時，直接從快取挑連結，省下一次整頁掃描。
+    LINK_CACHE_SIZE=0 代表停用。
+    """
+
+    def __init__(self, size=None, ttl=None):
+        self.size = int(os.getenv("LINK_CACHE_SIZE", "256")) if size is None else size
+        self.ttl = float(os.getenv("LINK_CACHE_TTL", "600")) if ttl is None else ttl
+        self._entries = OrderedDict()  # url -> (stored_at, [href, ...])
+
+    def get(self, url):
+        entry = self._entries.get(url)
+        if not entry: return None
+        stored_at, hrefs = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[url]
+            return None
+        self._entries.move_to_end(url)
+        return hrefs
+
+    def put(self, url, hrefs):
+        if self.size <= 0 or not hrefs: return
+        self._entries[url] = (time.monotonic(), hrefs)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, url):
+        self._entries.pop(url, None)
+
+class TrajectoryBank:
+    """
+    [新增] 預先產生的滑鼠軌跡庫
+    Bezier 軌跡可拆成 B(t) = w0(t)*起點 + w1(t)*終點 + D(t)，其中 D(t) 只與控制點偏移有關。
+    預先以 NumPy 批次算好 (w0, w1, D + 手抖, 每點延遲)，使用時只需一次向量運算對齊起點與終點。
+    MOUSE_BANK_SIZE=0 代表每次即時產生。
+    """
+
+    def __init__(self, size=None, rng=None):
+        import numpy as np
+        size = int(os.getenv("MOUSE_BANK_SIZE", "256")) if size is None else size
+        self.rng = rng or np.random.default_rng()
+        self._entries = [TrajectoryBank.generate(self.rng) for _ in range(size)]
+
+    @staticmethod
+    def generate(rng):
+        import numpy as np
+        steps = int(rng.integers(20, 51))
+        t = np.linspace(0, 1, steps)
+        u = 1 - t
+        b0, b1, b2, b3 = u**3, 3 * u**2 * t, 3 * u * t**2, t**3
+        # 控制點偏移 (與原本相同：±100~500 px)
+        offset = int(rng.integers(100, 501))
+        o1, o2 = rng.integers(-offset, offset + 1, size=(2, 2))
+        disp = b1[:, None] * o1 + b2[:, None] * o2
+        # 手部微抖，首尾兩點固定
+        jitter = rng.normal(0.0, 0.6, size=(steps, 2))
+        jitter[[0, -1]] = 0.0
+        delays = rng.uniform(0.001, 0.01, steps)
+        return b0 + b1, b2 + b3, disp + jitter, delays
+
+    def sample(self, start, target, rng=random):
+        """回傳 (path: (n, 2) ndarray, delays: (n,) ndarray 秒)；rng 為呼叫端 Session 的 random.Random"""
+        import numpy as np
+        if self._entries:
+            w0, w1, disp, delays = self._entries[rng.randrange(len(self._entries))]
+            # 隨機鏡射偏移量，讓有限的軌跡庫產生更多變化
+            disp = disp * (rng.choice((-1.0, 1.0)), rng.choice((-1.0, 1.0)))
+        else:
+            w0, w1, disp, delays = TrajectoryBank.generate(self.rng)
+        path = w0[:, None] * np.asarray(start, dtype=float) + w1[:, None] * np.asarray(target, dtype=float) + disp
+        return path, delays
+
+class HumanBehavior:
+    """
+    人類行為模型
+    [修改] 改為每個 Session 一個實例：游標位置、捲動位置、RNG 與 Persona 都屬於該 Session，
+    同一個 Event Loop 內的多個 Context 互不干擾。使用 __slots__ 讓每個 Session 狀態只佔幾十 bytes。
+    (連結快取與軌跡庫為唯讀共用資源，仍放在類別層級)
+    """
+    __slots__ = ('persona', 'session', 'rng', 'np_rng', 'cursor_x', 'cursor_y', 'scroll_y')
+
+    _link_cache = LinkCache()
+    _trajectories = None  # TrajectoryBank，第一次移動滑鼠時才建立 (不拖慢冷啟動)
+
+    # [新增] 滑鼠軌跡派送模式：cdp = 每點一次 page.mouse.move；script = 頁面內腳本一次播放整條軌跡
+    MOUSE_DISPATCH = os.getenv("MOUSE_DISPATCH", "cdp").lower()
+    MOUSE_REPLAY_JS = """async ([points, delays]) => {
+        const sleep = ms => new Promise(r => setTimeout(r, ms));
+        let last = null;
+        for (let i = 0; i < points.length; i++) {
+            const [x, y] = points[i];
+            const init = {bubbles: true, cancelable: true, view: window, clientX: x, clientY: y};
+            const el = document.elementFromPoint(x, y) || document.body;
+            if (el !== last) {
+                if (last) last.dispatchEvent(new MouseEvent('mouseout', init));
+                el.dispatchEvent(new MouseEvent('mouseover', init));
+                last = el;
+            }
+            el.dispatchEvent(new MouseEvent('mousemove', init));
+            await sleep(delays[i]);
+        }
+    }"""
+
+    # [新增] 單次 evaluate 完成連結探索：過濾 href、檢查可見性並回傳座標，
+    # 取代逐一 get_attribute / scroll_into_view / bounding_box 的大量 CDP 往返
+    LINK_SCAN_JS = """(limit) => {
+        const out = [], found = [];
+        const vw = window.innerWidth, vh = window.innerHeight;
+        for (const a of document.querySelectorAll('a[href]')) {
+            const raw = a.getAttribute('href');
+            if (!raw || raw.startsWith('javascript') || raw.startsWith('#')) continue;
+            const r = a.getBoundingClientRect();
+            if (r.width <= 0 || r.height <= 0) continue;
+            const st = getComputedStyle(a);
+            if (st.visibility === 'hidden' || st.display === 'none') continue;
+            found.push(a);
+            out.push({href: a.href, x: r.x, y: r.y, width: r.width, height: r.height,
+                      inView: r.top >= 0 && r.left >= 0 && r.bottom <= vh && r.right <= vw});
+            if (out.length >= limit) break;
+        }
+        window.__tgLinks = found;
+        return out;
+    }"""
+
+    # 將選中的連結捲動到畫面中並回傳新座標 (idx 對應上一次掃描，或以 href 直接尋找)
+    LINK_FOCUS_JS = """([idx, href]) => {
+        let a = null;
+        if (href !== null) {
+            for (const el of document.querySelectorAll('a[href]')) { if (el.href === href) { a = el; break; } }
+        } else if (window.__tgLinks) {
+            a = window.__tgLinks[idx];
+        }
+        if (!a || !a.isConnected) return null;
+        a.scrollIntoView({block: 'center', inline: 'nearest'});
+        const r = a.getBoundingClientRect();
+        if (r.width <= 0 || r.height <= 0) return null;
+        return {x: r.x, y: r.y, width: r.width, height: r.height};
+    }"""
+
+    def __init__(self, persona, seed=None):
+        self.persona = persona
+        self.session = EventLog.new_session()
+        import numpy as np
+        self.rng = random.Random(seed)
+        self.np_rng = np.random.default_rng(seed)
+        self.cursor_x = None
+        self.cursor_y = None
+        self.scroll_y = 0
+
+    def event(self, kind, target=None, outcome="ok", latency=None, **extra):
+        EventLog.emit(kind, target, outcome, latency, self.persona, self.session, **extra)
+
+    def timed(self, kind, target=None, **extra):
+        return EventLog.timed(kind, target, self.persona, self.session, **extra)
+
+    def get_pareto_sleep_time(self, min_s=2.0, max_s=300.0, alpha=3.0):
+        s = (self.np_rng.pareto(alpha) + 1) * min_s
+        return min(s, max_s)
+
+    def reset_page(self):
+        """換頁後捲動位置歸零 (游標位置保留，與真人一致)"""
+        self.scroll_y = 0
+
+    @staticmethod
+    def bezier_curve(p0, p1, p2, p3, steps=30):
+        """向量化三次 Bezier：回傳 (steps, 2) 的 ndarray"""
+        import numpy as np
+        t = np.linspace(0, 1, steps)[:, None]
+        u = 1 - t
+        pts = np.asarray([p0, p1, p2, p3], dtype=float)
+        return u**3 * pts[0] + 3 * u**2 * t * pts[1] + 3 * u * t**2 * pts[2] + t**3 * pts[3]
+
+    async def human_mouse_move(self, page: Page, target_x: float, target_y: float):
+        start_box = page.viewport_size
+        if not start_box: return
+        
+        if self.cursor_x is None:
+            self.cursor_x = self.rng.randint(0, start_box['width'])
+            self.cursor_y = self.rng.randint(0, start_box['height'])
+            await page.mouse.move(self.cursor_x, self.cursor_y)
+
+        if HumanBehavior._trajectories is None: HumanBehavior._trajectories = TrajectoryBank()
+        path, delays = HumanBehavior._trajectories.sample((self.cursor_x, self.cursor_y), (target_x, target_y), self.rng)
+
+        if HumanBehavior.MOUSE_DISPATCH == 'script':
+            # 整條軌跡交給頁面內腳本播放，一次 CDP 往返
+            await page.evaluate(HumanBehavior.MOUSE_REPLAY_JS, [path.round(1).tolist(), (delays * 1000).round(1).tolist()])
+        else:
+            for (x, y), delay in zip(path.tolist(), delays.tolist()):
+                await page.mouse.move(x, y)
+                await asyncio.sleep(delay)
+        self.cursor_x, self.cursor_y = target_x, target_y
+
+    async def human_scroll(self, page: Page):
+        # 失敗 (頁面關閉、導覽中) 不中斷 Session，但由 timed() 記錄結果
+        try:
+            with self.timed("scroll", page.url):
+                scroll_height = await page.evaluate("document.body.scrollHeight")
+                viewport_height = page.viewport_size['height'] if page.viewport_size else 800
+            
+                for _ in range(self.rng.randint(3, 10)):
+                    scroll_step = self.rng.randint(int(viewport_height * 0.3), int(viewport_height * 0.7))
+                    await page.mouse.wheel(0, scroll_step)
+                    self.scroll_y += scroll_step
+                    await asyncio.sleep(self.get_pareto_sleep_time(min_s=0.5, max_s=3.0))
+                
+                    # 偶爾回滾
+                    if self.rng.random() < 0.15:
+                        back = self.rng.randint(100, 300)
+                        await page.mouse.wheel(0, -back)
+                        self.scroll_y = max(0, self.scroll_y - back)
+                        await asyncio.sleep(1)
+
+                    scroll_height = await page.evaluate("document.body.scrollHeight")
+                    if self.scroll_y >= scroll_height - viewport_height: break
+        except Exception: pass
+
+    async def _pick_link_box(self, page: Page, limit=30):
+        """回傳要點擊的連結座標 (dict: x/y/width/height)，沒有可點的連結則回傳 None"""
+        url = page.url
+        cache = HumanBehavior._link_cache
+
+        # 快取命中：直接以 href 定位，一次往返
+        cached = cache.get(url)
+        if cached:
+            box = await page.evaluate(HumanBehavior.LINK_FOCUS_JS, [0, self.rng.choice(cached)])
+            if box: return box
+            cache.invalidate(url)
+
+        links = await page.evaluate(HumanBehavior.LINK_SCAN_JS, limit)
+        if not links: return None
+        cache.put(url, [l['href'] for l in links])
+
+        idx = self.rng.randrange(len(links))
+        target = links[idx]
+        if target['inView']: return target
+        return await page.evaluate(HumanBehavior.LINK_FOCUS_JS, [idx, None])
+
+    async def try_click_link(self, page: Page, context: BrowserContext):
+        with self.timed("click") as event:
+            return await self._click_link(page, context, event)
+
+    async def _click_link(self, page, context, event):
+        try:
+            box = await self._pick_link_box(page)
+            
+            if box:
+                logger.info(" -> [Deep Browsing] Clicking link...")
+                await self.human_mouse_move(page, box['x']+box['width']/2, box['y']+box['height']/2)
+                await asyncio.sleep(self.rng.uniform(0.3, 0.7))
+                
+                current_count = len(context.pages)
+                await page.mouse.click(box['x']+box['width']/2, box['y']+box['height']/2)
+                await asyncio.sleep(2)
+                self.reset_page()
+                
+                if len(context.pages) > current_count:
+                    new_page = context.pages[-1]
+                    logger.info(" -> [Nav] New tab detected! Switching...")
+                    try: await new_page.wait_for_load_state('domcontentloaded', timeout=10000)
+                    except Exception as e: event['load'] = type(e).__name__
+                    if not page.is_closed(): await page.close()
+                    event.update(outcome="new_tab", target=new_page.url)
+                    return new_page
+                else:
+                    try: await page.wait_for_load_state('domcontentloaded', timeout=5000)
+                    except Exception as e: event['load'] = type(e).__name__
+                    event['target'] = page.url
+                    return page
+            event['outcome'] = "no_link"
+            return None
+        except Exception as e:
+            event['outcome'] = type(e).__name__
+            return None
+
+    async def download_file(self, page: Page, url: str, limits=(0, 0)):
+        logger.info(f" -> [Download] Start: {url}")
+        with self.timed("download", url, mode=StreamDownloader.MODE) as event:
+            if StreamDownloader.MODE == 'stream':
+                max_bytes, rate_bps = limits
+                try:
+                    headers = {'User-Agent': await page.evaluate("navigator.userAgent"), 'Referer': page.url}
+                    received = await StreamDownloader.fetch(url, max_bytes, rate_bps, headers)
+                    event['bytes'] = received
+                    logger.info(f" -> [Download] Done (streamed {received / 1024 / 1024:.1f} MB)")
+                except Exception as e:
+                    event['outcome'] = type(e).__name__
+                    logger.error(f" -> [Download] Failed: {e}")
+                return
+
+            try:
+                async with page.expect_download() as download_info:
+                    # 直接下載的網址 goto 本身會丟例外 (不是頁面)，照樣等下載事件，只記下原因
+                    try: await page.goto(url, timeout=60000)
+                    except Exception as e: event['goto'] = type(e).__name__
+                
+                download = await download_info.value
+                path = await download.path()
+                logger.info(f" -> [Download] Done: {download.suggested_filename}")
+                if path and os.path.exists(path):
+                    event['bytes'] = os.path.getsize(path)
+                    os.remove(path)
+            except Exception as e:
+                event['outcome'] = type(e).__name__
+                logger.error(f" -> [Download] Failed: {e}")
+
+    async def watch_video(self, page: Page, url: str, streams=(), duration=None):
+        logger.info(f" -> [Video] Streaming: {url}")
+        # 記錄頁面自己發出的媒體請求 (HLS Playlist / 媒體檔)，優先用真實來源做串流模擬
+        sniffed = []
+        def on_request(request):
+            if '.m3u8' in request.url or request.resource_type == 'media':
+                sniffed.append(request.url)
+        page.on('request', on_request)
+        try:
+            with self.timed("video", url) as event:
+                await page.goto(url, wait_until='domcontentloaded')
+                await asyncio.sleep(5)
+                # 嘗試點擊播放
+                try: await page.click('video, .html5-video-player', timeout=3000)
+                except Exception as e: event['play'] = type(e).__name__
+                
+                watch_duration = duration or self.rng.randint(180, 1800)
+                event['watch_s'] = watch_duration
+
+                # [新增] Emulate 模式：交給背景 Task 模擬串流，Session 不必佔住 Browser 數十分鐘
+                if VideoStreamEmulator.MODE == 'emulate':
+                    source = sniffed[0] if sniffed else (self.rng.choice(streams) if streams else None)
+                    headers = {'User-Agent': await page.evaluate("navigator.userAgent"), 'Referer': page.url}
+                    tags = {'persona': self.persona, 'session': self.session}
+                    if source and VideoStreamEmulator.spawn(source, watch_duration, headers, tags):
+                        logger.info(f" -> [Video] Emulating {watch_duration}s stream from {source}")
+                        event.update(mode="emulate", stream=source)
+                        return
+
+                logger.info(f" -> [Video] Watching for {watch_duration}s...")
+                event['mode'] = "browser"
+                await asyncio.sleep(watch_duration)
+        except Exception as e:
+            # timed() 已記錄結果，這裡只避免中斷 Session
+            logger.warning(f" -> [Video] Failed: {e}")
+        finally:
+            page.remove_listener('request', on_request)
+
+async def run_browsing_session(context: BrowserContext, site_index: SiteIndex, pacer=None, plan=None):
+    """
+    單一 Persona Session (在共用 Browser 的獨立 Context 中執行)
+    [修改] 指定 pacer (開迴路模式) 時，動作數與動作間隔由 load_profile 決定，不再等固定的 5~10 秒
+    [新增] 指定 plan (planner.SessionPlan) 時，Persona、動作序列、目標、深度、停留與觀看時間都照計畫執行，
+           每個計畫步驟算一個動作 (深入點擊不另計)；頁面上的細部行為使用計畫中的 Session 種子
+    """
+    # --- Persona (興趣) 隨機選擇 ---
+    # 每次 Session 隨機扮演一種角色 (依 sites.json personas 權重)，決定它會去逛哪些網站
+    if plan and plan.persona in site_index.personas: persona = plan.persona
+    else: persona = site_index.pick_persona(random)
+
+    Metrics.new_session()
+    page = await context.new_page()
+    # [新增] Persona 的資源路由 / 網路條件，須在第一次導覽前掛上
+    routing = site_index.routing.get(persona)
+    if routing: await routing.attach(context, page)
+    # [新增] 第一個 Session 已在跑：寫入 Readiness 檔 (之後的 Session 不做事)
+    Startup.mark_ready()
+
+    from planner import ACTION_BROWSE, ACTION_DOWNLOAD, ACTION_VIDEO
+    # 本 Session 專屬的行為狀態 (游標 / 捲動 / RNG)，之後的隨機決策都走這個 RNG
+    behavior = HumanBehavior(persona, plan.seed if plan else None)
+    rng = behavior.rng
+
+    total_actions = len(plan.steps) if plan else pacer.total if pacer else rng.randint(10, 25)
+    logger.info(f"[*] NEW SESSION | Persona: {persona} | Actions: {total_actions}"
+                + (f" | Plan #{plan.index}" if plan else ""))
+    session_start = time.monotonic()
+    behavior.event("session_start", actions=total_actions, plan=plan.index if plan else None)
+
+    actions = 0
+    step_no = 0
+    while (step_no < total_actions) if plan else (actions < total_actions):
+        if page.is_closed(): 
+            if context.pages: page = context.pages[0]
+            else: break
+
+        if plan:
+            kind, target, max_depth, dwell, watch = plan.steps[step_no]
+        else:
+            # 10% 機率下載、20% 機率看影片、70% 機率一般瀏覽
+            dice = rng.random()
+            kind = ACTION_DOWNLOAD if dice < 0.10 else ACTION_VIDEO if dice < 0.30 else ACTION_BROWSE
+            target = max_depth = dwell = watch = None
+        step_no += 1
+
+        if kind == ACTION_DOWNLOAD:
+            dl_list = site_index.category('download')
+            target = target or (rng.choice(dl_list) if dl_list else None)
+            if target:
+                await behavior.download_file(page, target, site_index.download_limits[persona])
+                actions += 1
+        
+        elif kind == ACTION_VIDEO:
+            vid_list = site_index.category('video')
+            target = target or (rng.choice(vid_list) if vid_list else None)
+            if target:
+                await behavior.watch_video(page, target, site_index.category('video_streams'), watch)
+                actions += 1
+        
+        else:
+            target = target or site_index.pick_target(persona, rng)
+            max_depth = max_depth or rng.randint(2, 4)
+            logger.info(f"[{actions+1}] Browsing: {target} (Depth: {max_depth})")
+            try:
+                with behavior.timed("navigate", target, depth=max_depth, category=site_index.url_category.get(target)):
+                    await page.goto(target, wait_until='domcontentloaded', timeout=60000)
+                behavior.reset_page()
+                actions += 1
+                
+                # 深度瀏覽邏輯
+                current_depth = 0
+                while current_depth < max_depth:
+                    await asyncio.sleep(rng.uniform(2, 5))
+                    
+                    # 隨機滑動
+                    if rng.random() < 0.7:
+                        await behavior.human_scroll(page)
+                    
+                    # 點擊連結深入
+                    if rng.random() < 0.6:
+                        new_page = await behavior.try_click_link(page, context)
+                        if new_page:
+                            page = new_page
+                            current_depth += 1
+                            actions += 1
+                        else:
+                            break
+                    else:
+                        # 隨機回上一頁
+                        if current_depth > 0 and rng.random() < 0.3:
+                            with behavior.timed("back"):
+                                await page.go_back()
+                            behavior.reset_page()
+                            current_depth -= 1
+                    
+                    if page.is_closed(): break
+
+            except Exception: pass
+        
+        if pacer: await pacer.next(rng)
+        else: await asyncio.sleep(dwell or rng.randint(5, 10))
+
+    behavior.event("session_end", latency=time.monotonic() - session_start, actions=actions)
+
+class LoadProfile:
+    """
+    [新增] 開迴路負載曲線 (sites.json 的 load_profile)
+    每個容器的 Session 到達率 = sessions_per_hour × 日曲線 (當地時間，整點之間線性內插) × 週曲線 (週一 ~ 週日)
+    diurnal / weekly 可為預設曲線名稱或 24 / 7 個倍率。
+    """
+    HOURLY_SHAPES = {
+        "flat": [1.0] * 24,
+        # 辦公室：8~9 點爬升、午休下降、18 點後快速下降，夜間只剩背景流量
+        "office": [0.03, 0.02, 0.02, 0.02, 0.02, 0.03, 0.08, 0.25, 0.65, 1.0, 1.0, 0.9,
+                   0.55, 0.85, 1.0, 1.0, 0.95, 0.75, 0.4, 0.2, 0.15, 0.1, 0.06, 0.04],
+        # 住宅：白天偏低、20~23 點晚間高峰
+        "residential": [0.3, 0.15, 0.08, 0.05, 0.05, 0.05, 0.1, 0.2, 0.3, 0.35, 0.4, 0.45,
+                        0.5, 0.45, 0.45, 0.5, 0.55, 0.65, 0.8, 0.9, 1.0, 1.0, 0.85, 0.55],
+    }
+    WEEKLY_SHAPES = {
+        "flat": [1.0] * 7,
+        "office": [1.0, 1.0, 1.0, 1.0, 0.95, 0.15, 0.1],
+        "residential": [0.85, 0.85, 0.85, 0.85, 0.9, 1.0, 1.0],
+    }
+
+    def __init__(self, spec):
+        self.sessions_per_hour = float(spec.get('sessions_per_hour', 30))
+        self.actions_per_minute = float(spec.get('actions_per_minute', 4))
+        low, high = spec.get('session_actions', [10, 25])
+        self.session_actions = (int(low), max(int(low), int(high)))
+        self.arrival = spec.get('arrival', 'poisson')          # poisson | uniform
+        self.max_concurrent = int(spec.get('max_concurrent', 0))  # 0 = SESSIONS_PER_CONTAINER
+        self.max_backlog = int(spec.get('max_backlog', 10))     # 排隊超過此數的到達直接丟棄 (並計入落後)
+        self.utc_offset = float(spec.get('utc_offset_hours', 8)) * 3600
+        self.time_scale = float(spec.get('time_scale', 1))      # >1 時壓縮曲線時間 (例如 24 = 1 小時跑完一天)
+        self.hourly = self._shape(spec.get('diurnal', 'flat'), LoadProfile.HOURLY_SHAPES, 24)
+        self.weekly = self._shape(spec.get('weekly', 'flat'), LoadProfile.WEEKLY_SHAPES, 7)
+        self.peak_rate = self.sessions_per_hour / 3600 * max(self.hourly) * max(self.weekly)
+
+    @staticmethod
+    def _shape(value, presets, length):
+        if isinstance(value, str):
+            if value not in presets:
+                logger.warning(f"[Load] Unknown curve '{value}', using flat")
+                value = 'flat'
+            return list(presets[value])
+        values = [max(0.0, float(v)) for v in value]
+        if len(values) != length:
+            logger.warning(f"[Load] Curve needs {length} values (got {len(values)}), using flat")
+            return [1.0] * length
+        return values
+
+    def multiplier(self, epoch):
+        local = epoch + self.utc_offset
+        hours = (local / 3600) % 24
+        h0 = int(hours)
+        frac = hours - h0
+        hourly = self.hourly[h0] * (1 - frac) + self.hourly[(h0 + 1) % 24] * frac
+        weekday = int(local // 86400 + 3) % 7  # 1970-01-01 是星期四 (週一 = 0)
+        return hourly * self.weekly[weekday]
+
+    def session_rate(self, epoch):
+        """每秒 Session 到達率"""
+        return self.sessions_per_hour / 3600 * self.multiplier(epoch)
+
+class ActionPacer:
+    """
+    [新增] Session 內的動作排程：預定時間依 actions_per_minute 的 Poisson 過程累加，
+    不等前一個動作實際花了多久；動作做不完而超過預定時間時記為延遲。
+    """
+    __slots__ = ('scheduler', 'rate', 'due', 'total')
+
+    def __init__(self, scheduler, profile, rng):
+        self.scheduler = scheduler
+        self.rate = max(profile.actions_per_minute, 1e-6) / 60
+        self.due = time.monotonic()
+        self.total = rng.randint(*profile.session_actions)
+
+    async def next(self, rng):
+        self.due += rng.expovariate(self.rate)
+        delay = self.due - time.monotonic()
+        self.scheduler.record_action(max(0.0, -delay))
+        if delay > 0: await asyncio.sleep(delay)
+
+class OpenLoopScheduler:
+    """
+    [新增] 開迴路 Session 排程器
+    依 load_profile 產生 Session 到達時間 (非齊次 Poisson 以 thinning 取樣，或等間隔)，
+    交給最多 max_concurrent 個併發 Session 執行。Offered load 只由設定決定，不隨網站速度漂移；
+    來不及消化時 (排隊、丟棄、動作延遲) 每分鐘回報一次。曲線隨 sites.json 熱更新。
+    """
+    REPORT_INTERVAL = 60
+
+    def __init__(self, pool, profile):
+        self.pool = pool
+        self.profile = profile
+        self.slots = profile.max_concurrent or pool.size
+        self.queue = asyncio.Queue()
+        self.started_at = time.time()
+        self._reset_period()
+
+    def _reset_period(self):
+        self.offered = self.started = self.dropped = 0
+        self.start_lags = []
+        self.action_lags = []
+
+    def _current_profile(self):
+        profile = ConfigLoader.load_sites().load_profile
+        if profile: self.profile = profile
+        return self.profile
+
+    def curve_time(self, epoch=None):
+        epoch = time.time() if epoch is None else epoch
+        return self.started_at + (epoch - self.started_at) * self.profile.time_scale
+
+    def record_action(self, lag):
+        self.action_lags.append(lag)
+
+    async def _arrivals(self):
+        from planner import STREAM_ARRIVALS
+        rng = random.Random(REPLICA_PLAN.int_seed(STREAM_ARRIVALS) if REPLICA_PLAN else None)
+        due = time.monotonic()
+        while True:
+            profile = self._current_profile()
+            if profile.arrival == 'uniform':
+                rate = profile.session_rate(self.curve_time())
+                if rate <= 0:
+                    await asyncio.sleep(60)
+                    due = time.monotonic()
+                    continue
+                due += 1 / rate
+            else:
+                if profile.peak_rate <= 0:
+                    await asyncio.sleep(60)
+                    due = time.monotonic()
+                    continue
+                due += rng.expovariate(profile.peak_rate)
+            delay = due - time.monotonic()
+            if delay > 0: await asyncio.sleep(delay)
+            # thinning：以尖峰速率產生候選到達，依當下速率 / 尖峰速率的比例接受
+            if profile.arrival != 'uniform' and rng.random() * profile.peak_rate > profile.session_rate(self.curve_time()):
+                continue
+            self.offered += 1
+            if self.queue.qsize() >= profile.max_backlog:
+                self.dropped += 1
+                continue
+            self.queue.put_nowait(time.monotonic())
+
+    async def _slot(self, slot_id):
+        rng = random.Random()
+        while True:
+            arrived = await self.queue.get()
+            self.start_lags.append(time.monotonic() - arrived)
+            self.started += 1
+            profile = self._current_profile()
+            await self.pool.run_session(slot_id, ActionPacer(self, profile, rng))
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(OpenLoopScheduler.REPORT_INTERVAL)
+            profile = self.profile
+            hours = OpenLoopScheduler.REPORT_INTERVAL / 3600
+            target = profile.session_rate(self.curve_time()) * 3600
+            import numpy as np
+            start_p95 = float(np.percentile(self.start_lags, 95)) if self.start_lags else 0.0
+            action_p95 = float(np.percentile(self.action_lags, 95)) if self.action_lags else 0.0
+            backlog = self.queue.qsize()
+            # 落後：有到達被丟棄 / 仍在排隊，或動作延遲的 p95 超過平均動作間隔
+            behind = self.dropped > 0 or backlog > 0 or action_p95 > 60 / max(profile.actions_per_minute, 1e-6)
+            msg = (f"[Load] sessions/h target {target:.1f} offered {self.offered / hours:.1f} started {self.started / hours:.1f} "
+                   f"dropped {self.dropped} backlog {backlog} (start lag p95 {start_p95:.1f}s) | "
+                   f"actions/min {len(self.action_lags) / (hours * 60):.1f} (lag p95 {action_p95:.1f}s)")
+            if behind: logger.warning(msg + " -- falling behind schedule")
+            else: logger.info(msg)
+            self._reset_period()
+
+    def start(self):
+        logger.info(f"[Load] Open-loop scheduler: {self.profile.sessions_per_hour} sessions/h peak x curve, "
+                    f"{self.profile.actions_per_minute} actions/min, {self.slots} concurrent sessions")
+        tasks = [asyncio.create_task(self._arrivals()), asyncio.create_task(self._report())]
+        tasks += [asyncio.create_task(self._slot(i)) for i in range(self.slots)]
+        return tasks
+
+class BrowserPool:
+    """
+    [新增] 長駐 Chromium + 多 Context 併發模型
+    一個容器只啟動一次 Browser，N 個 Persona Session 各自使用獨立的 BrowserContext，
+    Session 結束後只回收 Context (Cookie/Cache 隔離)，不重啟 Browser。
+    """
+    SESSIONS = max(1, int(os.getenv("SESSIONS_PER_CONTAINER", "1")))
+    CONTEXT_OPTIONS = {'viewport': {'width': 1920, 'height': 1080}, 'locale': 'zh-TW', 'accept_downloads': True}
+    STEALTH_SCRIPT = "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+
+    def __init__(self, size=None):
+        self.size = size or BrowserPool.SESSIONS
+        self.active = 0  # 開啟中的 Context 數 (Metrics)
+        self._playwright = None
+        self._browser = None
+        self._launch_lock = asyncio.Lock()
+
+    async def start(self):
+        from playwright.async_api import async_playwright
+        self._playwright = await async_playwright().start()
+        Startup.phase("playwright")
+        await self._ensure_browser()
+        Startup.phase("chromium")
+
+    async def _ensure_browser(self):
+        """Browser 當掉 (OOM / crash) 時自動重新啟動，所有 Worker 共用同一個實例"""
+        async with self._launch_lock:
+            if self._browser and self._browser.is_connected():
+                return self._browser
+            is_headless = os.getenv("HEADLESS_MODE", "False").lower() == "true"
+            launch_args = {"headless": is_headless, "args": ["--disable-blink-features=AutomationControlled"]}
+            self._browser = await self._playwright.chromium.launch(**launch_args)
+            logger.info(f"[Pool] Chromium launched (sessions per container: {self.size})")
+            return self._browser
+
+    async def new_context(self) -> BrowserContext:
+        browser = await self._ensure_browser()
+        context = await browser.new_context(**BrowserPool.CONTEXT_OPTIONS)
+        await context.add_init_script(BrowserPool.STEALTH_SCRIPT)
+        return context
+
+    async def run_session(self, worker_id, pacer=None):
+        """執行一個 Session，回傳使用的計畫 (非計畫模式為 None)"""
+        # 每個 Session 開始前重新載入設定，修改 JSON 後下一個 Session 就會生效
+        site_index = ConfigLoader.load_sites()
+        plan = REPLICA_PLAN.next_session() if REPLICA_PLAN else None
+        context = None
+        try:
+            context = await self.new_context()
+            self.active += 1
+            await run_browsing_session(context, site_index, pacer, plan)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[Pool] Worker {worker_id} session error: {e}")
+        finally:
+            if context:
+                self.active -= 1
+                try: await context.close()
+                except Exception: pass
+        return plan
+
+    async def _session_worker(self, worker_id):
+        # 錯開各 Worker 的起始時間，避免同時冷啟動
+        await asyncio.sleep(worker_id * random.uniform(2, 6))
+        while True:
+            plan = await self.run_session(worker_id)
+            await asyncio.sleep(plan.pause if plan else random.randint(5, 15))
+
+    async def run(self):
+        # [修改] sites.json 設定 load_profile 時改用開迴路排程 (啟動時決定模式，之後只熱更新曲線與速率)
+        profile = ConfigLoader.load_sites().load_profile
+        if profile:
+            workers = OpenLoopScheduler(self, profile).start()
+            # 開迴路模式的第一個到達可能要等很久 (離峰時段)，Browser 已啟動、排程器開始等待即視為就緒
+            Startup.mark_ready("scheduler")
+        else:
+            workers = [asyncio.create_task(self._session_worker(i)) for i in range(self.size)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers: w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def close(self):
+        if self._browser:
+            try: await self._browser.close()
+            except Exception: pass
+        if self._playwright:
+            await self._playwright.stop()
+
+async def main():
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, graceful_shutdown, sig, stop_event)
+    # [新增] 冷啟動各階段計時，第一個 Session 開始後寫入 Readiness 檔
+    Startup.begin()
+
+    # [新增] PLAN_SEED 設定時，依 sites.json 與 REPLICA_ID 產生本容器的 Session 計畫 (同樣的種子可重播)
+    # (沒有設定時不載入 planner / NumPy)
+    global REPLICA_PLAN
+    if os.getenv("PLAN_SEED") or os.getenv("PLAN_FILE"):
+        from planner import DEFAULT_PERSONAS, ReplicaPlan
+        REPLICA_PLAN = ReplicaPlan.from_env(ConfigLoader.load_sites().raw, DEFAULT_PERSONAS)
+    if REPLICA_PLAN:
+        logger.info(f"[Plan] Replaying plan seed={REPLICA_PLAN.master_seed} replica={REPLICA_PLAN.replica_id}")
+
+    EventLog.start()
+    pool = BrowserPool()
+    # [新增] METRICS_PORT 設定時開啟 /metrics
+    Metrics.gauge("bot_active_contexts", lambda: pool.active)
+    Metrics.gauge("bot_video_viewers", lambda: len(VideoStreamEmulator._viewers))
+    await Metrics.start()
+    Startup.phase("config")
+    await pool.start()
+
+    # 背景雜訊在整個容器生命週期只跑一份，不隨 Session 重建
+    dns_task = asyncio.create_task(SystemNoise._dns_query_loop())
+    proto_task = asyncio.create_task(ProtocolSimulator.run_protocol_noise())
+    pool_task = asyncio.create_task(pool.run())
+    stop_task = asyncio.create_task(stop_event.wait())
+
+    try:
+        await asyncio.wait([pool_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        tasks = (pool_task, stop_task, dns_task, proto_task)
+        for t in tasks: t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await VideoStreamEmulator.cancel_all()
+        await pool.close()
+        await StreamDownloader.close()
+        await EventLog.stop()
+        await Metrics.stop()
+
+def graceful_shutdown(signum, stop_event):
+    logger.info(f"Received signal {signum}. Shutting down gracefully...")
+    # 由 main() 負責取消所有 Session 並關閉 Browser
+    stop_event.set()
@@ -0,0 +1,35 @@
+"""
+【映像檔預熱】
+docker build 時執行一次：用與 simulator.BrowserPool 相同的設定啟動 Chromium、開一個 Context 並渲染含中英日文字的頁面，
+確認映像檔內的 Browser 能正常啟動 (失敗時建置中止)，並讓 fontconfig 的字型快取留在映像檔裡。
+不會保留 Browser Profile：BrowserPool 以 chromium.launch() 啟動，每次都使用新的暫存 Profile，
+各 Session 又是獨立的 Context，預熱的 Profile 在執行時不會被用到。
+"""
+
+import asyncio
+import time
+
+from simulator import BrowserPool, logger
+
+WARMUP_PAGE = ("data:text/html;charset=utf-8,<html><body style='font-family:sans-serif'>"
+               "<h1>Warmup</h1><p>預熱 ウォームアップ 0123456789</p><canvas id='c'></canvas></body></html>")
+
+
+async def main():
+    start = time.monotonic()
+    pool = BrowserPool()
+    try:
+        await pool.start()
+        context = await pool.new_context()
+        page = await context.new_page()
+        await page.goto(WARMUP_PAGE)
+        # 實際排版與光柵化一次，確認字型可用
+        await page.screenshot()
+        await context.close()
+    finally:
+        await pool.close()
+    logger.info(f"[Warmup] Chromium launched and rendered in {time.monotonic() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
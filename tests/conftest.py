@@ -0,0 +1,17 @@
+"""
+測試共用設定：automation/ 與 analysis/ 的模組都是以腳本目錄為匯入路徑 (例如 `from orchestrator import ...`)，
+這裡比照加入 sys.path。
+"""
+
+import logging
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for sub in ("automation", "analysis"):
+    path = os.path.join(ROOT, sub)
+    if path not in sys.path: sys.path.insert(0, path)
+
+# pipeline_manager 匯入時以 basicConfig 掛上 pipeline_debug.log (mode='w')；root 已有 Handler 時 basicConfig 不動作，
+# 避免測試寫入或清空 Control Node 上真正的執行紀錄
+logging.getLogger().addHandler(logging.NullHandler())
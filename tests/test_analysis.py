@@ -0,0 +1,202 @@
+"""
+以產生的小型 pcap 驗證 analysis/：Flow 萃取 (雙向封包數、idle timeout 切分、逐批寫出)、pcap_index 查詢與 demux 輸出。
+"""
+
+import os
+import struct
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pq = pytest.importorskip("pyarrow.parquet")
+
+import demux
+import extract_flows
+import pcap_index
+from pcap_reader import PcapFile
+
+T0 = 1_700_000_000
+CLIENT, PEER, WEB, DNS = "10.0.1.5", "10.0.1.6", "93.184.216.34", "8.8.8.8"
+WORKER1, WORKER2 = "172.24.75.102", "172.24.75.103"
+SYN, ACK, PSH = 0x02, 0x10, 0x08
+
+
+def ipv4(addr):
+    return bytes(int(x) for x in addr.split("."))
+
+
+def ip_packet(src, dst, sport, dport, proto=6, flags=ACK, payload=b""):
+    """Ethernet + IPv4 + TCP / UDP"""
+    if proto == 6:
+        l4 = struct.pack("!HHIIBBHHH", sport, dport, 0, 0, 5 << 4, flags, 65535, 0, 0) + payload
+    else:
+        l4 = struct.pack("!HHHH", sport, dport, 8 + len(payload), 0) + payload
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(l4), 0, 0, 64, proto, 0, ipv4(src), ipv4(dst)) + l4
+    return b"\x02\x42\xac\x11\x00\x02" + b"\x02\x42\xac\x11\x00\x03" + b"\x08\x00" + ip
+
+
+def vxlan_packet(inner):
+    """Overlay 流量：Worker 之間的 UDP 4789 封裝整個內層 Ethernet frame"""
+    return ip_packet(WORKER1, WORKER2, 51000, 4789, proto=17, payload=struct.pack("!II", 0x08000000, 4096 << 8) + inner)
+
+
+def write_pcap(path, records):
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        for ts, frame in records:
+            sec, usec = divmod(round(ts * 1_000_000), 1_000_000)
+            f.write(struct.pack("<IIII", T0 + sec, usec, len(frame), len(frame)) + frame)
+
+
+# (時間, frame)：HTTPS 交談在 200 秒閒置後再次出現 (idle timeout 120 秒 -> 兩個 Flow)
+RECORDS = [
+    (0.0, ip_packet(CLIENT, WEB, 40000, 443, flags=SYN)),
+    (0.1, ip_packet(WEB, CLIENT, 443, 40000, flags=SYN | ACK)),
+    (0.2, ip_packet(CLIENT, WEB, 40000, 443)),
+    (0.3, ip_packet(CLIENT, WEB, 40000, 443, flags=PSH | ACK, payload=b"q" * 100)),
+    (0.4, ip_packet(WEB, CLIENT, 443, 40000, flags=PSH | ACK, payload=b"r" * 500)),
+    (1.0, ip_packet(PEER, DNS, 50000, 53, proto=17, payload=b"d" * 30)),
+    (1.05, ip_packet(DNS, PEER, 53, 50000, proto=17, payload=b"d" * 46)),
+    (2.0, vxlan_packet(ip_packet(CLIENT, PEER, 41000, 80, flags=SYN))),
+    (2.1, vxlan_packet(ip_packet(PEER, CLIENT, 80, 41000, flags=SYN | ACK))),
+    (3.0, b"\xff" * 6 + b"\x02" * 6 + b"\x08\x06" + b"\x00" * 28),   # ARP：不是 IP，各工具都應略過
+    (200.0, ip_packet(CLIENT, WEB, 40000, 443, flags=PSH | ACK, payload=b"q" * 10)),
+    (200.5, ip_packet(WEB, CLIENT, 443, 40000)),
+]
+
+
+@pytest.fixture
+def capture(tmp_path):
+    path = tmp_path / "round3_20260101_120000_worker1.pcap"
+    write_pcap(path, RECORDS)
+    return str(path)
+
+
+def count_packets(path):
+    with PcapFile(path) as pcap:
+        return sum(len(offsets) for offsets in pcap.record_offsets())
+
+
+# ---------- extract_flows ----------
+
+def flow_rows(path):
+    table = pq.read_table(path)
+    rows = table.to_pylist()
+    return sorted(rows, key=lambda r: (r["start_time"], r["src_port"]))
+
+
+def test_extract_flows_directions_and_idle_split(capture, tmp_path):
+    _, packets, flows, _ = extract_flows.process_file(capture, str(tmp_path / "flows"), idle_timeout=120)
+    dst = extract_flows.output_path(capture, str(tmp_path / "flows"))
+    assert dst.endswith(os.path.join("round=3", "worker=worker1", "round3_20260101_120000_worker1.parquet"))
+    assert (packets, flows) == (12, 4)
+
+    summary = [(r["proto"], r["src_ip"], r["src_port"], r["dst_ip"], r["dst_port"], r["fwd_packets"], r["bwd_packets"])
+               for r in flow_rows(dst)]
+    assert summary == [
+        (6, CLIENT, 40000, WEB, 443, 3, 2),      # 發起端 = 第一個封包 (SYN) 的來源
+        (17, PEER, 50000, DNS, 53, 1, 1),
+        (6, CLIENT, 41000, PEER, 80, 1, 1),      # VXLAN 內層位址
+        (6, CLIENT, 40000, WEB, 443, 1, 1),      # 閒置 200 秒後的同一組 5-tuple 是新的 Flow
+    ]
+    first = flow_rows(dst)[0]
+    assert (first["fwd_payload"], first["bwd_payload"], first["syn_count"]) == (100, 500, 2)
+    assert first["duration"] == pytest.approx(0.4)
+    assert first["iat_mean"] == pytest.approx(0.1)
+
+
+def test_extract_flows_longer_idle_timeout_merges(capture, tmp_path):
+    _, _, flows, _ = extract_flows.process_file(capture, str(tmp_path), idle_timeout=300)
+    https = [r for r in flow_rows(extract_flows.output_path(capture, str(tmp_path))) if r["dst_port"] == 443]
+    assert flows == 3
+    assert [(r["fwd_packets"], r["bwd_packets"]) for r in https] == [(4, 3)]
+
+
+def test_extract_flows_evicts_idle_flows_in_small_batches(tmp_path):
+    """小批次、門檻極低：已閒置的 Flow 在合併時逐批寫出，結果與一次處理相同"""
+    path = str(tmp_path / "round1_20260101_000000_worker1.pcap")
+    records = []
+    for i in range(10):   # 每 200 秒一組 DNS 查詢 / 回應 (同一組 5-tuple)，外加一條持續進行的 TCP 連線
+        records += [(i * 200.0, ip_packet(PEER, DNS, 50000, 53, proto=17, payload=b"d" * 30)),
+                    (i * 200.0 + 0.05, ip_packet(DNS, PEER, 53, 50000, proto=17, payload=b"d" * 46)),
+                    (i * 200.0 + 0.1, ip_packet(CLIENT, WEB, 40000, 443))]
+    write_pcap(path, records)
+
+    extract_flows.process_file(path, str(tmp_path / "whole"), idle_timeout=120)
+    _, _, flows, _ = extract_flows.process_file(path, str(tmp_path / "small"), idle_timeout=120,
+                                                batch_size=3, compact_rows=1)
+    small = extract_flows.output_path(path, str(tmp_path / "small"))
+    assert flows == 10 + 10   # TCP 封包間隔也是 200 秒，同樣每次都是新的 Flow
+    assert pq.ParquetFile(small).num_row_groups > 1
+    assert flow_rows(small) == flow_rows(extract_flows.output_path(path, str(tmp_path / "whole")))
+
+
+def test_extract_flows_empty_capture(tmp_path):
+    path = str(tmp_path / "round1_20260101_000000_worker2.pcap")
+    write_pcap(path, [])
+    _, packets, flows, _ = extract_flows.process_file(path, str(tmp_path))
+    assert (packets, flows) == (0, 0)
+    assert pq.read_table(extract_flows.output_path(path, str(tmp_path))).num_rows == 0
+
+
+# ---------- pcap_index ----------
+
+def test_index_select_and_slice(capture, tmp_path):
+    _, packets, flows, _ = pcap_index.build_index(capture)
+    assert (packets, flows) == (12, 3)   # 索引不切 idle timeout：同一組 5-tuple 只有一個 Flow
+    assert pcap_index.is_up_to_date(capture)
+
+    out = str(tmp_path / "out.pcap")
+    assert pcap_index.select_packets(capture, out, host=WEB) == 7
+    assert count_packets(out) == 7
+    assert pcap_index.select_packets(capture, out, proto=pcap_index.PROTO_NAMES["udp"], port=53) == 2
+    assert pcap_index.select_packets(capture, out, host=PEER, proto=6) == 2   # VXLAN 內層
+    assert pcap_index.select_packets(capture, out, host="192.0.2.1") == 0
+    assert count_packets(out) == 0
+
+    flows = pcap_index.list_flows(capture, host=CLIENT)
+    summary = sorted(((n, proto, {port_a, port_b}) for proto, _, port_a, _, port_b, n in flows), key=lambda f: f[0])
+    assert summary == [(2, 6, {80, 41000}), (7, 6, {443, 40000})]
+
+    start = (T0 + 199) * 1_000_000_000
+    assert pcap_index.slice_time(capture, start, start + 5 * 1_000_000_000, out) == 2
+    with PcapFile(out) as pcap:
+        ts_ns, _, _ = pcap.read_headers(next(pcap.record_offsets()))
+    assert ts_ns.tolist() == [(T0 + 200) * 1_000_000_000, (T0 + 200) * 1_000_000_000 + 500_000_000]
+
+
+def test_index_is_rebuilt_when_capture_changes(capture):
+    pcap_index.build_index(capture)
+    write_pcap(capture, RECORDS[:5])
+    os.utime(capture, ns=(0, 0))
+    assert not pcap_index.is_up_to_date(capture)
+    assert int(pcap_index.load_index(capture)["flow_ptr"][-1]) == 5
+
+
+# ---------- demux ----------
+
+def test_demux_per_container_ip_and_protocol(capture, tmp_path):
+    _, packets, streams, _ = demux.demux_file(capture, str(tmp_path), container_net="10.0.0.0/8")
+    assert packets == 12
+    assert streams == {
+        os.path.join("ip", f"{CLIENT}.pcap"): 9,     # HTTPS 7 + Overlay HTTP 2
+        os.path.join("ip", f"{PEER}.pcap"): 4,       # DNS 2 + Overlay HTTP 2
+        os.path.join("proto", "https.pcap"): 7,
+        os.path.join("proto", "dns.pcap"): 2,
+        os.path.join("proto", "http.pcap"): 2,
+    }
+    dst = demux.output_dir(capture, str(tmp_path))
+    for name, n in streams.items():
+        assert count_packets(os.path.join(dst, name)) == n
+    assert not os.path.exists(dst + ".tmp")
+
+    # 輸出保留原始 record (含 VXLAN 封裝)，依原檔順序
+    with open(capture, "rb") as f: original = f.read()
+    with open(os.path.join(dst, "proto", "http.pcap"), "rb") as f: http = f.read()
+    assert http[:24] == original[:24]
+    assert http[24:] in original
+
+
+def test_demux_container_net_filter(capture, tmp_path):
+    _, _, streams, _ = demux.demux_file(capture, str(tmp_path), container_net=f"{PEER}/32")
+    assert {name for name in streams if name.startswith("ip")} == {os.path.join("ip", f"{PEER}.pcap")}
@@ -0,0 +1,303 @@
+"""
+Orchestrator 以注入的 connector 取代 asyncssh：驗證結果格式、併發、逾時與連線錯誤，
+以及 pipeline_manager 經由 remote_shell 使用這些結果的錯誤處理 (ensure_service_scale / cleanup_on_exit)。
+"""
+
+import asyncio
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+import pipeline_manager as pm
+from orchestrator import HostResult, Inventory, Orchestrator
+
+INVENTORY = """\
+[managers]
+manager1 ansible_host=192.0.2.10
+
+[workers]
+worker1 ansible_host=192.0.2.11 ansible_user=traffic-gen-1
+worker2 ansible_host=192.0.2.12
+worker3 ansible_host=192.0.2.13
+
+[cluster:children]
+managers
+workers
+
+[all:vars]
+ansible_user=traffic-gen
+ansible_ssh_common_args='-o StrictHostKeyChecking=no'
+"""
+
+
+class FakeConn:
+    def __init__(self, cluster, host):
+        self.cluster = cluster
+        self.host = host
+        self.closed = False
+
+    async def run(self, command, input=None, check=False):
+        cluster = self.cluster
+        cluster.commands.append((self.host, command, input))
+        cluster.active[self.host] += 1
+        cluster.max_active = max(cluster.max_active, sum(cluster.active.values()))
+        cluster.max_per_host[self.host] = max(cluster.max_per_host[self.host], cluster.active[self.host])
+        try:
+            await asyncio.sleep(cluster.delay)
+            rc, stdout, stderr = cluster.handler(self.host, command)
+        finally:
+            cluster.active[self.host] -= 1
+        return SimpleNamespace(exit_status=rc, stdout=stdout, stderr=stderr)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCluster:
+    """可注入 Orchestrator 的 connector：handler(host, command) 回傳 (rc, stdout, stderr) 或拋出連線層例外"""
+
+    def __init__(self, handler=None, delay=0.0, unreachable=()):
+        self.handler = handler or (lambda host, command: (0, f"{host} ok\n", ""))
+        self.delay = delay
+        self.unreachable = set(unreachable)
+        self.commands = []
+        self.conns = []
+        self.connects = Counter()
+        self.active = Counter()
+        self.max_per_host = Counter()
+        self.max_active = 0
+
+    async def __call__(self, host_vars):
+        host = host_vars["inventory_hostname"]
+        self.connects[host] += 1
+        if host in self.unreachable: raise OSError(f"connect to {host_vars['ansible_host']} refused")
+        conn = FakeConn(self, host)
+        self.conns.append(conn)
+        return conn
+
+    def sent(self, host):
+        return [command for h, command, _ in self.commands if h == host]
+
+
+@pytest.fixture
+def inventory(tmp_path):
+    path = tmp_path / "inventory.ini"
+    path.write_text(INVENTORY, encoding="utf-8")
+    return Inventory(str(path))
+
+
+@pytest.fixture
+def make_orchestrator(inventory):
+    created = []
+
+    def make(cluster, become_password="secret"):
+        orchestrator = Orchestrator(inventory, become_password=become_password, connector=cluster)
+        created.append(orchestrator)
+        return orchestrator
+
+    yield make
+    for orchestrator in created: orchestrator.close()
+
+
+# ---------- Inventory ----------
+
+def test_inventory_groups_children_and_vars(inventory):
+    assert inventory.resolve("workers") == ["worker1", "worker2", "worker3"]
+    assert inventory.resolve("cluster") == ["manager1", "worker1", "worker2", "worker3"]
+    assert inventory.resolve("managers:worker2,worker2") == ["manager1", "worker2"]
+    assert inventory.resolve("nope") == []
+    assert inventory.vars_for("worker1")["ansible_user"] == "traffic-gen-1"
+    assert inventory.vars_for("worker2")["ansible_user"] == "traffic-gen"
+    assert inventory.vars_for("worker2")["ansible_ssh_common_args"] == "-o StrictHostKeyChecking=no"
+    assert inventory.hosts("managers") == {"manager1": "192.0.2.10"}
+
+
+# ---------- Orchestrator ----------
+
+def test_run_returns_structured_results(make_orchestrator):
+    cluster = FakeCluster(lambda host, command: (0, f"{host} up\n".encode(), b""))
+    results = make_orchestrator(cluster).run("workers", "uptime")
+
+    assert list(results) == ["worker1", "worker2", "worker3"]
+    for host, r in results.items():
+        assert isinstance(r, HostResult)
+        assert (r.host, r.rc, r.ok, r.error) == (host, 0, True, None)
+        assert r.stdout == f"{host} up"   # bytes 解碼並去掉結尾換行
+        assert r.elapsed >= 0
+    # 與 ansible -b 相同：以 sudo 執行，密碼由 stdin 傳入
+    host, command, stdin = cluster.commands[0]
+    assert command == "sudo -S -p '' sh -c uptime"
+    assert stdin == "secret\n"
+
+
+def test_become_false_runs_command_as_is(make_orchestrator):
+    cluster = FakeCluster()
+    make_orchestrator(cluster).run("worker1", "echo 'a b'", become=False)
+    assert cluster.commands == [("worker1", "echo 'a b'", None)]
+
+
+def test_nonzero_exit_is_a_result_not_an_error(make_orchestrator):
+    cluster = FakeCluster(lambda host, command: (1, "", "pgrep: no match\n"))
+    r = make_orchestrator(cluster).run("worker1", "pgrep -x tcpdump")["worker1"]
+    assert (r.rc, r.ok, r.error, r.stderr) == (1, False, None, "pgrep: no match")
+    assert cluster.connects["worker1"] == 1   # 非零 exit status 不會丟棄連線
+
+
+def test_hosts_run_concurrently_over_persistent_connections(make_orchestrator):
+    cluster = FakeCluster(delay=0.3)
+    orchestrator = make_orchestrator(cluster)
+    start = time.monotonic()
+    results = orchestrator.run("all", "true")
+    assert time.monotonic() - start < 0.3 * 2
+    assert all(r.ok for r in results.values()) and len(results) == 4
+    assert cluster.max_active == 4
+
+    orchestrator.run("all", "true")
+    assert set(cluster.connects.values()) == {1}   # 第二次沿用同一條連線
+
+
+def test_channels_per_host_are_capped(make_orchestrator):
+    cluster = FakeCluster(delay=0.05)
+    orchestrator = make_orchestrator(cluster)
+
+    async def burst():
+        return await asyncio.gather(*(orchestrator.run_async("worker1", f"echo {i}") for i in range(20)))
+
+    results = asyncio.run_coroutine_threadsafe(burst(), orchestrator._loop).result(10)
+    assert all(r["worker1"].ok for r in results)
+    assert cluster.max_per_host["worker1"] == Orchestrator.MAX_CHANNELS_PER_HOST
+    assert cluster.connects["worker1"] == 1   # 併發建立連線時也只連一次
+
+
+def test_unreachable_host_does_not_block_others(make_orchestrator):
+    cluster = FakeCluster(unreachable={"worker2"})
+    orchestrator = make_orchestrator(cluster)
+    assert orchestrator.connect_all("workers") == {"worker1": None, "worker2": "connect to 192.0.2.12 refused",
+                                                   "worker3": None}
+
+    results = orchestrator.run("workers", "true")
+    assert results["worker1"].ok and results["worker3"].ok
+    assert results["worker2"].rc is None and not results["worker2"].ok
+    assert "refused" in results["worker2"].error
+
+
+def test_dropped_connection_is_reconnected_once(make_orchestrator):
+    failures = iter([ConnectionResetError("connection lost")])
+
+    def handler(host, command):
+        for exc in failures: raise exc
+        return 0, "ok", ""
+
+    cluster = FakeCluster(handler)
+    r = make_orchestrator(cluster).run("worker1", "true")["worker1"]
+    assert r.ok and r.stdout == "ok"
+    assert cluster.connects["worker1"] == 2
+    assert cluster.conns[0].closed and not cluster.conns[1].closed
+
+
+def test_connection_error_after_retry_is_reported(make_orchestrator):
+    def handler(host, command):
+        raise ConnectionResetError("connection lost")
+
+    cluster = FakeCluster(handler)
+    r = make_orchestrator(cluster).run("worker1", "true")["worker1"]
+    assert r.rc is None and r.error == "connection lost"
+    assert cluster.connects["worker1"] == 2
+
+
+def test_per_host_timeout(make_orchestrator):
+    cluster = FakeCluster(delay=5)
+    start = time.monotonic()
+    r = make_orchestrator(cluster).run("worker1", "sleep 5", timeout=0.3)["worker1"]
+    assert time.monotonic() - start < 2
+    assert r.rc is None and r.error == "timeout after 0.3s"
+
+
+# ---------- pipeline_manager ----------
+
+def test_parse_ansible_output_matches_orchestrator_results():
+    output = (
+        "worker1 | CHANGED | rc=0 >>\n12345\n"
+        "worker2 | FAILED | rc=1 >>\n"
+        "non-zero return code\n"
+        "worker3 | UNREACHABLE! => {\n    \"msg\": \"ssh: connect to host\"\n}\n"
+    )
+    results = pm.parse_ansible_output(output)
+    assert (results["worker1"].rc, results["worker1"].stdout) == (0, "12345")
+    assert (results["worker2"].rc, results["worker2"].ok) == (1, False)
+    assert (results["worker3"].rc, results["worker3"].error, results["worker3"].stdout) == (None, "unreachable", "")
+    assert pm.parse_ansible_output(None) == {}
+
+
+@pytest.fixture
+def use_orchestrator(make_orchestrator, monkeypatch):
+    """pipeline_manager 的 remote_shell 改經由注入 connector 的 Orchestrator；重試間隔不等待"""
+    def install(cluster):
+        monkeypatch.setattr(pm, "ORCHESTRATOR", make_orchestrator(cluster))
+        return cluster
+
+    monkeypatch.setattr(pm.time, "sleep", lambda seconds: None)
+    return install
+
+
+def service_ls(replicas):
+    return ("ID             NAME                         MODE         REPLICAS   IMAGE\n"
+            f"k3x1           {pm.SERVICE_NAME}   replicated   {replicas}       traffic-bot:latest\n")
+
+
+def test_remote_shell_goes_through_orchestrator(use_orchestrator):
+    cluster = use_orchestrator(FakeCluster())
+    results = pm.remote_shell("workers", "pgrep -x tcpdump")
+    assert sorted(results) == ["worker1", "worker2", "worker3"]
+    assert pm.joined_stdout(results) == "worker1 ok\nworker2 ok\nworker3 ok"
+    assert len(cluster.commands) == 3
+
+
+def test_ensure_service_scale_confirms_desired_replicas(use_orchestrator):
+    cluster = use_orchestrator(FakeCluster(lambda host, command: (0, service_ls("3/12") if "service ls" in command else "", "")))
+    assert pm.ensure_service_scale(12)
+    sent = cluster.sent("manager1")
+    assert f"{pm.SERVICE_NAME}=12" in sent[0] and "docker service scale --detach" in sent[0]
+    assert len(sent) == 2 and not cluster.sent("worker1")
+
+
+def test_ensure_service_scale_retries_when_ignored(use_orchestrator):
+    cluster = use_orchestrator(FakeCluster(lambda host, command: (0, service_ls("3/3") if "service ls" in command else "", "")))
+    assert not pm.ensure_service_scale(12, max_retries=3)
+    assert sum("service scale" in c for c in cluster.sent("manager1")) == 3
+
+
+def test_ensure_service_scale_with_unreachable_manager(use_orchestrator):
+    cluster = use_orchestrator(FakeCluster(unreachable={"manager1"}))
+    assert not pm.ensure_service_scale(5, max_retries=2)
+    assert cluster.connects["manager1"] == 8   # 2 次重試 x (scale + ls) x 每個指令重連一次
+
+
+def test_cleanup_on_exit_survives_unreachable_manager(use_orchestrator, monkeypatch):
+    cluster = use_orchestrator(FakeCluster(unreachable={"manager1"}))
+    fetches = []
+    monkeypatch.setattr(pm, "ACTIVE_ROUND", None)
+    monkeypatch.setattr(pm, "run_cmd_stream", lambda cmd, description="": fetches.append((cmd, description)) or True)
+
+    pm.cleanup_on_exit()
+    assert all("pkill tcpdump" in cluster.sent(h)[0] for h in ("worker1", "worker2", "worker3"))
+    assert len(fetches) == 1 and fetches[0][1] == "Emergency Fetch"
+    assert any(arg.endswith("stop_and_fetch.yml") for arg in fetches[0][0])
+
+
+def test_cleanup_on_exit_continues_when_remote_shell_raises(monkeypatch):
+    calls, fetches = [], []
+
+    def remote_shell(pattern, command, timeout=60):
+        calls.append(pattern)
+        raise TimeoutError("orchestrator did not answer")
+
+    monkeypatch.setattr(pm, "remote_shell", remote_shell)
+    monkeypatch.setattr(pm, "ACTIVE_ROUND", None)
+    monkeypatch.setattr(pm, "run_cmd_stream", lambda cmd, description="": fetches.append(description) or True)
+
+    pm.cleanup_on_exit()
+    assert calls == ["managers", "workers"]
+    assert fetches == ["Emergency Fetch"]